@@ -19,6 +19,12 @@
 #   Riptide will try to add a group with this id (named riptide; only if not already exists)
 #   and add $RIPTIDE__DOCKER_USER to this group.
 #
+# RIPTIDE__DOCKER_USER_ENTRIES:
+#   If set (together with RIPTIDE__DOCKER_USER and RIPTIDE__DOCKER_GROUP), the engine already generated the user
+#   and group entries and mounted them at /riptide_users: /etc/passwd and /etc/group are replaced with the files
+#   passwd and group there, the file user contains the name and home directory of the user (one per line).
+#   No user management tools are run then.
+#
 # RIPTIDE__DOCKER_RUN_MAIN_CMD_AS_USER:
 #   If set, the original entrypoint and command are run via the RIPTIDE__DOCKER_USER_RUN user using su.
 #
@@ -39,10 +45,20 @@
 # RIPTIDE__DOCKER_CMD_LOGGING_*:
 #   Command logging.
 #   All the vlaues of these environment variables will be started and their stdout redirected to /cmd_logs/*.
+#   They are restarted (with backoff) if they exit, see supervise_logging_commands.
+#
+# RIPTIDE__DOCKER_LOG_ROTATE:
+#   List of log files written by this script (/riptide_stdout, /riptide_stderr, /cmd_logs/*), separated by :.
+#   Each entry has the form <path in container>=<file name in /riptide_logs>. /riptide_logs is the mounted host
+#   directory containing the logs. If set, a background loop checks the sizes every
+#   RIPTIDE__DOCKER_LOG_ROTATE_INTERVAL seconds (default 30). Logs larger than RIPTIDE__DOCKER_LOG_MAX_SIZE bytes
+#   are copied to /riptide_logs/<file name>.1.gz and truncated in place. RIPTIDE__DOCKER_LOG_KEEP (default 3)
+#   rotated files are kept.
 #
-# RIPTIDE__DOCKER_HOST_SYSTEM_HOSTNAMES:
-#   List of hostnames to add to the /etc/hosts. These hostnames must be routable to the host
-#   system.
+# RIPTIDE__DOCKER_HOSTS_SYNC_ONLY:
+#   If set, only the hosts file fragment at /riptide_hosts/hosts is merged into /etc/hosts, nothing else is done.
+#   The fragment contains the hostnames that must be routable to the host system, they are added with the
+#   address of host.riptide.internal. This is done on every start and by the engine whenever the fragment changes.
 #
 # RIPTIDE__DOCKER_OVERLAY_TARGETS:
 #   Paths at these locations (separated by :), will be mounted via an overlayfs. Paths must be absolute.
@@ -50,14 +66,70 @@
 #   at the position in src with the lower part being the bind mount created in /riptide_overlayfs/lower.
 #   Upper and workdirs are created in /riptide_overlayfs/tmp/upper and /riptide_overlayfs/tmp/work respecitively.
 #   upper and work are kept in memory using tmpfs. Regular tmpfs restrictions apply.
+#   The size of the tmpfs can be limited with RIPTIDE__DOCKER_OVERLAY_TMPFS_SIZE (tmpfs size option).
+#   If RIPTIDE__DOCKER_OVERLAY_PERSISTENT is set, a (named volume) mount already exists at /riptide_overlayfs/tmp
+#   and is used instead of the tmpfs, so that upper and work survive restarts.
+#   If not on Linux, the targets are chowned recursively (in the overlay, the files of the host stay untouched).
+#   This is recorded in an ownership stamp file next to upper and work (/riptide_overlayfs/tmp/stamps/<target>,
+#   containing owner and RIPTIDE__DOCKER_CHOWN_STAMP_VERSION) and skipped on the next start if the stamp matches.
+#   Stamps are only written if RIPTIDE__DOCKER_OVERLAY_PERSISTENT is set, in the tmpfs they would not survive.
+#
+# RIPTIDE__DOCKER_CHOWN_STAMP_VERSION:
+#   Version of the ownership stamps, see RIPTIDE__DOCKER_OVERLAY_TARGETS. Changing it invalidates all stamps.
+#
+# RIPTIDE__DOCKER_CHOWN_VERIFY_DEPTH:
+#   (optional, defaults to 2)
+#   If an ownership stamp matches, the first levels (up to this depth) of the target are still checked for
+#   files with a different owner. If any are found, the target is chowned again. 0 disables this check.
 #
 # RIPTIDE__DOCKER_ON_LINUX:
 #   "1": Docker is running natively on Linux
 #   "0": Docker is running via a Linux VM.
 #
+# Timings:
+#   The end of each phase of this script is recorded in /riptide_timings, one line "<phase> <uptime>" each,
+#   using the (monotonic) system uptime. The file is rewritten on every start and read by the engine.
+#
 # RIPTIDE__USE_RIPSU:
 #   If set, use ripsu instead of su whereever su would be used
 
+# Merge the hostnames of the hosts file fragment into /etc/hosts (replacing the previously merged line)
+sync_hosts() {
+    if [ ! -f /riptide_hosts/hosts ]; then
+        return
+    fi
+    read -r HOSTS_FRAGMENT < /riptide_hosts/hosts
+    HOST_IP=""
+    NEW_HOSTS=""
+    while IFS= read -r line; do
+        case "$line" in
+            *"# riptide-hosts") continue ;;
+        esac
+        NEW_HOSTS="$NEW_HOSTS$line
+"
+        if [ -z "$HOST_IP" ]; then
+            case "$line" in
+                *[[:space:]]host.riptide.internal | *[[:space:]]host.riptide.internal[[:space:]]*)
+                    HOST_IP="${line%%[[:space:]]*}" ;;
+            esac
+        fi
+    done < /etc/hosts
+    # /etc/hosts is a bind mount, it must be written in place.
+    printf '%s%s  %s # riptide-hosts\n' "$NEW_HOSTS" "${HOST_IP:-172.17.0.1}" "$HOSTS_FRAGMENT" > /etc/hosts
+}
+if [ ! -z "$RIPTIDE__DOCKER_HOSTS_SYNC_ONLY" ]; then
+    sync_hosts
+    exit 0
+fi
+
+# Record the end of the phase $1 of this script, see Timings above
+timing() {
+    read -r TIMING_UPTIME TIMING_REST < /proc/uptime
+    echo "$1 $TIMING_UPTIME" >> /riptide_timings
+}
+read -r TIMING_UPTIME TIMING_REST < /proc/uptime
+echo "start $TIMING_UPTIME" > /riptide_timings
+
 if [ -z "$RIPTIDE__DOCKER_NO_STDOUT_REDIRECT" ]
 then
     # redirect stdout and stderr to files
@@ -71,19 +143,112 @@ then
     >&2 echo $echo
 fi
 
-# Start logging commands, prefixed RIPTIDE__DOCKER_CMD_LOGGING_
-env | sed -n "s/^RIPTIDE__DOCKER_CMD_LOGGING_\(\S*\)=.*/\1/p" | while read -r name ; do
-    eval "cmd=\${RIPTIDE__DOCKER_CMD_LOGGING_${name}}"
-    # XXX: Currently waiting 5sec for service to start, make configurable?
-    # The infinite sleep is required, because in some instances, the main command
-    #   will exit otherwise if a logging command exits.
-    nohup sh -c "sleep 5; ${cmd}; sleep infinity" > /cmd_logs/${name} &
-done
+# Supervise the logging commands, prefixed RIPTIDE__DOCKER_CMD_LOGGING_.
+# All commands are started right away. Whenever one exits (e.g. because the service wasn't ready yet), it is
+# restarted with exponential backoff (1s up to 32s; reset after it ran for at least 60s).
+# The commands are children of this one supervisor process (and not of the main command, which might exit
+# otherwise if a logging command exits), no other processes are kept around.
+supervise_logging_commands() {
+    COUNT=0
+    for name in $1; do
+        COUNT=$((COUNT + 1))
+        eval "NAME_$COUNT=\$name; PID_$COUNT=''; NEXT_$COUNT=0; BACKOFF_$COUNT=1; STARTED_$COUNT=0"
+    done
+    NOW=0
+    while true; do
+        # Reap exited commands
+        jobs > /dev/null
+        i=1
+        while [ "$i" -le "$COUNT" ]; do
+            eval "name=\$NAME_$i; pid=\$PID_$i; next=\$NEXT_$i; backoff=\$BACKOFF_$i; started=\$STARTED_$i"
+            if [ ! -z "$pid" ] && ! kill -0 "$pid" 2> /dev/null; then
+                # Exited, schedule the restart
+                if [ $((NOW - started)) -ge 60 ]; then
+                    backoff=1
+                fi
+                next=$((NOW + backoff))
+                backoff=$((backoff * 2))
+                if [ "$backoff" -gt 32 ]; then
+                    backoff=32
+                fi
+                pid=""
+            fi
+            if [ -z "$pid" ] && [ "$NOW" -ge "$next" ]; then
+                eval "cmd=\${RIPTIDE__DOCKER_CMD_LOGGING_${name}}"
+                sh -c "$cmd" >> "/cmd_logs/$name" &
+                pid=$!
+                started=$NOW
+            fi
+            eval "PID_$i=\$pid; NEXT_$i=\$next; BACKOFF_$i=\$backoff; STARTED_$i=\$started"
+            i=$((i + 1))
+        done
+        sleep 1
+        NOW=$((NOW + 1))
+    done
+}
+LOGGING_COMMANDS=$(env | sed -n "s/^RIPTIDE__DOCKER_CMD_LOGGING_\(\S*\)=.*/\1/p")
+if [ ! -z "$LOGGING_COMMANDS" ]; then
+    supervise_logging_commands "$LOGGING_COMMANDS" < /dev/null &
+fi
+
+# Rotate logs that got too large. The logs are appended to, so copying and then truncating them is safe.
+rotate_logs() {
+    KEEP=${RIPTIDE__DOCKER_LOG_KEEP:-3}
+    while true; do
+        sleep ${RIPTIDE__DOCKER_LOG_ROTATE_INTERVAL:-30}
+        OLD_IFS=$IFS
+        IFS=':'
+        for entry in $RIPTIDE__DOCKER_LOG_ROTATE; do
+            IFS=$OLD_IFS
+            f="${entry%%=*}"
+            rotated="/riptide_logs/${entry#*=}"
+            if [ -f "$f" ] && [ "$(wc -c < "$f")" -gt "$RIPTIDE__DOCKER_LOG_MAX_SIZE" ]; then
+                i=$KEEP
+                rm -f "$rotated.$i.gz"
+                while [ "$i" -gt 1 ]; do
+                    prev=$((i - 1))
+                    if [ -f "$rotated.$prev.gz" ]; then
+                        mv "$rotated.$prev.gz" "$rotated.$i.gz"
+                    fi
+                    i=$prev
+                done
+                if [ "$KEEP" -gt 0 ]; then
+                    gzip -c "$f" > "$rotated.1.gz"
+                fi
+                : > "$f"
+            fi
+        done
+        IFS=$OLD_IFS
+    done
+}
+if [ ! -z "$RIPTIDE__DOCKER_LOG_ROTATE" ] && [ ! -z "$RIPTIDE__DOCKER_LOG_MAX_SIZE" ]; then
+    rotate_logs > /dev/null 2>&1 &
+fi
+timing logging
 
 # Create user and group
 SU_PREFIX=""
 SU_POSTFIX=""
-if [ ! -z "$RIPTIDE__DOCKER_USER" ]; then
+if [ ! -z "$RIPTIDE__DOCKER_USER" ] && [ ! -z "$RIPTIDE__DOCKER_USER_ENTRIES" ]; then
+    # User and group entries generated by the engine
+    cat /riptide_users/passwd > /etc/passwd
+    cat /riptide_users/group > /etc/group
+    { read -r RIPTIDE__DOCKER_USERNAME; read -r RIPTIDE__DOCKER_HOME; } < /riptide_users/user
+    USERNAME=$RIPTIDE__DOCKER_USERNAME
+    if [ ! -e /home/riptide ]; then
+        if [ "$RIPTIDE__DOCKER_HOME" = "/home/riptide" ]; then
+            mkdir -p /home/riptide
+            chown $RIPTIDE__DOCKER_USER:$RIPTIDE__DOCKER_GROUP /home/riptide
+        else
+            # Symlink the other user directory to /home/riptide
+            mkdir -p /home
+            ln -s "$RIPTIDE__DOCKER_HOME" /home/riptide
+        fi
+    fi
+    if [ -z "$RIPTIDE__DOCKER_USER_RUN" ]; then
+        RIPTIDE__DOCKER_USER_RUN=$RIPTIDE__DOCKER_USER
+    fi
+elif [ ! -z "$RIPTIDE__DOCKER_USER" ]; then
     # ADD GROUP
     if ! grep -q $RIPTIDE__DOCKER_GROUP /etc/group; then
         # groupadd might be called addgroup (alpine)
@@ -120,29 +285,64 @@ if [ ! -z "$RIPTIDE__DOCKER_USER" ]; then
         RIPTIDE__DOCKER_USER_RUN=$RIPTIDE__DOCKER_USER
     fi
 fi
+timing users
+
+if [ ! -z "$RIPTIDE__DOCKER_GROUP" ]; then
+  OWNER="$RIPTIDE__DOCKER_USER_RUN:$RIPTIDE__DOCKER_GROUP"
+else
+  OWNER="$RIPTIDE__DOCKER_USER_RUN"
+fi
+
+# Chown all provided volume paths (with one chown call)
+if [ ! -z "$RIPTIDE__DOCKER_NAMED_VOLUMES" ]; then
+  OLD_IFS=$IFS
+  IFS=':'
+  chown "$OWNER" $RIPTIDE__DOCKER_NAMED_VOLUMES
+  IFS=$OLD_IFS
+fi
+timing chown
 
-# Chown all provided volume paths
-OLD_IFS=$IFS
-IFS=':'
-for p in $RIPTIDE__DOCKER_NAMED_VOLUMES; do
-  if [ ! -z "$RIPTIDE__DOCKER_GROUP" ]; then
-    chown $RIPTIDE__DOCKER_USER_RUN:$RIPTIDE__DOCKER_GROUP $p
-  else
-    chown $RIPTIDE__DOCKER_USER_RUN $p
-  fi
-done
-IFS=$OLD_IFS
+# Recursively chown the directory $1 to $OWNER, unless its ownership stamp (file $2) shows that this was already
+# done and a check of the first levels doesn't find any drift.
+chown_stamped() {
+    STAMP_FILE="$2"
+    STAMP="$OWNER $RIPTIDE__DOCKER_CHOWN_STAMP_VERSION"
+    OLD_STAMP=""
+    if [ -f "$STAMP_FILE" ]; then
+        read -r OLD_STAMP < "$STAMP_FILE"
+    fi
+    if [ "$OLD_STAMP" = "$STAMP" ]; then
+        VERIFY_DEPTH=${RIPTIDE__DOCKER_CHOWN_VERIFY_DEPTH:-2}
+        if [ "$VERIFY_DEPTH" = "0" ]; then
+            return
+        fi
+        if [ ! -z "$RIPTIDE__DOCKER_GROUP" ]; then
+            DRIFT=$(find "$1" -maxdepth "$VERIFY_DEPTH" \( ! -user "$RIPTIDE__DOCKER_USER_RUN" -o ! -group "$RIPTIDE__DOCKER_GROUP" \) -print | head -n 1)
+        else
+            DRIFT=$(find "$1" -maxdepth "$VERIFY_DEPTH" ! -user "$RIPTIDE__DOCKER_USER_RUN" -print | head -n 1)
+        fi
+        if [ -z "$DRIFT" ]; then
+            return
+        fi
+    fi
+    chown -R "$OWNER" "$1" && mkdir -p "$(dirname "$STAMP_FILE")" && echo "$STAMP" > "$STAMP_FILE"
+}
 
 # Apply overlayfs settings
 apply_overlayfs() {
-    mkdir /riptide_overlayfs
-    mkdir /riptide_overlayfs/tmp
-    mkdir /riptide_overlayfs/tmp/upper
-    mkdir /riptide_overlayfs/tmp/work
-    mount -t tmpfs none "/riptide_overlayfs/tmp"
+    mkdir -p /riptide_overlayfs/tmp
+    if [ -z "$RIPTIDE__DOCKER_OVERLAY_PERSISTENT" ]; then
+        if [ ! -z "$RIPTIDE__DOCKER_OVERLAY_TMPFS_SIZE" ]; then
+            mount -t tmpfs -o "size=$RIPTIDE__DOCKER_OVERLAY_TMPFS_SIZE" none "/riptide_overlayfs/tmp"
+        else
+            mount -t tmpfs none "/riptide_overlayfs/tmp"
+        fi
+    fi
     OLD_IFS=$IFS
     IFS=':'
     for p in $1; do
+        # Only for splitting the list, $OWNER contains ":".
+        IFS=$OLD_IFS
         if [ -d "$p" ]; then
             l="/riptide_overlayfs/lower$p"
             u="/riptide_overlayfs/tmp/upper$p"
@@ -151,17 +351,19 @@ apply_overlayfs() {
             mkdir -p "$u"
             mkdir -p "$w"
             mount --bind "$p" "$l"
-            mount -t overlay overlay -o "lowerdir=$l,upperdir=$u,workdir=$w" $p
+            mount -t overlay overlay -o "lowerdir=$l,upperdir=$u,workdir=$w" "$p"
             # Because of the weird osxfs under Mac and propably also under Windows,
-            # we have to properly set all permissions for these subdirectories
-            RECURSIVE_FLAG=""
+            # we have to properly set all permissions for these subdirectories.
+            # This is done in the overlay (the upper directory), so the files on the host are not changed.
             if [ ! "$RIPTIDE__DOCKER_ON_LINUX" = "1" ]; then
-              RECURSIVE_FLAG="-R"
-            fi
-            if [ ! -z "$RIPTIDE__DOCKER_GROUP" ]; then
-              chown $RIPTIDE__DOCKER_USER_RUN:$RIPTIDE__DOCKER_GROUP $p $RECURSIVE_FLAG
+              if [ ! -z "$RIPTIDE__DOCKER_OVERLAY_PERSISTENT" ]; then
+                chown_stamped "$p" "/riptide_overlayfs/tmp/stamps$p/.riptide_owner"
+              else
+                # A stamp in the tmpfs would be lost on the next start anyway.
+                chown -R "$OWNER" "$p"
+              fi
             else
-              chown $RIPTIDE__DOCKER_USER_RUN $p $RECURSIVE_FLAG
+              chown "$OWNER" "$p"
             fi
         fi
     done
@@ -170,10 +372,15 @@ apply_overlayfs() {
 if [ ! -z "$RIPTIDE__DOCKER_OVERLAY_TARGETS" ]; then
     apply_overlayfs $RIPTIDE__DOCKER_OVERLAY_TARGETS
 fi
+timing overlayfs
 
 # PREPARE SU COMMAND AND ENV
 if [ ! -z "$RIPTIDE__DOCKER_RUN_MAIN_CMD_AS_USER" ]; then
-    USERNAME=$(getent passwd "$RIPTIDE__DOCKER_USER_RUN" | cut -d: -f1)
+    if [ "$RIPTIDE__DOCKER_USER_RUN" = "$RIPTIDE__DOCKER_USER" ] && [ ! -z "$RIPTIDE__DOCKER_USERNAME" ]; then
+        USERNAME=$RIPTIDE__DOCKER_USERNAME
+    else
+        USERNAME=$(getent passwd "$RIPTIDE__DOCKER_USER_RUN" | cut -d: -f1)
+    fi
     if [ ! -z "$RIPTIDE__USE_RIPSU" ]; then
       SU_PREFIX="/ripsu $USERNAME "
       SU_POSTFIX=""
@@ -184,29 +391,9 @@ if [ ! -z "$RIPTIDE__DOCKER_RUN_MAIN_CMD_AS_USER" ]; then
     export HOME=/home/riptide
 fi
 
-# host.riptide.internal is supposed to be routable to the host.
-if [ "$RIPTIDE__DOCKER_ON_LINUX" = "1" ]; then
-    # TODO Resolve IP dynamically
-    POSSIBLE_IP="172.17.0.1"
-else
-    LOOP=0
-    while [ -z "$POSSIBLE_IP" ]; do
-        POSSIBLE_IP="$(getent hosts host.docker.internal | awk '{ print $1 }')"
-        LOOP=$(expr $LOOP + 1)
-        if [ "$LOOP" = "10" ]; then
-            echo "Riptide: Trying to determine host IP address... this is taking way longer than it should..."
-        fi
-        if [ "$LOOP" = "100" ]; then
-            echo "Riptide: Failed to determine host IP address... giving up. The container might not be able to reach the host system!"
-            POSSIBLE_IP="172.17.0.1"
-        fi
-    done
-fi
-
-# Add all host entries passed in to the /etc/hosts file
-if [ ! -z "$RIPTIDE__DOCKER_HOST_SYSTEM_HOSTNAMES" ]; then
-    echo "$POSSIBLE_IP  $RIPTIDE__DOCKER_HOST_SYSTEM_HOSTNAMES" >> /etc/hosts
-fi
+# Add all hostnames that must be routable to the host to the /etc/hosts file
+sync_hosts
+timing hosts
 
 # ENV_PATH = PATH to make it consistent with the default Docker API
 echo "
@@ -217,6 +404,7 @@ ENV_PATH PATH=$PATH
 # fun race conditions in resolving host names for commands
 # because of adding the container to a network AFTER it's been started.
 sleep 0.05
+timing exec
 
 # Run original entrypoint and/or cmd
 if [ -z "RIPTIDE__DOCKER_DONT_RUN_CMD" ]; then
@@ -0,0 +1,53 @@
+#!/bin/sh
+# Main process of command runner containers (see runners.py), started by the Riptide entrypoint
+# after it prepared the container.
+#
+# Without arguments: Waits until the runner was idle (no invocation running or started) for
+# RIPTIDE__DOCKER_RUNNER_IDLE_TIMEOUT seconds, then exits, which stops and removes the container.
+#
+# "run <workdir> <command>": One invocation of the command, sent to the runner via docker exec.
+# Runs the command string with sh in workdir and exits with its exit code.
+
+STATE_DIR=/tmp/riptide_runner
+INTERVAL=5
+
+mkdir -p "$STATE_DIR"
+
+if [ "$1" = "run" ]; then
+    echo $$ > "$STATE_DIR/active.$$"
+    printf . >> "$STATE_DIR/uses"
+    cd "$2" || exit 1
+    sh -c "$3"
+    RC=$?
+    rm -f "$STATE_DIR/active.$$"
+    exit $RC
+fi
+
+trap 'exit 0' TERM INT
+touch "$STATE_DIR/uses"
+TIMEOUT=${RIPTIDE__DOCKER_RUNNER_IDLE_TIMEOUT:-600}
+IDLE=0
+LAST_USES=0
+while true; do
+    sleep $INTERVAL &
+    wait $!
+    ACTIVE=""
+    for f in "$STATE_DIR"/active.*; do
+        [ -e "$f" ] || continue
+        if kill -0 "${f##*.}" 2> /dev/null; then
+            ACTIVE=1
+        else
+            rm -f "$f"
+        fi
+    done
+    USES=$(wc -c < "$STATE_DIR/uses")
+    if [ ! -z "$ACTIVE" ] || [ "$USES" != "$LAST_USES" ]; then
+        IDLE=0
+        LAST_USES=$USES
+    else
+        IDLE=$((IDLE + INTERVAL))
+        if [ $IDLE -ge $TIMEOUT ]; then
+            exit 0
+        fi
+    fi
+done
@@ -0,0 +1,21 @@
+"""
+Settings of a ContainerBuilder that are resolved with the Docker daemon, shared by all containers the engine runs
+for services and commands.
+"""
+
+from docker import DockerClient
+from riptide_engine_docker.container_builder import ContainerBuilder
+from riptide_engine_docker.image_users import image_users
+from riptide_engine_docker.named_volumes import protect_clone_bases
+from riptide_engine_docker.network import host_gateway
+
+
+def setup_from_daemon(client: DockerClient, builder: ContainerBuilder, project_name: str, image_id: str) -> None:
+    """
+    Sets the host gateway, the users of the image and the read-only clone bases for the builder, which must already
+    have its named volumes. image_id is the ID of the image of the builder, as inspected by the caller.
+    Each of them is cached, so that this usually doesn't talk to the daemon.
+    """
+    builder.set_host_gateway(host_gateway(client, project_name))
+    builder.set_image_users(image_users(client, image_id))
+    protect_clone_bases(client, builder)
@@ -1,13 +1,20 @@
 from __future__ import annotations
 
 import os
+import threading
+import uuid
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypedDict
 
 from docker import DockerClient
-from docker.errors import ContainerError, NotFound
+from docker.errors import NotFound
+from docker.models.containers import Container
 from riptide.config.document.command import Command
 from riptide.config.document.project import Project
 from riptide.lib.cross_platform.cpuser import getgid, getuid
-from riptide_engine_docker.config import get_image_platform
+from riptide_engine_docker.builder_setup import setup_from_daemon
+from riptide_engine_docker.config import get_detached_workers, get_image_platform
 from riptide_engine_docker.container_builder import (
     EENV_GROUP,
     EENV_NO_STDOUT_REDIRECT,
@@ -15,47 +22,139 @@ from riptide_engine_docker.container_builder import (
     ContainerBuilder,
     get_network_name,
 )
-from riptide_engine_docker.network import add_network_links
+from riptide_engine_docker.container_output import (
+    ERROR_DETAILS_TAIL_BYTES,
+    STDERR,
+    STDOUT,
+    OutputCallback,
+    OutputTail,
+    run_streaming,
+)
+from riptide_engine_docker.network import add_network_links, create_container, network_index
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+class DetachedResult(TypedDict):
+    """Result of cmd_detached_stream."""
+
+    exit_code: int
+    # Retained (tail of the) output
+    stdout: str
+    stderr: str
 
 
 def cmd_detached(client: DockerClient, project: Project, command: Command, run_as_root=False) -> tuple[int, str]:
     """See AbstractEngine.cmd_detached."""
+    output = OutputTail()
+    container = _create(client, project, command, run_as_root)
+    try:
+        exit_code = run_streaming(client, container, lambda _, data: output.append(data))
+        return exit_code, output.get().decode("utf-8")
+    finally:
+        container.remove(force=True)
+
+
+def cmd_detached_stream(
+    client: DockerClient,
+    project: Project,
+    command: Command,
+    on_output: OutputCallback | None = None,
+    run_as_root=False,
+    tail_bytes: int | None = ERROR_DETAILS_TAIL_BYTES,
+) -> DetachedResult:
+    """
+    Like cmd_detached, but passes the output to on_output as it arrives (see container_output.OutputCallback)
+    and only retains the last tail_bytes bytes of stdout and stderr each for the result (everything if None).
+    """
+    tails = {STDOUT: OutputTail(tail_bytes), STDERR: OutputTail(tail_bytes)}
+
+    def handle_output(stream: int, data: bytes):
+        tails[stream].append(data)
+        if on_output is not None:
+            on_output(stream, data)
+
+    container = _create(client, project, command, run_as_root)
+    try:
+        exit_code = run_streaming(client, container, handle_output)
+    finally:
+        container.remove(force=True)
+    return {
+        "exit_code": exit_code,
+        "stdout": tails[STDOUT].get().decode("utf-8", "replace"),
+        "stderr": tails[STDERR].get().decode("utf-8", "replace"),
+    }
+
+
+def _create(client: DockerClient, project: Project, command: Command, run_as_root: bool) -> Container:
+    """Creates the container for a detached command and connects it to the link networks."""
     # Pulling image
     # Check if image exists
     try:
-        client.images.get(command["image"])
+        image = client.api.inspect_image(command["image"])
     except NotFound:
         image_name_full = command["image"] if ":" in command["image"] else command["image"] + ":latest"
         client.api.pull(image_name_full, platform=get_image_platform())
-
-    client.images.get(command["image"])  # must not throw
-    image_config = client.api.inspect_image(command["image"])["Config"]
+        image = client.api.inspect_image(command["image"])  # must not throw
+    image_config = image["Config"]
     image_command = image_config["Cmd"] if "Cmd" in image_config else None
 
     builder = ContainerBuilder(command["image"], command["command"] if "command" in command else image_command)
 
     builder.set_name(get_container_name(project["name"]))
+    builder.set_helper("cmd_detached")
     # network_mode host not supported atm
     builder.set_network(get_network_name(project["name"]))
 
     builder.set_env(EENV_NO_STDOUT_REDIRECT, "yes")
 
     builder.init_from_command(command, image_config)
+    setup_from_daemon(client, builder, project["name"], image["Id"])
     if not run_as_root:
         builder.switch_to_normal_user(image_config)
         builder.set_env(EENV_USER, str(getuid()))
         builder.set_env(EENV_GROUP, str(getgid()))
 
+    container = create_container(client, builder.build_docker_api())
     try:
-        container = client.containers.create(**builder.build_docker_api())  # type: ignore
-        add_network_links(client, container, None, project["links"])
-        container.start()
-        exit_code = container.wait()
-        output = container.logs()
-        return exit_code["StatusCode"], output.decode("utf-8")
-    except ContainerError as err:
-        return err.exit_status, err.stderr  # type: ignore
+        add_network_links(client, container, None, project["links"], project["name"])
+    except BaseException:
+        container.remove(force=True)
+        raise
+    return container
+
+
+def cmd_detached_async(
+    client: DockerClient, project: Project, command: Command, run_as_root=False
+) -> Future[tuple[int, str]]:
+    """
+    Runs cmd_detached in a shared worker pool, which runs at most config.get_detached_workers() commands at once.
+    Returns a future for its exit code and output.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=get_detached_workers(), thread_name_prefix="riptide_detached")
+    return _executor.submit(cmd_detached, client, project, command, run_as_root)
+
+
+def cmd_detached_batch(
+    client: DockerClient, project: Project, commands: Iterable[Command], run_as_root=False
+) -> list[tuple[int, str]]:
+    """
+    Runs the commands concurrently (see cmd_detached_async) and returns the exit code and output of each,
+    in the order of commands. Raises the first error of any of the commands, after all of them finished.
+    """
+    # All commands share the networks as checked for the first one.
+    with network_index(client).batch():
+        futures = [cmd_detached_async(client, project, command, run_as_root) for command in commands]
+        errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
 
 
 def get_container_name(project_name: str):
-    return "riptide__" + project_name + "__detached_cmd__" + str(os.getpid())
+    return "riptide__" + project_name + "__detached_cmd__" + str(os.getpid()) + "__" + uuid.uuid4().hex[:12]
@@ -1,6 +1,35 @@
 import os
 
 ENV_DOCKER_DEFAULT_PLATFORM = "DOCKER_DEFAULT_PLATFORM"
+ENV_RIPTIDE_DOCKER_NETWORK_MODE = "RIPTIDE_DOCKER_NETWORK_MODE"
+ENV_RIPTIDE_DOCKER_LOG_MAX_SIZE = "RIPTIDE_DOCKER_LOG_MAX_SIZE"
+ENV_RIPTIDE_DOCKER_LOG_KEEP = "RIPTIDE_DOCKER_LOG_KEEP"
+ENV_RIPTIDE_DOCKER_OVERLAY_UPPER = "RIPTIDE_DOCKER_OVERLAY_UPPER"
+ENV_RIPTIDE_DOCKER_OVERLAY_TMPFS_SIZE = "RIPTIDE_DOCKER_OVERLAY_TMPFS_SIZE"
+ENV_RIPTIDE_DOCKER_WARM_COMMANDS = "RIPTIDE_DOCKER_WARM_COMMANDS"
+ENV_RIPTIDE_DOCKER_RUNNER_IDLE_TIMEOUT = "RIPTIDE_DOCKER_RUNNER_IDLE_TIMEOUT"
+ENV_RIPTIDE_DOCKER_POOL_COMMANDS = "RIPTIDE_DOCKER_POOL_COMMANDS"
+ENV_RIPTIDE_DOCKER_POOL_SIZE = "RIPTIDE_DOCKER_POOL_SIZE"
+ENV_RIPTIDE_DOCKER_DETACHED_WORKERS = "RIPTIDE_DOCKER_DETACHED_WORKERS"
+ENV_RIPTIDE_DOCKER_FILEOPS_SIDECAR = "RIPTIDE_DOCKER_FILEOPS_SIDECAR"
+ENV_RIPTIDE_DOCKER_HOST_FILEOPS = "RIPTIDE_DOCKER_HOST_FILEOPS"
+
+# Every container is added to the networks of all linked projects.
+NETWORK_MODE_LINKS = "links"
+# Every container is added to one shared network, services are reachable as "<service>.<project>" there.
+NETWORK_MODE_HUB = "hub"
+
+# The upper layers of the overlays for unimportant paths are kept in memory and lost on restart.
+OVERLAY_UPPER_TMPFS = "tmpfs"
+# The upper layers of the overlays for unimportant paths of services are stored in a named volume per service.
+OVERLAY_UPPER_VOLUME = "volume"
+
+DEFAULT_LOG_MAX_SIZE = 100 * 1024 * 1024
+DEFAULT_LOG_KEEP = 3
+DEFAULT_RUNNER_IDLE_TIMEOUT = 600
+DEFAULT_POOL_SIZE = 2
+DEFAULT_DETACHED_WORKERS = 4
+SIZE_SUFFIXES = {"k": 1024, "m": 1024**2, "g": 1024**3}
 
 
 def get_image_platform() -> str | None:
@@ -8,3 +37,119 @@ def get_image_platform() -> str | None:
     if ENV_DOCKER_DEFAULT_PLATFORM in os.environ:
         return os.environ[ENV_DOCKER_DEFAULT_PLATFORM]
     return None
+
+
+def get_network_mode() -> str:
+    """
+    Get the network topology to use for project links, reads env variable RIPTIDE_DOCKER_NETWORK_MODE.
+    One of NETWORK_MODE_LINKS (default) or NETWORK_MODE_HUB.
+    """
+    if os.environ.get(ENV_RIPTIDE_DOCKER_NETWORK_MODE) == NETWORK_MODE_HUB:
+        return NETWORK_MODE_HUB
+    return NETWORK_MODE_LINKS
+
+
+def get_log_max_size(service_name: str) -> int:
+    """
+    Get the size (in bytes) at which the stdout/stderr/command logs of a service are rotated. 0 disables rotation.
+    Reads env variable RIPTIDE_DOCKER_LOG_MAX_SIZE__<service name> or, if not set, RIPTIDE_DOCKER_LOG_MAX_SIZE.
+    Values may have a k, M or G suffix.
+    """
+    value = os.environ.get(ENV_RIPTIDE_DOCKER_LOG_MAX_SIZE + "__" + service_name)
+    if value is None:
+        value = os.environ.get(ENV_RIPTIDE_DOCKER_LOG_MAX_SIZE)
+    if value is None or value.strip() == "":
+        return DEFAULT_LOG_MAX_SIZE
+    value = value.strip()
+    multiplier = SIZE_SUFFIXES.get(value[-1].lower(), 1)
+    if multiplier != 1:
+        value = value[:-1]
+    return int(value) * multiplier
+
+
+def get_log_keep() -> int:
+    """Get the number of rotated (compressed) log files to keep, reads env variable RIPTIDE_DOCKER_LOG_KEEP."""
+    if ENV_RIPTIDE_DOCKER_LOG_KEEP in os.environ:
+        return int(os.environ[ENV_RIPTIDE_DOCKER_LOG_KEEP])
+    return DEFAULT_LOG_KEEP
+
+
+def get_overlay_upper_mode() -> str:
+    """
+    Get where to store the upper layers of the overlays for unimportant paths of services,
+    reads env variable RIPTIDE_DOCKER_OVERLAY_UPPER. One of OVERLAY_UPPER_TMPFS (default) or OVERLAY_UPPER_VOLUME.
+    When not running on Linux, the paths are chowned recursively on every start, unless OVERLAY_UPPER_VOLUME is used:
+    Only then the ownership stamps that let the entrypoint skip this survive restarts.
+    """
+    if os.environ.get(ENV_RIPTIDE_DOCKER_OVERLAY_UPPER) == OVERLAY_UPPER_VOLUME:
+        return OVERLAY_UPPER_VOLUME
+    return OVERLAY_UPPER_TMPFS
+
+
+def get_overlay_tmpfs_size() -> str | None:
+    """
+    Get the size limit of the tmpfs for the upper layers of the overlays for unimportant paths (tmpfs size option,
+    e.g. "2g" or "25%"), reads env variable RIPTIDE_DOCKER_OVERLAY_TMPFS_SIZE. None means the tmpfs default.
+    """
+    if os.environ.get(ENV_RIPTIDE_DOCKER_OVERLAY_TMPFS_SIZE, "") != "":
+        return os.environ[ENV_RIPTIDE_DOCKER_OVERLAY_TMPFS_SIZE]
+    return None
+
+
+def get_warm_commands() -> set[str]:
+    """
+    Get the names of the commands to run in long-lived runner containers (see runners.py),
+    reads env variable RIPTIDE_DOCKER_WARM_COMMANDS (comma-separated).
+    """
+    return {name.strip() for name in os.environ.get(ENV_RIPTIDE_DOCKER_WARM_COMMANDS, "").split(",") if name.strip()}
+
+
+def get_runner_idle_timeout() -> int:
+    """
+    Get the time (in seconds) after which idle runner containers stop,
+    reads env variable RIPTIDE_DOCKER_RUNNER_IDLE_TIMEOUT.
+    """
+    if ENV_RIPTIDE_DOCKER_RUNNER_IDLE_TIMEOUT in os.environ:
+        return int(os.environ[ENV_RIPTIDE_DOCKER_RUNNER_IDLE_TIMEOUT])
+    return DEFAULT_RUNNER_IDLE_TIMEOUT
+
+
+def get_pool_commands() -> set[str]:
+    """
+    Get the names of the commands to keep pre-created containers for (see pool.py),
+    reads env variable RIPTIDE_DOCKER_POOL_COMMANDS (comma-separated).
+    """
+    return {name.strip() for name in os.environ.get(ENV_RIPTIDE_DOCKER_POOL_COMMANDS, "").split(",") if name.strip()}
+
+
+def get_pool_size() -> int:
+    """Get the number of pre-created containers to keep per command, reads env variable RIPTIDE_DOCKER_POOL_SIZE."""
+    if ENV_RIPTIDE_DOCKER_POOL_SIZE in os.environ:
+        return int(os.environ[ENV_RIPTIDE_DOCKER_POOL_SIZE])
+    return DEFAULT_POOL_SIZE
+
+
+def get_detached_workers() -> int:
+    """
+    Get the maximum number of detached commands to run concurrently in batches,
+    reads env variable RIPTIDE_DOCKER_DETACHED_WORKERS.
+    """
+    if ENV_RIPTIDE_DOCKER_DETACHED_WORKERS in os.environ:
+        return max(1, int(os.environ[ENV_RIPTIDE_DOCKER_DETACHED_WORKERS]))
+    return DEFAULT_DETACHED_WORKERS
+
+
+def get_fileops_sidecar_enabled() -> bool:
+    """
+    Whether path_rm/path_copy use the long-lived file operations container of the project (see path_utils),
+    reads env variable RIPTIDE_DOCKER_FILEOPS_SIDECAR ("0" disables it).
+    """
+    return os.environ.get(ENV_RIPTIDE_DOCKER_FILEOPS_SIDECAR, "1") != "0"
+
+
+def get_host_fileops_enabled() -> bool:
+    """
+    Whether path_rm/path_copy operate directly on the host file system where the permissions allow it
+    (see host_fileops), reads env variable RIPTIDE_DOCKER_HOST_FILEOPS ("0" disables it).
+    """
+    return os.environ.get(ENV_RIPTIDE_DOCKER_HOST_FILEOPS, "1") != "0"
@@ -3,7 +3,9 @@
 import copy
 import os
 import platform
+import socket
 import sys
+import uuid
 from collections import OrderedDict
 from pathlib import PurePosixPath
 from typing import TypeAlias, TypedDict
@@ -11,11 +13,30 @@ from typing import TypeAlias, TypedDict
 from docker.types import Mount, Ulimit
 from riptide.config.document.command import Command
 from riptide.config.document.service import Service
-from riptide.config.hosts import get_localhost_hosts
+from riptide.config.service.logging import (
+    LOGGING_CONTAINER_STDERR,
+    LOGGING_CONTAINER_STDOUT,
+    PATH_OF_COMMAND_OUTPUT_LOGFILES_IN_CONTAINER,
+)
 from riptide.config.service.ports import find_open_port_starting_at
+from riptide.engine.abstract import RIPTIDE_HOST_HOSTNAME
 from riptide.lib.cross_platform.cpuser import getgid, getuid
+from riptide_engine_docker import user_entries
 from riptide_engine_docker.assets import riptide_engine_docker_assets_dir
-from riptide_engine_docker.config import get_image_platform
+from riptide_engine_docker.config import (
+    OVERLAY_UPPER_VOLUME,
+    get_image_platform,
+    get_log_keep,
+    get_log_max_size,
+    get_overlay_tmpfs_size,
+    get_overlay_upper_mode,
+)
+from riptide_engine_docker.hosts_dir import riptide_docker_hosts_dir
+from riptide_engine_docker.volume_names import (
+    NAMED_VOLUME_INTERNAL_PREFIX,
+    RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER,
+    overlay_upper_volume_name,
+)
 
 ENTRYPOINT_SH = "entrypoint.sh"
 
@@ -24,9 +45,13 @@ RIPTIDE_DOCKER_LABEL_SERVICE = "riptide_service"
 RIPTIDE_DOCKER_LABEL_PROJECT = "riptide_project"
 RIPTIDE_DOCKER_LABEL_MAIN = "riptide_main"
 RIPTIDE_DOCKER_LABEL_HTTP_PORT = "riptide_port"
+# Helper containers: Kind of helper and the process they belong to (see helper_owner), for garbage collection.
+RIPTIDE_DOCKER_LABEL_HELPER = "riptide_helper"
+RIPTIDE_DOCKER_LABEL_OWNER = "riptide_owner"
 
 ENTRYPOINT_CONTAINER_PATH = "/entrypoint_riptide.sh"
 RIPSU_CONTAINER_PATH = "/ripsu"
+HOSTS_DIR_CONTAINER_PATH = "/riptide_hosts"
 EENV_DONT_RUN_CMD = "RIPTIDE__DOCKER_DONT_RUN_CMD"
 EENV_USER = "RIPTIDE__DOCKER_USER"
 EENV_USER_RUN = "RIPTIDE__DOCKER_USER_RUN"
@@ -37,10 +62,24 @@ EENV_COMMAND_LOG_PREFIX = "RIPTIDE__DOCKER_CMD_LOGGING_"
 EENV_NO_STDOUT_REDIRECT = "RIPTIDE__DOCKER_NO_STDOUT_REDIRECT"
 EENV_NAMED_VOLUMES = "RIPTIDE__DOCKER_NAMED_VOLUMES"
 EENV_ON_LINUX = "RIPTIDE__DOCKER_ON_LINUX"
-EENV_HOST_SYSTEM_HOSTNAMES = "RIPTIDE__DOCKER_HOST_SYSTEM_HOSTNAMES"
 EENV_OVERLAY_TARGETS = "RIPTIDE__DOCKER_OVERLAY_TARGETS"
+EENV_CHOWN_STAMP_VERSION = "RIPTIDE__DOCKER_CHOWN_STAMP_VERSION"
+EENV_OVERLAY_PERSISTENT = "RIPTIDE__DOCKER_OVERLAY_PERSISTENT"
+EENV_OVERLAY_TMPFS_SIZE = "RIPTIDE__DOCKER_OVERLAY_TMPFS_SIZE"
+EENV_USER_ENTRIES = "RIPTIDE__DOCKER_USER_ENTRIES"
+EENV_LOG_ROTATE = "RIPTIDE__DOCKER_LOG_ROTATE"
+EENV_LOG_MAX_SIZE = "RIPTIDE__DOCKER_LOG_MAX_SIZE"
+EENV_LOG_KEEP = "RIPTIDE__DOCKER_LOG_KEEP"
+LOGS_DIR_CONTAINER_PATH = "/riptide_logs"
+OVERLAY_UPPER_CONTAINER_PATH = "/riptide_overlayfs/tmp"
 EENV_USE_RIPSU = "RIPTIDE__USE_RIPSU"
 
+# Version of the ownership stamps written by the entrypoint. Increase to force a new chown of all overlay targets.
+CHOWN_STAMP_VERSION = "1"
+
+# Special value for extra hosts: Let Docker resolve the address of the host system.
+HOST_GATEWAY = "host-gateway"
+
 # For services map HTTP main port to a host port starting here
 DOCKER_ENGINE_HTTP_PORT_BND_START = 30000
 
@@ -62,9 +101,14 @@ class DockerContainerCreate(TypedDict, total=False):
     cap_add: list[str]
     security_opt: list[str]
     environment: dict[str, str]
+    extra_hosts: dict[str, str]
     labels: dict[str, str]
     mounts: list[Mount]
     platform: str | None
+    tty: bool
+    stdin_open: bool
+    init: bool
+    auto_remove: bool
 
 
 class ContainerBuilder:
@@ -93,11 +137,18 @@ class ContainerBuilder:
         self.allow_full_memlock: bool = False
         self.cap_sys_admin: bool = False
         self.use_host_network: bool = False
+        self.host_system_hostnames: list[str] = []
+        self.host_gateway: str = HOST_GATEWAY
+        self.image_users: tuple[str, str] | None = None
 
         self.on_linux: bool = platform.system().lower().startswith("linux")
         self.set_env(EENV_ON_LINUX, "1" if self.on_linux else "0")
 
         self.named_volumes_in_cnt: list[str] = []
+        # Named volumes (names without prefix) that are always mounted read-only, see set_read_only_volumes
+        self.read_only_volumes: set[str] = set()
+        # Log files written by the entrypoint (stdout/stderr/logging commands), container path -> host path
+        self.rotated_logs: dict[str, str] = {}
 
     def set_env(self, name: str, val: str | None):
         if val is None:
@@ -110,6 +161,11 @@ class ContainerBuilder:
         self.labels[name] = val
         return self
 
+    def set_helper(self, kind: str):
+        """Mark the container as a helper container of the given kind, owned by this process."""
+        self.labels.update(helper_labels(kind))
+        return self
+
     def set_mount(self, host_path: str, container_path: str, mode="rw"):
         self.mounts[host_path] = Mount(
             target=container_path,
@@ -124,19 +180,42 @@ class ContainerBuilder:
         """
         Add a named volume. Name is automatically prefixed with riptide__.
         """
-        from riptide_engine_docker.named_volumes import NAMED_VOLUME_INTERNAL_PREFIX
-
         vol_name = NAMED_VOLUME_INTERNAL_PREFIX + name
         self.mounts[name] = Mount(
             target=container_path,
             source=vol_name,
             type="volume",
-            read_only=mode == "ro",
+            read_only=mode == "ro" or name in self.read_only_volumes,
             labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"},
         )
         self.named_volumes_in_cnt.append(container_path)
         return self
 
+    def set_read_only_volumes(self, names: set[str]):
+        """
+        Mount the given named volumes (names without the riptide__ prefix) read-only, regardless of the mode they
+        are added with. Used for the bases of clones, see named_volumes.protect_clone_bases.
+        """
+        self.read_only_volumes = set(names)
+        for name in self.read_only_volumes:
+            if name in self.mounts and self.mounts[name]["Type"] == "volume":
+                self.mounts[name]["ReadOnly"] = True
+        return self
+
+    def set_overlay_upper_volume(self, name: str):
+        """
+        Store the upper layers of the overlays for unimportant paths in the given named volume (name without
+        the riptide__ prefix) instead of a tmpfs, so that they survive restarts.
+        """
+        self.mounts[OVERLAY_UPPER_CONTAINER_PATH] = Mount(
+            target=OVERLAY_UPPER_CONTAINER_PATH,
+            source=NAMED_VOLUME_INTERNAL_PREFIX + name,
+            type="volume",
+            labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER: "1"},
+        )
+        self.set_env(EENV_OVERLAY_PERSISTENT, "1")
+        return self
+
     def set_port(self, cnt: int, host: int):
         self.ports[cnt] = host
         return self
@@ -173,6 +252,19 @@ class ContainerBuilder:
         self.allow_full_memlock = flag
         return self
 
+    def set_host_gateway(self, host_gateway: str):
+        """Set the address the host system hostnames (see add_host_hostnames) resolve to."""
+        self.host_gateway = host_gateway
+        return self
+
+    def set_image_users(self, image_users: tuple[str, str] | None):
+        """
+        Set the contents of /etc/passwd and /etc/group of the image (see image_users).
+        If set, the entries for the Riptide user are generated here instead of by the entrypoint.
+        """
+        self.image_users = image_users
+        return self
+
     def enable_riptide_entrypoint(self, image_config: ImageConfig, enable_original_entrypoint=True):
         """Add the Riptide entrypoint script and configure it."""
         # The original entrypoint of the image is replaced with
@@ -197,9 +289,13 @@ class ContainerBuilder:
 
     def add_host_hostnames(self):
         """
-        Adds all hostnames that must be routable to the host system within the container as a environment variable.
+        Makes all hostnames that must be routable to the host system available within the container.
+
+        The host system itself is added as an extra host. All other hostnames are read by the entrypoint
+        from the shared hosts file fragment maintained by the engine (see hosts_file), which is mounted read-only.
         """
-        self.set_env(EENV_HOST_SYSTEM_HOSTNAMES, " ".join(get_localhost_hosts()))
+        self.host_system_hostnames = [RIPTIDE_HOST_HOSTNAME]
+        self.set_mount(riptide_docker_hosts_dir(), HOSTS_DIR_CONTAINER_PATH, "ro")
 
     def _init_common(self, doc: Service | Command, image_config: ImageConfig, use_named_volume, unimportant_paths):
         disable_original_entrypoint = False
@@ -214,6 +310,8 @@ class ContainerBuilder:
                 self.set_named_volume_mount(volume["name"], volume["bind"], volume["mode"] or "rw")
             else:
                 self.set_mount(host, volume["bind"], volume["mode"] or "rw")
+                if _is_entrypoint_log(volume["bind"]):
+                    self.rotated_logs[volume["bind"]] = host
         # Collect environment
         for key, val in doc.collect_environment().items():
             self.set_env(key, val)
@@ -222,6 +320,10 @@ class ContainerBuilder:
         # Mounting bind/overlayfs will require SYS_ADMIN caps:
         if len(unimportant_paths) > 0:
             self.cap_sys_admin = True
+            self.set_env(EENV_CHOWN_STAMP_VERSION, CHOWN_STAMP_VERSION)
+            tmpfs_size = get_overlay_tmpfs_size()
+            if tmpfs_size is not None:
+                self.set_env(EENV_OVERLAY_TMPFS_SIZE, tmpfs_size)
 
     def init_from_service(self, service: Service, image_config):
         """
@@ -238,6 +340,8 @@ class ContainerBuilder:
             perf_settings["dont_sync_named_volumes_with_host"],
             project_absolute_unimportant_paths,
         )
+        if len(project_absolute_unimportant_paths) > 0 and get_overlay_upper_mode() == OVERLAY_UPPER_VOLUME:
+            self.set_overlay_upper_volume(overlay_upper_volume_name(service.get_project()["name"], service["$name"]))
         # Collect labels
         labels = service_collect_labels(service, service.get_project()["name"])
         # Collect (and process!) additional_ports
@@ -262,11 +366,31 @@ class ContainerBuilder:
             self.set_label(name, val)
         for container, host in ports.items():
             self.set_port(container, host)
+        self.enable_log_rotation(get_log_max_size(service["$name"]), get_log_keep())
         # Check if ulimit memlock setting is enabled
         if "allow_full_memlock" in service and service["allow_full_memlock"]:
             self.set_allow_full_memlock(True)
         return self
 
+    def enable_log_rotation(self, max_size: int, keep: int):
+        """
+        Let the entrypoint rotate the stdout/stderr/command logs once they are larger than max_size bytes,
+        keeping the last keep rotated logs (gzip-compressed). The files are copied and truncated in place, so the
+        service doesn't need to be restarted. The directory containing the logs is mounted for this.
+        """
+        if max_size <= 0 or len(self.rotated_logs) < 1:
+            return self
+        # All logs of a service are in the same directory.
+        log_dir = os.path.dirname(next(iter(self.rotated_logs.values())))
+        self.set_mount(log_dir, LOGS_DIR_CONTAINER_PATH, "rw")
+        self.set_env(
+            EENV_LOG_ROTATE,
+            ":".join(f"{cnt}={os.path.basename(host)}" for cnt, host in self.rotated_logs.items()),
+        )
+        self.set_env(EENV_LOG_MAX_SIZE, str(max_size))
+        self.set_env(EENV_LOG_KEEP, str(keep))
+        return self
+
     def service_add_main_port(self, service: Service):
         """
         Add main service port.
@@ -363,15 +487,24 @@ class ContainerBuilder:
             if self.on_linux:
                 args["security_opt"] = ["apparmor:unconfined"]
 
+        if len(self.host_system_hostnames) > 0:
+            args["extra_hosts"] = {hostname: self.host_gateway for hostname in self.host_system_hostnames}
+
         args["environment"] = self.env.copy()
 
         # Add list of named volume paths for Docker to chown
         if len(self.named_volumes_in_cnt) > 0:
             args["environment"][EENV_NAMED_VOLUMES] = ":".join(self.named_volumes_in_cnt)
 
+        user_entries_mount = self._user_entries_mount()
+        if user_entries_mount is not None:
+            args["environment"][EENV_USER_ENTRIES] = "1"
+
         args["labels"] = self.labels
 
         args["mounts"] = list(self.mounts.values())
+        if user_entries_mount is not None:
+            args["mounts"].append(user_entries_mount)
 
         image_platform = get_image_platform()
         if image_platform is not None:
@@ -384,7 +517,8 @@ class ContainerBuilder:
         Build the docker container in the form of a Docker CLI command.
         """
         shell = ["docker", "run", "--rm", "-i"]
-        if sys.stdin.isatty():
+        # No TTY if input or output is redirected, a TTY would mangle binary data.
+        if sys.stdin.isatty() and sys.stdout.isatty():
             shell += ["-t"]
         if run_with_init:
             shell += ["--init"]
@@ -407,6 +541,8 @@ class ContainerBuilder:
             shell += ["-u", str(0)]
         if self.hostname:
             shell += ["--hostname", self.hostname]
+        for hostname in self.host_system_hostnames:
+            shell += ["--add-host", hostname + ":" + self.host_gateway]
 
         for key, value in self.env.items():
             shell += ["-e", key + "=" + value]
@@ -415,12 +551,18 @@ class ContainerBuilder:
         if len(self.named_volumes_in_cnt) > 0:
             shell += ["-e", EENV_NAMED_VOLUMES + "=" + ":".join(self.named_volumes_in_cnt)]
 
+        mounts = list(self.mounts.values())
+        user_entries_mount = self._user_entries_mount()
+        if user_entries_mount is not None:
+            shell += ["-e", EENV_USER_ENTRIES + "=1"]
+            mounts.append(user_entries_mount)
+
         for key, value in self.labels.items():
             shell += ["--label", key + "=" + value]
 
         # Mac: Add delegated
         mac_add = ",consistency=delegated" if platform.system().lower().startswith("mac") else ""
-        for mount in self.mounts.values():
+        for mount in mounts:
             mode = "ro" if mount["ReadOnly"] else "rw"
             if mount["Type"] == "bind":
                 # --mount type=bind,src=/tmp/test,comma,dst=/tmp/test
@@ -430,10 +572,11 @@ class ContainerBuilder:
                     + mac_add,
                 ]
             else:
+                labels = mount.get("VolumeOptions", {}).get("Labels", {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"})
                 shell += [
                     "--mount",
                     f"type=volume,target={mount['Target']},src={mount['Source']},ro={'0' if mode == 'rw' else '1'},"
-                    f"volume-label={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE}=1",
+                    + ",".join(f"volume-label={key}={value}" for key, value in labels.items()),
                 ]
 
         # ulimits
@@ -450,6 +593,13 @@ class ContainerBuilder:
         if image_platform is not None:
             shell += [f"--platform={image_platform}"]
 
+        shell += [self.image, self.build_command_string()]
+        return shell
+
+    def build_command_string(self) -> str:
+        """
+        Build the command with its arguments as one string, as passed to the entrypoint by the Docker CLI.
+        """
         command = self.command
         if command is None:
             command = ""
@@ -461,18 +611,56 @@ class ContainerBuilder:
                 commandstr += " " + " ".join(f'"{w}"' for w in command[1:])
             command = commandstr
 
-        shell += [self.image, (command + " " + " ".join(f'"{w}"' for w in self.args)).rstrip()]
-        return shell
+        return (command + " " + " ".join(f'"{w}"' for w in self.args)).rstrip()
 
     def clone(self):
         """Clone this builder"""
         return copy.deepcopy(self)
 
+    def _user_entries_mount(self) -> Mount | None:
+        """Mount of the generated user entries for the entrypoint (see user_entries), if possible."""
+        if self.image_users is None or EENV_USER not in self.env or EENV_GROUP not in self.env:
+            return None
+        entries = make_user_entries(*self.image_users, self.env[EENV_USER], self.env[EENV_GROUP])
+        return Mount(
+            target=user_entries.USER_ENTRIES_CONTAINER_PATH,
+            source=user_entries.write(*entries),
+            type="bind",
+            read_only=True,
+            consistency="delegated",
+        )
+
+
+def helper_owner() -> str:
+    """Identifies this process as the owner of helper containers."""
+    return socket.gethostname() + ":" + str(os.getpid())
+
+
+def helper_labels(kind: str) -> dict[str, str]:
+    """Labels for helper containers of the given kind, owned by this process."""
+    return {
+        RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1",
+        RIPTIDE_DOCKER_LABEL_HELPER: kind,
+        RIPTIDE_DOCKER_LABEL_OWNER: helper_owner(),
+    }
+
 
 def get_cmd_container_name(project_name: str, command_name: str):
     return "riptide__" + project_name + "__cmd__" + command_name + "__" + str(os.getpid())
 
 
+def get_runner_container_name(project_name: str, command_name: str):
+    return "riptide__" + project_name + "__runner__" + command_name
+
+
+def get_fileops_container_name(project_name: str):
+    return "riptide__" + project_name + "__fileops"
+
+
+def get_pool_container_name(project_name: str, command_name: str):
+    return "riptide__" + project_name + "__pool__" + command_name + "__" + uuid.uuid4().hex[:12]
+
+
 def get_network_name(project_name: str):
     return "riptide__" + project_name
 
@@ -481,6 +669,51 @@ def get_service_container_name(project_name: str, service_name: str):
     return "riptide__" + project_name + "__" + service_name
 
 
+def make_user_entries(passwd: str, group: str, uid: str, gid: str) -> tuple[str, str, str, str]:
+    """
+    Adds the Riptide user and group to the given /etc/passwd and /etc/group contents, like the entrypoint would
+    do with groupadd/useradd/usermod:
+
+    - If no group with gid exists, the group "riptide" is added.
+    - If no user with uid exists, the user "riptide" is added, with the group as primary group and
+      /home/riptide as home. Otherwise, the existing user is added to the group.
+
+    Returns the new passwd and group contents, the name and the home directory of the user.
+    """
+    group_lines = group.splitlines()
+    passwd_lines = passwd.splitlines()
+
+    group_index = None
+    for i, line in enumerate(group_lines):
+        fields = line.split(":")
+        if len(fields) >= 4 and fields[2] == gid:
+            group_index = i
+            break
+    if group_index is None:
+        group_lines.append(f"riptide:x:{gid}:")
+        group_index = len(group_lines) - 1
+
+    username = None
+    home = "/home/riptide"
+    for line in passwd_lines:
+        fields = line.split(":")
+        if len(fields) >= 7 and fields[2] == uid:
+            username = fields[0]
+            home = fields[5]
+            break
+    if username is None:
+        username = "riptide"
+        passwd_lines.append(f"riptide:x:{uid}:{gid}::{home}:/bin/sh")
+    else:
+        fields = group_lines[group_index].split(":")
+        members = [m for m in fields[3].split(",") if m != ""]
+        if username not in members:
+            fields[3] = ",".join(members + [username])
+            group_lines[group_index] = ":".join(fields)
+
+    return "\n".join(passwd_lines), "\n".join(group_lines), username, home
+
+
 def parse_entrypoint(image_config: ImageConfig):
     """
     Parse the original entrypoint of an image and return a map of variables for the riptide entrypoint script.
@@ -530,6 +763,13 @@ def service_collect_labels(service: Service, project_name):
     return labels
 
 
+def _is_entrypoint_log(container_path: str) -> bool:
+    """Whether the file at container_path is a log file written by the entrypoint."""
+    return container_path in (LOGGING_CONTAINER_STDOUT, LOGGING_CONTAINER_STDERR) or container_path.startswith(
+        PATH_OF_COMMAND_OUTPUT_LOGFILES_IN_CONTAINER + "/"
+    )
+
+
 def _make_abs_to_src(p):
     """Convert the given relative path to an absolute path. Relative base is /src/."""
     return str(PurePosixPath("/src").joinpath(p))
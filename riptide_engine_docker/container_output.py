@@ -0,0 +1,75 @@
+"""
+Streaming the output of non-interactive containers with bounded memory.
+
+The output is read from the attach stream of the container while it runs, with stdout and stderr kept separate,
+instead of being loaded completely with container.logs() after it exited.
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from collections.abc import Callable
+from typing import TypeAlias
+
+from docker import DockerClient
+from docker.models.containers import Container
+
+STDOUT = 1
+STDERR = 2
+
+# Bytes of stdout and stderr each, that are kept of the output of failed commands for error details.
+ERROR_DETAILS_TAIL_BYTES = 64 * 1024
+
+# Called with STDOUT or STDERR and a chunk of output, as it arrives.
+OutputCallback: TypeAlias = Callable[[int, bytes], None]
+
+
+class OutputTail:
+    """Keeps the last max_bytes bytes of a stream of output chunks (everything if max_bytes is None)."""
+
+    def __init__(self, max_bytes: int | None = None):
+        self.max_bytes = max_bytes
+        self.chunks: deque[bytes] = deque()
+        self.size = 0
+
+    def append(self, data: bytes):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.max_bytes is None:
+            return
+        while len(self.chunks) > 1 and self.size - len(self.chunks[0]) >= self.max_bytes:
+            self.size -= len(self.chunks.popleft())
+
+    def get(self) -> bytes:
+        data = b"".join(self.chunks)
+        if self.max_bytes is not None:
+            return data[-self.max_bytes :] if self.max_bytes > 0 else b""
+        return data
+
+
+def run_streaming(client: DockerClient, container: Container, on_output: OutputCallback) -> int:
+    """
+    Starts the created (not yet started) non-TTY container and passes its output to on_output as it arrives,
+    until the container exits. Returns the exit code.
+    """
+    # Attach before starting, so no output is missed and attaching can't race with the container exiting.
+    output = client.api.attach(container.id, stream=True, logs=True, demux=True)  # type: ignore
+    container.start()
+    for stdout, stderr in output:
+        if stdout:
+            on_output(STDOUT, stdout)
+        if stderr:
+            on_output(STDERR, stderr)
+    return container.wait()["StatusCode"]
+
+
+def run_with_tails(
+    client: DockerClient, container: Container, tail_bytes: int | None = ERROR_DETAILS_TAIL_BYTES
+) -> tuple[int, bytes, bytes]:
+    """
+    Like run_streaming, but returns the exit code and the last tail_bytes bytes of stdout and stderr
+    (everything if tail_bytes is None).
+    """
+    tails = {STDOUT: OutputTail(tail_bytes), STDERR: OutputTail(tail_bytes)}
+    exit_code = run_streaming(client, container, lambda stream, data: tails[stream].append(data))
+    return exit_code, tails[STDOUT].get(), tails[STDERR].get()
@@ -3,6 +3,7 @@ from __future__ import annotations
 import asyncio
 import json
 import platform
+from collections.abc import Callable
 from json import JSONDecodeError
 
 import docker
@@ -18,13 +19,19 @@ from riptide.engine.results import (
     ResultQueue,
     StartStopResultStep,
 )
-from riptide_engine_docker import named_volumes, network, path_utils, service
-from riptide_engine_docker.cmd_detached import cmd_detached
+from riptide_engine_docker import helper_gc, hosts_file, named_volumes, network, path_utils, service, timings
+from riptide_engine_docker.cmd_detached import (
+    DetachedResult,
+    cmd_detached,
+    cmd_detached_batch,
+    cmd_detached_stream,
+)
 from riptide_engine_docker.config import get_image_platform
 from riptide_engine_docker.container_builder import (
     RIPTIDE_DOCKER_LABEL_HTTP_PORT,
     get_service_container_name,
 )
+from riptide_engine_docker.container_output import ERROR_DETAILS_TAIL_BYTES, OutputCallback
 from riptide_engine_docker.fg import (
     DEFAULT_EXEC_FG_CMD,
     cmd_fg,
@@ -32,6 +39,8 @@ from riptide_engine_docker.fg import (
     exec_fg,
     service_fg,
 )
+from riptide_engine_docker.named_volumes import NamedVolumeInfo
+from riptide_engine_docker.volume_names import overlay_upper_volume_name
 
 
 class DockerEngine(AbstractEngine):
@@ -44,11 +53,14 @@ class DockerEngine(AbstractEngine):
     ) -> MultiResultQueue[StartStopResultStep]:
         with riptide_start_project_ctx(project):
             # Start network
-            network.start(self.client, project["name"])
+            network.ensure(self.client, project["name"])
+            hosts_file.update(self.client)
 
             # Start all services
             queues = {}
             loop = asyncio.get_event_loop()
+            # Clean up after riptide processes that were killed, in the background
+            helper_gc.collect_in_background(self.client)
             for service_name in services:
                 # Create queue and add to queues
                 queue: ResultQueue[StartStopResultStep] = ResultQueue()
@@ -57,7 +69,7 @@ class DockerEngine(AbstractEngine):
                     # Run start task
                     loop.run_in_executor(
                         None,
-                        service.start,
+                        _start_service,
                         project["name"],
                         project["app"]["services"][service_name],
                         command_group,
@@ -123,7 +135,8 @@ class DockerEngine(AbstractEngine):
     ) -> int:
         project = command.get_project()
         # Start network
-        network.start(self.client, project["name"])
+        network.ensure(self.client, project["name"])
+        hosts_file.update(self.client)
 
         return cmd_fg(self.client, project, command, arguments, working_directory, extra_volumes)
 
@@ -142,7 +155,8 @@ class DockerEngine(AbstractEngine):
         command_group: str = "default",
     ) -> None:
         # Start network
-        network.start(self.client, project["name"])
+        network.ensure(self.client, project["name"])
+        hosts_file.update(self.client)
 
         with riptide_start_project_ctx(project):
             service_fg(self.client, project, service_name, command_group, arguments)
@@ -161,11 +175,44 @@ class DockerEngine(AbstractEngine):
 
     def cmd_detached(self, project: Project, command: Command, run_as_root=False):
         # Start network
-        network.start(self.client, project["name"])
+        network.ensure(self.client, project["name"])
+        hosts_file.update(self.client)
         command.parent_doc = project["app"]
 
         return cmd_detached(self.client, project, command, run_as_root)
 
+    def cmd_detached_stream(
+        self,
+        project: Project,
+        command: Command,
+        on_output: OutputCallback | None = None,
+        run_as_root=False,
+        tail_bytes: int | None = ERROR_DETAILS_TAIL_BYTES,
+    ) -> DetachedResult:
+        """
+        Like cmd_detached, but passes stdout and stderr chunks to on_output as they arrive and only keeps the
+        last tail_bytes bytes of each for the result. See cmd_detached.cmd_detached_stream.
+        """
+        # Start network
+        network.ensure(self.client, project["name"])
+        hosts_file.update(self.client)
+        command.parent_doc = project["app"]
+
+        return cmd_detached_stream(self.client, project, command, on_output, run_as_root, tail_bytes)
+
+    def cmd_detached_batch(self, project: Project, commands: list[Command], run_as_root=False) -> list[tuple[int, str]]:
+        """
+        Like cmd_detached, but runs all commands concurrently (at most config.get_detached_workers() at once).
+        Returns the exit code and output of each command, in order.
+        """
+        # Start network
+        network.ensure(self.client, project["name"])
+        hosts_file.update(self.client)
+        for command in commands:
+            command.parent_doc = project["app"]
+
+        return cmd_detached_batch(self.client, project, commands, run_as_root)
+
     def pull_images(self, project: Project, line_reset="\n", update_func=lambda msg: None) -> None:
         if "services" in project["app"]:
             for name, service in project["app"]["services"].items():
@@ -203,18 +250,81 @@ class DockerEngine(AbstractEngine):
     def list_named_volumes(self) -> list[str]:
         return named_volumes.list(self.client)
 
-    def delete_named_volume(self, name: str) -> None:
-        named_volumes.delete(self.client, name)
+    def list_named_volumes_with_usage(self) -> list[NamedVolumeInfo]:
+        """Lists all named volumes with size, usage and creation time, see named_volumes.list_with_usage."""
+        return named_volumes.list_with_usage(self.client)
+
+    def delete_named_volume(self, name: str, cascade: bool = False) -> None:
+        """If cascade is set, clones based on the volume are deleted as well (see named_volumes.delete)."""
+        named_volumes.delete(self.client, name, cascade)
 
     def exists_named_volume(self, name: str) -> bool:
         return named_volumes.exists(self.client, name)
 
-    def copy_named_volume(self, from_name: str, target_name: str) -> None:
-        named_volumes.copy(self.client, from_name, target_name)
+    def copy_named_volume(
+        self,
+        from_name: str,
+        target_name: str,
+        incremental: bool = False,
+        progress: Callable[[int, int, int], None] | None = None,
+    ) -> None:
+        """See named_volumes.copy for incremental and progress."""
+        named_volumes.copy(self.client, from_name, target_name, incremental, progress)
 
     def create_named_volume(self, name: str) -> None:
         named_volumes.create(self.client, name)
 
+    def clone_named_volume(self, base_name: str, target_name: str) -> None:
+        """
+        Create the named volume 'target_name' as a copy-on-write clone of 'base_name'. See named_volumes.clone.
+
+        :raises: FileExistsError: If 'target_name' already exists.
+        """
+        named_volumes.clone(self.client, base_name, target_name)
+
+    def reset_overlay_upper(self, project: Project, service_name: str) -> None:
+        """
+        Discard everything written to the unimportant paths of the service, if their overlay upper layer is stored
+        in a named volume (see config.get_overlay_upper_mode). The service must be stopped.
+        """
+        named_volumes.delete(self.client, overlay_upper_volume_name(project["name"], service_name))
+
+    def list_named_volume_bases(self) -> dict[str, str]:
+        """Names of all named volume clones, mapped to the name of the volume they are based on."""
+        return named_volumes.list_bases(self.client)
+
+    def snapshot_named_volume(self, name: str, path: str) -> None:
+        """Writes the named volume 'name' to the compressed snapshot archive 'path'."""
+        named_volumes.snapshot(self.client, name, path)
+
+    def restore_named_volume(self, path: str, name: str) -> None:
+        """
+        Creates the named volume 'name' from the snapshot archive 'path'.
+
+        :raises: FileExistsError: If 'name' already exists.
+        """
+        named_volumes.restore(self.client, path, name)
+
+    def get_start_timings(self, project: Project, service_name: str) -> dict[str, float] | None:
+        """
+        Durations (in seconds) of the phases of the last start of the service: "docker" (creating and starting
+        the container, if it was started by this process), followed by the phases of the entrypoint in order.
+        Returns None if the service is not running.
+        """
+        name = get_service_container_name(project["name"], service_name)
+        entrypoint = timings.entrypoint_timings(self.client, name)
+        if entrypoint is None:
+            return None
+        daemon = timings.daemon_timing(name)
+        return ({"docker": daemon} if daemon is not None else {}) | entrypoint
+
+    def collect_garbage(self) -> list[str]:
+        """
+        Removes leftover helper containers of Riptide processes on this host that no longer exist.
+        Returns the IDs of the removed containers. See helper_gc.collect.
+        """
+        return helper_gc.collect(self.client)
+
     def __pull_image(self, image_name, line_reset, update_func):
         try:
             # TODO: This is pretty messy and should just be entirely redone, not
@@ -250,3 +360,19 @@ class DockerEngine(AbstractEngine):
         except ImageNotFound:
             return None
         return image.labels
+
+
+def _start_service(
+    project_name: str,
+    service_obj: Service,
+    command_group: str,
+    client: docker.DockerClient,
+    queue: ResultQueue[StartStopResultStep],
+    quick: bool,
+):
+    """
+    service.start, in a batch of the network index: Starting a service (and its pre and post start containers)
+    only needs the networks as checked at the start of the project.
+    """
+    with network.network_index(client).batch():
+        service.start(project_name, service_obj, command_group, client, queue, quick)
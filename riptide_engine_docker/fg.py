@@ -1,3 +1,4 @@
+import subprocess
 import sys
 import threading
 from time import sleep
@@ -10,12 +11,15 @@ from riptide.config.document.service import Service
 from riptide.config.files import CONTAINER_SRC_PATH, get_current_relative_src_path
 from riptide.engine.abstract import ExecError, SimpleBindVolume
 from riptide.lib.cross_platform.cpuser import getgid, getuid
-from riptide_engine_docker.config import get_image_platform
+from riptide_engine_docker import pool, runners, tty_attach
+from riptide_engine_docker.builder_setup import setup_from_daemon
+from riptide_engine_docker.config import get_image_platform, get_pool_commands, get_warm_commands
 from riptide_engine_docker.container_builder import (
     EENV_GROUP,
     EENV_NO_STDOUT_REDIRECT,
     EENV_USER,
     ContainerBuilder,
+    DockerContainerCreate,
     get_cmd_container_name,
     get_network_name,
     get_service_container_name,
@@ -41,24 +45,44 @@ def exec_fg(
     user = getuid()
     user_group = getgid()
 
-    try:
-        container = client.containers.get(container_name)
-        if container.status == "exited":
-            container.remove()
-            raise ExecError("The service is not running. Try starting it first.")
+    workdir = None
+    if "src" in service_obj["roles"]:
+        # Service has source code, set workdir in container to current workdir
+        workdir = CONTAINER_SRC_PATH + "/" + get_current_relative_src_path(project)
+    environment = {}
+    if cols and lines:
+        # Add COLUMNS and LINES env variables
+        environment.update({"COLUMNS": str(cols), "LINES": str(lines)})
+    environment.update(environment_variables)
 
-        # TODO: The Docker Python API doesn't seem to support interactive exec - use pty.spawn for now
-        shell = ["docker", "exec", "-it"]
+    try:
+        if tty_attach.is_supported():
+            # The daemon refuses to exec in containers that are not running, no need to check that first.
+            try:
+                return tty_attach.exec_interactive(
+                    client,
+                    container_name,
+                    ["sh", "-c", cmd],
+                    user="" if root else str(user) + ":" + str(user_group),
+                    environment=environment,
+                    workdir=workdir,
+                )
+            except APIError as err:
+                if err.status_code != 409:
+                    raise
+                _remove_if_exited(client, container_name)
+                raise ExecError("The service is not running. Try starting it first.") from err
+
+        _remove_if_exited(client, container_name)
+        shell = ["docker", "exec", "-i"]
+        if _is_interactive():
+            shell += ["-t"]
         if not root:
             shell += ["-u", str(user) + ":" + str(user_group)]
-        if cols and lines:
-            # Add COLUMNS and LINES env variables
-            shell += ["-e", "COLUMNS=" + str(cols), "-e", "LINES=" + str(lines)]
-        for key, value in environment_variables.items():
+        for key, value in environment.items():
             shell += ["-e", key + "=" + value]
-        if "src" in service_obj["roles"]:
-            # Service has source code, set workdir in container to current workdir
-            shell += ["-w", CONTAINER_SRC_PATH + "/" + get_current_relative_src_path(project)]
+        if workdir is not None:
+            shell += ["-w", workdir]
         shell += [container_name, "sh", "-c", cmd]
 
         return _spawn(shell)
@@ -69,6 +93,14 @@ def exec_fg(
         raise ExecError("Error communicating with the Docker Engine.") from err
 
 
+def _remove_if_exited(client, container_name: str) -> None:
+    """:raises: ExecError: If the container exited (it is removed then)."""
+    container = client.containers.get(container_name)
+    if container.status == "exited":
+        container.remove()
+        raise ExecError("The service is not running. Try starting it first.")
+
+
 def service_fg(client, project: Project, service_name: str, command_group: str, arguments: list[str]) -> None:
     """Run a service in foreground"""
     if service_name not in project["app"]["services"]:
@@ -117,8 +149,7 @@ def fg(
 
     # Check if image exists
     try:
-        client.images.get(exec_object["image"])  # must not throw
-        image_config = client.api.inspect_image(exec_object["image"])["Config"]
+        image = client.api.inspect_image(exec_object["image"])
     except NotFound:
         print("Riptide: Pulling image... Your command will be run after that.", file=sys.stderr)
         try:
@@ -126,8 +157,7 @@ def fg(
                 exec_object["image"] if ":" in exec_object["image"] else exec_object["image"] + ":latest",
                 platform=get_image_platform(),
             )
-            client.images.get(exec_object["image"])  # must not throw
-            image_config = client.api.inspect_image(exec_object["image"])["Config"]
+            image = client.api.inspect_image(exec_object["image"])  # must not throw
         except ImageNotFound:
             print("Riptide: Could not pull. The image was not found. Your command will not run :(", file=sys.stderr)
             return 1
@@ -136,6 +166,7 @@ def fg(
             print("    " + str(ex), file=sys.stderr)
             return 1
 
+    image_config = image["Config"]
     command = image_config["Cmd"] if "Cmd" in image_config else None
     if "command" in exec_object:
         if isinstance(exec_object, Service):
@@ -167,23 +198,105 @@ def fg(
         builder.set_env(EENV_USER, str(getuid()))
         builder.set_env(EENV_GROUP, str(getgid()))
 
+    setup_from_daemon(client, builder, project["name"], image["Id"])
+
     if extra_volumes is not None:
         for host, volume in extra_volumes.items():
             builder.set_mount(host, volume["bind"], volume["mode"] or "rw")
 
-    # Using a new thread:
+    def connect_links(container):
+        add_network_links(client, container, None, project["links"], project["name"])
+
+    command_name = exec_object["$name"] if isinstance(exec_object, Command) and "$name" in exec_object else None
+
+    if command_name is not None and command_name in get_warm_commands():
+        try:
+            return _exec_in_runner(
+                client, runners.prepare(client, project["name"], command_name, builder, connect_links)
+            )
+        except (APIError, ExecError) as ex:
+            print(
+                "Riptide: There was an error starting the runner container. Your command will not run :(",
+                file=sys.stderr,
+            )
+            print("    " + str(ex), file=sys.stderr)
+            return 1
+
+    if tty_attach.is_supported() and command_name is not None and command_name in get_pool_commands():
+        try:
+            exit_code = pool.run(client, project["name"], command_name, builder, connect_links)
+        except APIError as ex:
+            print("Riptide: There was an error starting the container. Your command will not run :(", file=sys.stderr)
+            print("    " + str(ex), file=sys.stderr)
+            return 1
+        if exit_code is not None:
+            return exit_code
+
+    if isinstance(exec_object, Command):
+        # Unlike runner and pool containers, the container is bound to this process.
+        builder.set_helper("cmd")
+
+    if tty_attach.is_supported():
+        try:
+            return tty_attach.run_interactive(client, run_create_args(builder), connect_links)
+        except APIError as ex:
+            print("Riptide: There was an error starting the container. Your command will not run :(", file=sys.stderr)
+            print("    " + str(ex), file=sys.stderr)
+            return 1
+
+    # Fallback using the docker CLI. Using a new thread:
     # Add the container link networks after docker run started... I tried a combo of Docker API create and Docker CLI
     # start to make it cleaner, but 'docker start' does not work well for interactive commands at all,
     # so that's the best we can do
-    AddNetLinks(container_name, client, project["links"]).start()
+    AddNetLinks(container_name, client, project["links"], project["name"]).start()
 
     return _spawn(builder.build_docker_cli(True))
 
 
+def run_create_args(builder: ContainerBuilder) -> DockerContainerCreate:
+    """
+    Create arguments of the container of builder for tty_attach.run_interactive. Like the Docker CLI
+    (see ContainerBuilder.build_docker_cli), the command is passed to the entrypoint as one string:
+    The entrypoint splits it itself, a list would have its arguments split again.
+    """
+    create_args = builder.build_docker_api()
+    create_args["command"] = [builder.build_command_string()]
+    return create_args
+
+
+def _exec_in_runner(client, runner_exec: runners.RunnerExec) -> int:
+    if tty_attach.is_supported():
+        return tty_attach.exec_interactive(
+            client,
+            runner_exec["container"],
+            runner_exec["cmd"],
+            user=runner_exec["user"],
+            environment=runner_exec["environment"],
+        )
+    shell = ["docker", "exec", "-i"]
+    if _is_interactive():
+        shell += ["-t"]
+    if runner_exec["user"]:
+        shell += ["-u", runner_exec["user"]]
+    for key, value in runner_exec["environment"].items():
+        shell += ["-e", key + "=" + value]
+    shell += [runner_exec["container"]] + runner_exec["cmd"]
+    return _spawn(shell)
+
+
 def _spawn(shell: list[str]) -> int:
+    if not _is_interactive():
+        # Input or output is redirected: Let the docker CLI use our file descriptors directly,
+        # without relaying every byte through a PTY.
+        sys.stdout.flush()
+        return subprocess.call(shell)
     return pty.spawn(shell, win_repeat_argv0=True)
 
 
+def _is_interactive() -> bool:
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
+
 MAX_RETRIES = 1500
 
 
@@ -205,13 +318,14 @@ def _wait_until_container_exists(client, container_name):
 
 
 class AddNetLinks(threading.Thread):
-    def __init__(self, container_name, client, links):
+    def __init__(self, container_name, client, links, project_name):
         threading.Thread.__init__(self)
         self.links = links
+        self.project_name = project_name
         self.client = client
         self.container_name = container_name
 
     def run(self):
         container = _wait_until_container_exists(self.client, self.container_name)
         if container is not None:
-            add_network_links(self.client, container, None, self.links)
+            add_network_links(self.client, container, None, self.links, self.project_name)
@@ -0,0 +1,113 @@
+"""
+Garbage collection of leftover helper containers.
+
+Helper containers (detached commands, pre_start commands, foreground commands, named volume operations, ...) are
+labelled with the process that created them (see ContainerBuilder.set_helper) and are removed by that process when
+they are done. If the process is killed, they are left behind. collect removes the helper containers of processes
+on this host that no longer exist.
+
+Containers of command pools are shared by all processes and have no owner, see pool for the rules that apply to them.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import platform
+import socket
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from docker import DockerClient
+from docker.errors import APIError
+from riptide_engine_docker.container_builder import (
+    RIPTIDE_DOCKER_LABEL_HELPER,
+    RIPTIDE_DOCKER_LABEL_OWNER,
+    helper_owner,
+)
+from riptide_engine_docker.pool import HELPER_KIND_POOL, POOL_CONTAINER_MAX_AGE, claimer, is_claimed
+
+logger = logging.getLogger(__name__)
+
+# Its thread is joined on exit, so a collection in the background is not cut off.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="riptide_helper_gc")
+
+
+def collect_in_background(client: DockerClient) -> Future[list[str]]:
+    """Runs collect in a background thread. Failures are logged, since usually nobody waits for the result."""
+    future = _executor.submit(collect, client)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def collect(client: DockerClient) -> list[str]:
+    """
+    Removes all helper containers whose owning process is gone, claimed pool containers whose claiming process is
+    gone and unclaimed pool containers older than pool.POOL_CONTAINER_MAX_AGE. Only the collected containers are
+    removed, by ID. Returns the IDs of the removed containers.
+    """
+    try:
+        containers = client.api.containers(all=True, filters={"label": RIPTIDE_DOCKER_LABEL_HELPER})
+    except APIError:
+        return []
+
+    hostname = socket.gethostname()
+    # Owner -> whether it is dead, each owner is only checked once.
+    owners: dict[str, bool] = {}
+    removed: list[str] = []
+    for container in containers:
+        labels = container.get("Labels") or {}
+        if labels.get(RIPTIDE_DOCKER_LABEL_HELPER) == HELPER_KIND_POOL:
+            # Pool containers of older versions still have an owner (the process that created them), it is ignored.
+            if _is_leftover_pool_container(container, hostname):
+                _remove(client, container["Id"], removed)
+            continue
+        owner = labels.get(RIPTIDE_DOCKER_LABEL_OWNER, "")
+        if owner not in owners:
+            owners[owner] = _is_dead(owner, hostname)
+        if owners[owner]:
+            _remove(client, container["Id"], removed)
+    return removed
+
+
+def _is_leftover_pool_container(container: dict, hostname: str) -> bool:
+    name = (container.get("Names") or ["/"])[0].lstrip("/")
+    claimed_by = claimer(name)
+    if claimed_by is not None:
+        return _is_dead(claimed_by, hostname)
+    # Unclaimed or claimed by an older version: Only removed once nobody used the pool for a long time.
+    too_old = time.time() - container.get("Created", 0) > POOL_CONTAINER_MAX_AGE
+    return too_old and (not is_claimed(name) or container.get("State") != "running")
+
+
+def _remove(client: DockerClient, container_id: str, removed: list[str]):
+    try:
+        client.api.remove_container(container_id, force=True)
+        removed.append(container_id)
+    except APIError:
+        # Already gone or being removed.
+        pass
+
+
+def _log_failure(future: Future[list[str]]):
+    error = future.exception()
+    if error is not None:
+        logger.debug("Collecting leftover helper containers failed.", exc_info=error)
+
+
+def _is_dead(owner: str, hostname: str) -> bool:
+    """Whether the owner (see helper_owner) is a process on this host that no longer exists."""
+    owner_host, _, pid = owner.rpartition(":")
+    if owner_host != hostname or not pid.isdigit() or owner == helper_owner():
+        return False
+    if platform.system().lower().startswith("win"):
+        # There is no side effect free way to check for a process here without extra dependencies.
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # Exists, but belongs to another user.
+        return False
+    return False
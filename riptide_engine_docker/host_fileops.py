@@ -0,0 +1,200 @@
+"""
+Removing and copying files directly on the host file system, for path_rm/path_copy.
+
+Files created by containers often belong to root, which is why path_utils runs these operations in root containers.
+Where the current user owns the files involved, that is not needed: rm and copy do as much of the operation as
+possible in-process and return the subtrees that need root, for path_utils to handle with a container.
+Only supported on Linux; elsewhere, permissions of bind mounts are mapped and containers are used for everything.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import platform
+import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from riptide_engine_docker.config import get_host_fileops_enabled
+
+# ioctl to share the data of a file with another on copy-on-write file systems (btrfs, xfs, ...), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+# Maximum number of top-level entries of a directory that are processed concurrently.
+MAX_WORKERS = 8
+
+
+def is_supported() -> bool:
+    return platform.system() == "Linux" and get_host_fileops_enabled()
+
+
+def rm(path: str) -> list[str]:
+    """
+    Removes path (recursively, symlinks are not followed), as far as possible without root.
+    Directories not owned by the current user and entries that can't be removed are left in place.
+    Returns these subtrees; directories containing them are left in place as well.
+    """
+    entries = _scandir_if_owned_dir(path)
+    if entries is None:
+        return _rm_tree(path)
+    remaining = list(chain.from_iterable(_map(_rm_tree, entries)))
+    if remaining:
+        return remaining
+    return _rm_tree(path)
+
+
+def copy(fromm: str, to: str) -> list[tuple[str, str]]:
+    """
+    Copies the contents of the directory fromm into to (created if missing) like `cp -a fromm/. to/`,
+    as far as possible without root. File data is copied using reflinks or copy_file_range where supported.
+    Returns the (source, destination) pairs of the subtrees that still need to be copied:
+    entries not owned by the current user, entries that would overwrite entries not owned by the current user
+    and entries that could not be copied.
+    """
+    entries = _scandir_if_owned_dir(fromm)
+    if entries is None or not _prepare_dir(to):
+        return [(fromm, to)]
+    remaining = list(
+        chain.from_iterable(_map(lambda src: _copy_tree(src, os.path.join(to, os.path.basename(src))), entries))
+    )
+    try:
+        _copy_attributes(fromm, to, os.lstat(fromm))
+    except OSError:
+        return [(fromm, to)]
+    return remaining
+
+
+def _map(fn, paths: list[str]) -> list:
+    """Maps fn over paths, concurrently if there are multiple."""
+    if len(paths) < 2:
+        return [fn(path) for path in paths]
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(paths))) as executor:
+        return list(executor.map(fn, paths))
+
+
+def _owned(st: os.stat_result) -> bool:
+    return st.st_uid == os.getuid()
+
+
+def _scandir_if_owned_dir(path: str) -> list[str] | None:
+    """Paths of the entries of path, if it is a directory (not a symlink) owned by the current user."""
+    try:
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or not _owned(st):
+            return None
+        with os.scandir(path) as it:
+            return [entry.path for entry in it]
+    except OSError:
+        return None
+
+
+def _rm_tree(path: str) -> list[str]:
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return []
+    except OSError:
+        return [path]
+    if stat.S_ISDIR(st.st_mode):
+        if not _owned(st):
+            return [path]
+        try:
+            with os.scandir(path) as it:
+                entries = [entry.path for entry in it]
+        except OSError:
+            return [path]
+        remaining = list(chain.from_iterable(_rm_tree(entry) for entry in entries))
+        if remaining:
+            return remaining
+        remove = os.rmdir
+    else:
+        # Only requires write access to the (owned) parent directory.
+        remove = os.unlink
+    try:
+        remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return [path]
+    return []
+
+
+def _copy_tree(src: str, dst: str) -> list[tuple[str, str]]:
+    try:
+        st = os.lstat(src)
+        if not _owned(st):
+            return [(src, dst)]
+        if stat.S_ISDIR(st.st_mode):
+            if not _prepare_dir(dst):
+                return [(src, dst)]
+            with os.scandir(src) as it:
+                entries = [entry.name for entry in it]
+            remaining = list(
+                chain.from_iterable(_copy_tree(os.path.join(src, n), os.path.join(dst, n)) for n in entries)
+            )
+            # After the entries, since adding them changes the modification time.
+            _copy_attributes(src, dst, st)
+            return remaining
+        try:
+            dst_st: os.stat_result | None = os.lstat(dst)
+        except FileNotFoundError:
+            dst_st = None
+        if dst_st is not None and (not _owned(dst_st) or stat.S_ISDIR(dst_st.st_mode)):
+            return [(src, dst)]
+        if stat.S_ISLNK(st.st_mode):
+            if dst_st is not None:
+                os.unlink(dst)
+            os.symlink(os.readlink(src), dst)
+        elif stat.S_ISREG(st.st_mode):
+            _copy_file(src, dst)
+        else:
+            # Devices, FIFOs and sockets
+            return [(src, dst)]
+        _copy_attributes(src, dst, st)
+    except OSError:
+        return [(src, dst)]
+    return []
+
+
+def _prepare_dir(dst: str) -> bool:
+    """Creates the directory dst to copy a directory into, if missing. Returns False if dst can't be used."""
+    try:
+        dst_st = os.lstat(dst)
+    except FileNotFoundError:
+        try:
+            os.mkdir(dst, 0o700)
+        except OSError:
+            return False
+        return True
+    except OSError:
+        return False
+    return stat.S_ISDIR(dst_st.st_mode) and _owned(dst_st)
+
+
+def _copy_file(src: str, dst: str):
+    """Copies the data of the regular file src to dst, sharing the data with a reflink if possible."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024) > 0:
+                pass
+            return
+        except OSError:
+            # Not supported by the kernel or the file systems, start over with a plain copy.
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def _copy_attributes(src: str, dst: str, st: os.stat_result):
+    """Copies the group, permissions and timestamps of src to dst, as cp -a does."""
+    dst_st = os.lstat(dst)
+    if dst_st.st_gid != st.st_gid:
+        os.lchown(dst, -1, st.st_gid)
+    shutil.copystat(src, dst, follow_symlinks=False)
@@ -0,0 +1,12 @@
+"""Location of the shared hosts file fragment on the host system (see hosts_file)."""
+
+import os
+
+from riptide.config.files import riptide_config_dir
+
+HOSTS_FILE_NAME = "hosts"
+
+
+def riptide_docker_hosts_dir() -> str:
+    """Host path of the directory containing the hosts file fragment."""
+    return os.path.join(riptide_config_dir(), "docker_hosts")
@@ -0,0 +1,120 @@
+"""
+Module for the shared hosts file fragment.
+
+The fragment contains all hostnames that must be routable to the host system inside of containers
+(see riptide.config.hosts.get_localhost_hosts). It is generated by the engine, mounted read-only into all containers
+and merged into /etc/hosts by the entrypoint.
+"""
+
+import os
+import platform
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from docker import DockerClient
+from docker.errors import APIError
+from riptide.config.hosts import get_localhost_hosts
+from riptide_engine_docker.container_builder import (
+    ENTRYPOINT_CONTAINER_PATH,
+    HOSTS_DIR_CONTAINER_PATH,
+    RIPTIDE_DOCKER_LABEL_IS_RIPTIDE,
+)
+from riptide_engine_docker.hosts_dir import HOSTS_FILE_NAME, riptide_docker_hosts_dir
+
+# If set, the entrypoint only merges the hosts file fragment into /etc/hosts and exits
+EENV_HOSTS_SYNC_ONLY = "RIPTIDE__DOCKER_HOSTS_SYNC_ONLY"
+# Maximum number of running containers that are told to merge a new fragment at once
+SYNC_WORKERS = 8
+
+_update_lock = threading.Lock()
+# Signature (see _signature) of the system hosts file and the fragment as of the last update
+_last_signature: tuple | None = None
+
+
+def update(client: DockerClient) -> None:
+    """
+    Regenerates the hosts file fragment, if the system hosts file (or the fragment) changed since the last update.
+    The file is only written if the content changed and is replaced atomically.
+    If it changed, running Riptide containers are told to merge the new fragment into their /etc/hosts,
+    in the background.
+    """
+    global _last_signature
+    hosts_dir = riptide_docker_hosts_dir()
+    path = os.path.join(hosts_dir, HOSTS_FILE_NAME)
+
+    with _update_lock:
+        signature = _signature(path)
+        if signature is not None and signature == _last_signature:
+            return
+
+        content = " ".join(get_localhost_hosts()) + "\n"
+        try:
+            with open(path) as f:
+                changed = f.read() != content
+        except FileNotFoundError:
+            changed = True
+
+        if changed:
+            os.makedirs(hosts_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=hosts_dir, prefix="." + HOSTS_FILE_NAME)
+            with os.fdopen(fd, "w") as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            # The directory is mounted, not the file, so containers see the replaced file.
+            os.replace(tmp_path, path)
+        _last_signature = _signature(path)
+
+    if changed:
+        # Not daemonic, so that the containers are updated before the process exits.
+        threading.Thread(target=_sync_running_containers, args=(client,), name="riptide_hosts_sync").start()
+
+
+def _signature(path: str) -> tuple | None:
+    """Identifies the current versions of the system hosts file and the fragment at path, None if unknown."""
+    try:
+        system_hosts = os.stat(_system_hosts_path())
+    except OSError:
+        return None
+    try:
+        fragment = os.stat(path)
+    except OSError:
+        return None
+    return (
+        (system_hosts.st_ino, system_hosts.st_mtime_ns, system_hosts.st_size),
+        (fragment.st_ino, fragment.st_mtime_ns, fragment.st_size),
+    )
+
+
+def _system_hosts_path() -> str:
+    """The hosts file of the system, that get_localhost_hosts reads."""
+    if platform.system() == "Windows":
+        return os.path.join(os.environ.get("SystemRoot", r"C:\Windows"), "System32", "drivers", "etc", "hosts")
+    return "/etc/hosts"
+
+
+def _sync_running_containers(client: DockerClient) -> None:
+    try:
+        containers = client.api.containers(filters={"label": RIPTIDE_DOCKER_LABEL_IS_RIPTIDE, "status": "running"})
+    except APIError:
+        return
+    container_ids = [
+        container["Id"]
+        for container in containers
+        if any(mount.get("Destination") == HOSTS_DIR_CONTAINER_PATH for mount in container.get("Mounts") or [])
+    ]
+    if len(container_ids) == 0:
+        return
+    with ThreadPoolExecutor(max_workers=min(SYNC_WORKERS, len(container_ids))) as executor:
+        executor.map(lambda container_id: _sync_container(client, container_id), container_ids)
+
+
+def _sync_container(client: DockerClient, container_id: str) -> None:
+    try:
+        exec_id = client.api.exec_create(
+            container_id, [ENTRYPOINT_CONTAINER_PATH], user="0", environment={EENV_HOSTS_SYNC_ONLY: "1"}
+        )["Id"]
+        client.api.exec_start(exec_id)
+    except APIError:
+        # The container may have stopped in the meantime.
+        pass
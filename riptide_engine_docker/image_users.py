@@ -0,0 +1,69 @@
+"""
+Module for reading the users and groups of images.
+
+The container builder uses them to generate the entries for the Riptide user, so that the entrypoint doesn't have to
+run any user management tools. The result is cached on disk per image ID, since images are immutable.
+"""
+
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from docker import DockerClient
+from docker.errors import APIError, NotFound
+from riptide.config.files import riptide_config_dir
+from riptide_engine_docker.container_builder import helper_labels
+
+IMAGE_USERS_CACHE_DIR_NAME = "docker_image_users"
+
+
+def image_users(client: DockerClient, image_id: str) -> tuple[str, str] | None:
+    """
+    Returns the contents of /etc/passwd and /etc/group of the image with the given ID.
+    Returns None if the image doesn't contain them, in which case the entrypoint creates the user itself.
+    """
+    cache_dir = os.path.join(riptide_config_dir(), IMAGE_USERS_CACHE_DIR_NAME)
+    cache_path = os.path.join(cache_dir, image_id.replace("sha256:", "") + ".json")
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        return None if cached is None else (cached["passwd"], cached["group"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    result = _read_from_image(client, image_id)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".image_users")
+    with os.fdopen(fd, "w") as f:
+        json.dump(None if result is None else {"passwd": result[0], "group": result[1]}, f)
+    os.replace(tmp_path, cache_path)
+    return result
+
+
+def _read_from_image(client: DockerClient, image_id: str) -> tuple[str, str] | None:
+    # The container is never started, so the command doesn't matter.
+    container = client.api.create_container(
+        image_id, command=["true"], entrypoint="", labels=helper_labels("image_users")
+    )
+    try:
+        return _read_file(client, container["Id"], "/etc/passwd"), _read_file(client, container["Id"], "/etc/group")
+    except (NotFound, KeyError):
+        return None
+    finally:
+        try:
+            client.api.remove_container(container["Id"], force=True)
+        except APIError:
+            pass
+
+
+def _read_file(client: DockerClient, container_id: str, path: str) -> str:
+    stream, _ = client.api.get_archive(container_id, path)
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+        member = tar.extractfile(os.path.basename(path))
+        if member is None:
+            # e.g. a symlink
+            raise KeyError(path)
+        return member.read().decode()
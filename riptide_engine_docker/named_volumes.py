@@ -3,38 +3,145 @@ Module for manipulating and listing Docker named volumes. For function docs, see
 """
 
 import builtins
+import gzip
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import TypedDict
+from weakref import WeakKeyDictionary
 
 from docker import DockerClient
-from docker.errors import ContainerError, NotFound
+from docker.errors import NotFound
 from riptide.engine.abstract import ExecError
 from riptide_engine_docker.container_builder import (
     RIPTIDE_DOCKER_LABEL_IS_RIPTIDE,
     ContainerBuilder,
 )
 from riptide_engine_docker.path_utils import IMAGE as PATH_UTILS_IMAGE
+from riptide_engine_docker.volume_names import (
+    NAMED_VOLUME_INTERNAL_PREFIX,
+    RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER,
+    RIPTIDE_DOCKER_LABEL_VOLUME_BASE,
+    RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF,
+)
+
+# Where the named volume is mounted in the (never started) container used for snapshots.
+# Snapshot archives contain the volume contents below this directory name.
+SNAPSHOT_CONTAINER_PATH = "/riptide_volume"
+# Fast compression; snapshots are mostly database files and speed matters more than size here.
+SNAPSHOT_COMPRESSLEVEL = 1
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024
+CLONE_UPPER_SUFFIX = "__upper"
+CLONE_WORK_SUFFIX = "__work"
+# Number of seconds the results of list_with_usage and clone_bases are reused
+VOLUME_USAGE_CACHE_TTL = 10
+
+
+class NamedVolumeInfo(TypedDict):
+    name: str
+    # Size in bytes, -1 if not known (e.g. for volumes not managed by the local driver)
+    size: int
+    # Number of containers referencing the volume
+    ref_count: int
+    # Names of the containers referencing the volume
+    containers: builtins.list[str]
+    created_at: str
+    # Name of the volume this volume is a clone of (see clone)
+    base: str | None
 
-NAMED_VOLUME_INTERNAL_PREFIX = "riptide__"
+
+_usage_cache: "WeakKeyDictionary[DockerClient, tuple[float, builtins.list[NamedVolumeInfo]]]" = WeakKeyDictionary()
+_usage_cache_lock = threading.Lock()
+_clone_bases_cache: "WeakKeyDictionary[DockerClient, tuple[float, set[str]]]" = WeakKeyDictionary()
 
 
 def list(client: DockerClient) -> builtins.list[str]:
     volumes = client.volumes.list(filters={"label": RIPTIDE_DOCKER_LABEL_IS_RIPTIDE})
     volumes_wo_prefix = []
-    len_prefix = len(NAMED_VOLUME_INTERNAL_PREFIX)
     for v in volumes:
-        if v.name.startswith(NAMED_VOLUME_INTERNAL_PREFIX):
-            volumes_wo_prefix.append(v.name[len_prefix:])
-        else:
-            # ???
-            volumes_wo_prefix.append(v.name)
+        if _is_internal(v.attrs.get("Labels") or {}):
+            continue
+        volumes_wo_prefix.append(_strip_prefix(v.name))
     return volumes_wo_prefix
 
 
-def delete(client: DockerClient, name: str) -> None:
+def list_with_usage(client: DockerClient) -> builtins.list[NamedVolumeInfo]:
+    """
+    Lists all named volumes with their disk usage and the containers using them.
+
+    Uses a single system df call, the result is cached for VOLUME_USAGE_CACHE_TTL seconds (or until a volume is
+    changed by this module).
+    """
+    with _usage_cache_lock:
+        cached = _usage_cache.get(client)
+        if cached is not None and time.time() - cached[0] < VOLUME_USAGE_CACHE_TTL:
+            return cached[1]
+
+        df = client.df()
+        containers_by_volume: dict[str, builtins.list[str]] = {}
+        for container in df.get("Containers") or []:
+            for mount in container.get("Mounts") or []:
+                if mount.get("Type") == "volume":
+                    containers_by_volume.setdefault(mount["Name"], []).append(container["Names"][0].lstrip("/"))
+
+        infos: builtins.list[NamedVolumeInfo] = []
+        for volume in df.get("Volumes") or []:
+            labels = volume.get("Labels") or {}
+            if RIPTIDE_DOCKER_LABEL_IS_RIPTIDE not in labels or _is_internal(labels):
+                continue
+            usage = volume.get("UsageData") or {}
+            infos.append(
+                {
+                    "name": _strip_prefix(volume["Name"]),
+                    "size": usage.get("Size", -1),
+                    "ref_count": usage.get("RefCount", -1),
+                    "containers": containers_by_volume.get(volume["Name"], []),
+                    "created_at": volume.get("CreatedAt", ""),
+                    "base": labels.get(RIPTIDE_DOCKER_LABEL_VOLUME_BASE),
+                }
+            )
+        _usage_cache[client] = (time.time(), infos)
+        return infos
+
+
+def _invalidate_usage_cache(client: DockerClient):
+    with _usage_cache_lock:
+        _usage_cache.pop(client, None)
+        _clone_bases_cache.pop(client, None)
+
+
+def list_bases(client: DockerClient) -> dict[str, str]:
+    """Returns the names of all clones (see clone), mapped to the name of the volume they are based on."""
+    volumes = client.volumes.list(filters={"label": RIPTIDE_DOCKER_LABEL_VOLUME_BASE})
+    return {_strip_prefix(v.name): v.attrs["Labels"][RIPTIDE_DOCKER_LABEL_VOLUME_BASE] for v in volumes}
+
+
+def delete(client: DockerClient, name: str, cascade: bool = False) -> None:
+    """
+    Deletes the named volume. If it is the base of clones (see clone), the clones are deleted as well if cascade is
+    set, otherwise an ExecError is raised.
+    """
+    dependents = client.volumes.list(filters={"label": f"{RIPTIDE_DOCKER_LABEL_VOLUME_BASE}={name}"})
+    if len(dependents) > 0:
+        if not cascade:
+            raise ExecError(
+                f"The named volume {name} is the base of the named volumes "
+                f"{', '.join(_strip_prefix(v.name) for v in dependents)}. Delete them first."
+            )
+        for dependent in dependents:
+            delete(client, _strip_prefix(dependent.name), cascade=True)
     try:
         client.volumes.get(NAMED_VOLUME_INTERNAL_PREFIX + name).remove(True)
     except NotFound:
         # this is fine.
         pass
+    finally:
+        _invalidate_usage_cache(client)
+    for layer in client.volumes.list(filters={"label": f"{RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF}={name}"}):
+        layer.remove(True)
 
 
 def exists(client: DockerClient, name: str) -> bool:
@@ -45,22 +152,94 @@ def exists(client: DockerClient, name: str) -> bool:
         return False
 
 
-def copy(client: DockerClient, from_name: str, target_name: str) -> None:
+# Shell script doing the actual copy inside a container. First prints "TOTAL <files> <bytes>" (the estimate
+# of what will be transferred), then one line per transferred file (verbose output of the extracting tar).
+# A tar pipe is used instead of cp, since it streams many small files much faster.
+# In incremental mode, only files whose mtime or size differ are transferred and files no longer in the
+# source are removed from the target.
+COPY_SCRIPT = """
+set -e -o pipefail
+cd /copy_from
+if [ "$1" = "incremental" ]; then
+    find . ! -type d -exec stat -c '%Y %s %n' {} + | sort > /tmp/from
+    (cd /copy_to && find . ! -type d -exec stat -c '%Y %s %n' {} +) | sort > /tmp/to
+    find . | sort > /tmp/from_names
+    (cd /copy_to && find .) | sort > /tmp/to_names
+    comm -13 /tmp/from_names /tmp/to_names | (cd /copy_to && while IFS= read -r p; do rm -rf "$p"; done)
+    comm -23 /tmp/from_names /tmp/to_names | while IFS= read -r p; do
+        if [ -d "$p" ] && [ ! -L "$p" ]; then
+            mkdir -p "/copy_to/$p"
+            chown "$(stat -c '%u:%g' "$p")" "/copy_to/$p"
+            chmod "$(stat -c '%a' "$p")" "/copy_to/$p"
+        fi
+    done
+    comm -23 /tmp/from /tmp/to > /tmp/changed
+    cut -d' ' -f3- /tmp/changed > /tmp/list
+    awk '{s+=$2} END {print "TOTAL", NR, s+0}' /tmp/changed
+    if [ -s /tmp/list ]; then
+        tar -cf - -T /tmp/list | tar -xvpf - -C /copy_to
+    fi
+else
+    find . -exec stat -c '%s %F' {} + | awk '{n++} $2 != "directory" {s+=$1} END {print "TOTAL", n, s+0}'
+    tar -cf - . | tar -xvpf - -C /copy_to
+fi
+"""
+COPY_TOTAL_PREFIX = "TOTAL "
+
+
+def copy(
+    client: DockerClient,
+    from_name: str,
+    target_name: str,
+    incremental: bool = False,
+    progress: Callable[[int, int, int], None] | None = None,
+) -> None:
+    """
+    Copies the named volume from_name to target_name and waits until the copy is done.
+
+    If incremental is set, target_name may already exist; only changed files are transferred then.
+    progress is called with (files copied, estimated total files, estimated total bytes) during the copy.
+    """
     if not exists(client, from_name):
         raise FileExistsError(f"The named volume {from_name} does not exist.")
-    if exists(client, target_name):
+    if not incremental and exists(client, target_name):
         raise FileExistsError(f"The named volume {target_name} already exists.")
+    if incremental and target_name in clone_bases(client, use_cache=False):
+        raise ExecError(f"The named volume {target_name} is the base of clones and can not be changed.")
 
-    builder = ContainerBuilder(PATH_UTILS_IMAGE, "cp -a /copy_from/. /copy_to/")
-    builder.set_named_volume_mount(from_name, "/copy_from", "rw")
+    builder = ContainerBuilder(
+        PATH_UTILS_IMAGE, ["sh", "-c", COPY_SCRIPT, "sh", "incremental" if incremental else "full"]
+    )
+    builder.set_named_volume_mount(from_name, "/copy_from", "ro")
     builder.set_named_volume_mount(target_name, "/copy_to", "rw")
+    builder.set_helper("volume_copy")
 
+    container = client.containers.create(**builder.build_docker_api())  # type: ignore
+    _invalidate_usage_cache(client)
     try:
-        container = client.containers.create(**builder.build_docker_api())  # type: ignore
         container.start()
+        files_total = 0
+        bytes_total = 0
+        files_done = 0
+        buffer = b""
+        for chunk in container.logs(stdout=True, stderr=False, stream=True, follow=True):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.startswith(COPY_TOTAL_PREFIX.encode()) and files_total == 0:
+                    _, files, size = line.decode().split(" ")
+                    files_total = int(files)
+                    bytes_total = int(size)
+                else:
+                    files_done = min(files_done + 1, files_total)
+                if progress is not None:
+                    progress(files_done, files_total, bytes_total)
+        result = container.wait()
+        if result["StatusCode"] != 0:
+            stderr = container.logs(stdout=False, stderr=True).decode(errors="replace")
+            raise ExecError(f"Error copying the named volume {from_name} -> {target_name}: {stderr}")
+    finally:
         container.remove(force=True)
-    except ContainerError as err:
-        raise ExecError(f"Error copying the named volume {from_name} -> {target_name}: {err.stderr}") from err
 
 
 def create(client: DockerClient, name: str) -> None:
@@ -68,3 +247,163 @@ def create(client: DockerClient, name: str) -> None:
         raise FileExistsError(f"The named volume {name} already exists.")
 
     client.volumes.create(NAMED_VOLUME_INTERNAL_PREFIX + name, labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"})
+    _invalidate_usage_cache(client)
+
+
+def clone(client: DockerClient, base_name: str, target_name: str) -> None:
+    """
+    Creates target_name as a copy-on-write clone of base_name.
+
+    The clone is an overlay volume, with base_name as the (read-only) lower layer and two internal volumes as
+    upper and work layer. Creating it takes constant time and only changes made to the clone use disk space.
+    The base must not be changed while clones of it exist: It is mounted read-only from now on
+    (see protect_clone_bases) and can't be deleted (see delete).
+    Only supported by Docker daemons running on Linux (incl. the VM of Docker Desktop).
+    """
+    if not exists(client, base_name):
+        raise FileExistsError(f"The named volume {base_name} does not exist.")
+    if exists(client, target_name):
+        raise FileExistsError(f"The named volume {target_name} already exists.")
+
+    base = client.volumes.get(NAMED_VOLUME_INTERNAL_PREFIX + base_name)
+    # Containers started from now on mount the base read-only (see protect_clone_bases), running ones may not.
+    writers = [
+        container["Names"][0].lstrip("/")
+        for container in client.api.containers(filters={"volume": base.name})
+        if any(mount.get("Name") == base.name and mount.get("RW") for mount in container.get("Mounts") or [])
+    ]
+    if len(writers) > 0:
+        raise ExecError(
+            f"The named volume {base_name} is mounted writable by the containers {', '.join(writers)}. "
+            "Stop them before cloning it."
+        )
+    _invalidate_usage_cache(client)
+    layer_labels = {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF: target_name}
+    upper = client.volumes.create(NAMED_VOLUME_INTERNAL_PREFIX + target_name + CLONE_UPPER_SUFFIX, labels=layer_labels)
+    work = client.volumes.create(NAMED_VOLUME_INTERNAL_PREFIX + target_name + CLONE_WORK_SUFFIX, labels=layer_labels)
+    try:
+        client.volumes.create(
+            NAMED_VOLUME_INTERNAL_PREFIX + target_name,
+            driver="local",
+            driver_opts={
+                "type": "overlay",
+                "device": "overlay",
+                "o": f"lowerdir={_lowerdirs(base)},upperdir={upper.attrs['Mountpoint']},"
+                f"workdir={work.attrs['Mountpoint']}",
+            },
+            labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_VOLUME_BASE: base_name},
+        )
+    except BaseException:
+        upper.remove(True)
+        work.remove(True)
+        raise
+
+
+def clone_bases(client: DockerClient, use_cache: bool = True) -> set[str]:
+    """
+    Names of the named volumes that are the base of clones (see clone).
+    The result is cached like the one of list_with_usage, unless use_cache is unset.
+    """
+    with _usage_cache_lock:
+        cached = _clone_bases_cache.get(client)
+        if use_cache and cached is not None and time.time() - cached[0] < VOLUME_USAGE_CACHE_TTL:
+            return cached[1]
+    bases = {
+        volume.attrs["Labels"][RIPTIDE_DOCKER_LABEL_VOLUME_BASE]
+        for volume in client.volumes.list(filters={"label": RIPTIDE_DOCKER_LABEL_VOLUME_BASE})
+    }
+    with _usage_cache_lock:
+        _clone_bases_cache[client] = (time.time(), bases)
+    return bases
+
+
+def protect_clone_bases(client: DockerClient, builder: ContainerBuilder) -> None:
+    """
+    Makes the builder mount named volumes that are the base of clones read-only. Clones use the data of their base
+    as the lower layer of an overlay, which must not change while the overlay exists.
+    """
+    if len(builder.named_volumes_in_cnt) > 0:
+        builder.set_read_only_volumes(clone_bases(client))
+
+
+def _lowerdirs(volume) -> str:
+    """Lower layer(s) for a clone of the volume. Clones of clones stack all layers instead of nesting overlays."""
+    if RIPTIDE_DOCKER_LABEL_VOLUME_BASE not in (volume.attrs.get("Labels") or {}):
+        return volume.attrs["Mountpoint"]
+    opts = dict(opt.split("=", 1) for opt in volume.attrs["Options"]["o"].split(","))
+    return opts["upperdir"] + ":" + opts["lowerdir"]
+
+
+def _is_internal(labels: dict[str, str]) -> bool:
+    """Internal volumes (layers of clones, overlay upper layers) are not listed."""
+    return RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF in labels or RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER in labels
+
+
+def _strip_prefix(volume_name: str) -> str:
+    if volume_name.startswith(NAMED_VOLUME_INTERNAL_PREFIX):
+        return volume_name[len(NAMED_VOLUME_INTERNAL_PREFIX) :]
+    # ???
+    return volume_name
+
+
+def snapshot(client: DockerClient, name: str, path: str) -> None:
+    """
+    Writes the contents of the named volume to path, as a gzip-compressed tar archive.
+
+    The archive is streamed from the Docker daemon and compressed on the fly, memory usage doesn't depend on the
+    size of the volume. path is only replaced once the snapshot is complete.
+    """
+    if not exists(client, name):
+        raise FileNotFoundError(f"The named volume {name} does not exist.")
+
+    with _volume_container(client, name, "ro") as container_id:
+        stream, _ = client.api.get_archive(container_id, SNAPSHOT_CONTAINER_PATH, chunk_size=SNAPSHOT_CHUNK_SIZE)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".riptide_snapshot")
+        try:
+            with (
+                os.fdopen(fd, "wb") as raw,
+                gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=SNAPSHOT_COMPRESSLEVEL) as f,
+            ):
+                for chunk in stream:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def restore(client: DockerClient, path: str, name: str) -> None:
+    """
+    Creates the named volume name from a snapshot created with snapshot.
+
+    The compressed archive is streamed to the Docker daemon as-is, which decompresses and extracts it.
+
+    :raises: FileExistsError: If 'name' already exists.
+    """
+    if exists(client, name):
+        raise FileExistsError(f"The named volume {name} already exists.")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"The snapshot {path} does not exist.")
+
+    create(client, name)
+    try:
+        with _volume_container(client, name, "rw") as container_id, open(path, "rb") as f:
+            # The archive contains the volume root directory, so it is extracted into its parent.
+            if not client.api.put_archive(container_id, os.path.dirname(SNAPSHOT_CONTAINER_PATH), f):
+                raise ExecError(f"Error restoring the named volume {name} from {path}.")
+    except BaseException:
+        delete(client, name)
+        raise
+
+
+@contextmanager
+def _volume_container(client: DockerClient, name: str, mode: str) -> Iterator[str]:
+    """Creates (but doesn't start) a container with the named volume mounted and yields its ID."""
+    builder = ContainerBuilder(PATH_UTILS_IMAGE, "true")
+    builder.set_named_volume_mount(name, SNAPSHOT_CONTAINER_PATH, mode)
+    builder.set_helper("volume_archive")
+    container = client.containers.create(**builder.build_docker_api())  # type: ignore
+    try:
+        yield container.id  # type: ignore
+    finally:
+        container.remove(force=True)
@@ -1,42 +1,325 @@
+import threading
+import time
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+
 import docker.errors
 from docker import DockerClient
 from docker.errors import NotFound
 from docker.models.containers import Container
+from docker.utils import version_gte
+from riptide_engine_docker.config import NETWORK_MODE_HUB, get_network_mode
 from riptide_engine_docker.container_builder import (
+    HOST_GATEWAY,
     RIPTIDE_DOCKER_LABEL_IS_RIPTIDE,
+    DockerContainerCreate,
     get_network_name,
 )
 
+# Prefix shared by the names of all project networks managed by Riptide
+NETWORK_NAME_PREFIX = get_network_name("")
+# Name of the network shared by all projects in the "hub" network mode
+HUB_NETWORK_NAME = "riptide_hub"
+# Minimum number of seconds between two event syncs of a network index
+NETWORK_INDEX_SYNC_INTERVAL = 5
+# First Docker API version supporting the "host-gateway" extra hosts value (Docker 20.10)
+HOST_GATEWAY_MIN_API_VERSION = "1.41"
+# Used if the host gateway can not be determined otherwise
+FALLBACK_HOST_GATEWAY = "172.17.0.1"
 
-def start(client: DockerClient, project_name: str):
-    net_name = get_network_name(project_name)
+
+class NetworkIndex:
+    """
+    Index of all Riptide networks (name -> ID) for one Docker client.
+
+    The index is built with a single list call. Afterwards it is kept up to date by replaying the network
+    create/destroy events of the Docker daemon (at most every NETWORK_INDEX_SYNC_INTERVAL seconds) and by the
+    networks created by the engine itself, so that resolving links doesn't need to list networks.
+    Until the next sync, networks removed by others may still be in the index, see create_container.
+    """
+
+    def __init__(self, client: DockerClient):
+        self.client = client
+        self.lock = threading.RLock()
+        # Held while talking to the daemon for a sync, so that lookups (and lock) don't wait for it.
+        self._sync_lock = threading.Lock()
+        # Held while creating a network, so that threads of this process don't race each other.
+        # Never held together with lock, lookups while holding it may sync.
+        self.create_lock = threading.Lock()
+        self._ids: dict[str, str] | None = None
+        self._synced_at = 0.0
+        self._batch_depth = 0
+        self.host_gateway: str | None = None
+
+    def get(self, name: str) -> str | None:
+        """Returns the ID of the network with the given name or None if it doesn't exist."""
+        while True:
+            self._sync()
+            with self.lock:
+                # Otherwise invalidated while syncing.
+                if self._ids is not None:
+                    return self._ids.get(name)
+
+    def on_created(self, name: str, net_id: str):
+        with self.lock:
+            if self._ids is not None:
+                self._ids[name] = net_id
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager. While active, the index is not re-synced with the daemon, so that
+        all operations in the batch share the result of one check.
+        """
+        with self.lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batch_depth -= 1
+
+    def invalidate(self):
+        """Drop the index, the next lookup rebuilds it from scratch."""
+        with self.lock:
+            self._ids = None
+
+    def _sync(self):
+        with self.lock:
+            if self._ids is not None and (
+                self._batch_depth > 0 or time.time() - self._synced_at < NETWORK_INDEX_SYNC_INTERVAL
+            ):
+                return
+        if self._ids is None:
+            # Nothing to work with without the index, wait for a concurrent sync.
+            self._sync_lock.acquire()
+        elif not self._sync_lock.acquire(blocking=False):
+            # Another thread is syncing, use the index as it is until then.
+            return
+        try:
+            now = time.time()
+            with self.lock:
+                ids = self._ids
+                since = self._synced_at
+            if ids is None:
+                ids = self._list()
+                with self.lock:
+                    self._ids = ids
+                    self._synced_at = now
+            elif now - since >= NETWORK_INDEX_SYNC_INTERVAL:
+                # Replay everything since the last sync (with a small overlap to be safe against clock
+                # differences). Only past events are requested, so the daemon doesn't keep the stream open.
+                # Events newer than until are included in the next sync, thanks to the overlap.
+                events = list(
+                    self.client.events(
+                        since=int(since) - 1,
+                        until=int(now),
+                        filters={"type": "network", "event": ["create", "destroy"]},
+                        decode=True,
+                    )
+                )
+                with self.lock:
+                    if self._ids is not None:
+                        # Events are applied in order, so the last event for a name always wins.
+                        for event in events:
+                            name = event.get("Actor", {}).get("Attributes", {}).get("name", "")
+                            if not _is_riptide_network(name):
+                                continue
+                            if event.get("Action") == "create":
+                                self._ids[name] = event["Actor"]["ID"]
+                            elif event.get("Action") == "destroy":
+                                self._ids.pop(name, None)
+                        self._synced_at = now
+        finally:
+            self._sync_lock.release()
+
+    def _list(self) -> dict[str, str]:
+        return {
+            net["Name"]: net["Id"]
+            for net in self.client.api.networks(filters={"name": "riptide", "type": "custom"})
+            if _is_riptide_network(net["Name"])
+        }
+
+
+_network_indexes: "WeakKeyDictionary[DockerClient, NetworkIndex]" = WeakKeyDictionary()
+_network_indexes_lock = threading.Lock()
+
+
+def network_index(client: DockerClient) -> NetworkIndex:
+    """Returns the network index of the given client (and thus of the engine owning it)."""
+    with _network_indexes_lock:
+        if client not in _network_indexes:
+            _network_indexes[client] = NetworkIndex(client)
+        return _network_indexes[client]
+
+
+def ensure(client: DockerClient, project_name: str) -> str:
+    """
+    Makes sure the network of the project exists and returns its ID.
+
+    Networks already known to the network index are not checked again. If they were removed since the index last
+    saw them, creating containers in them fails once and re-creates them, see create_container.
+    If another process creates the network at the same time, the network created by it is used.
+    """
+    return _ensure_network(client, get_network_name(project_name))
+
+
+def ensure_hub(client: DockerClient) -> str:
+    """Makes sure the shared hub network exists and returns its ID. See ensure."""
+    return _ensure_network(client, HUB_NETWORK_NAME)
+
+
+def _ensure_network(client: DockerClient, net_name: str) -> str:
+    index = network_index(client)
+    net_id = index.get(net_name)
+    if net_id is not None:
+        return net_id
+    with index.create_lock:
+        # Created by another thread while waiting for the lock?
+        net_id = index.get(net_name)
+        if net_id is not None:
+            return net_id
+        try:
+            net_id = client.api.create_network(
+                net_name,
+                driver="bridge",
+                attachable=True,
+                check_duplicate=True,
+                labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"},
+            )["Id"]
+        except docker.errors.APIError as err:
+            if err.status_code != 409:
+                raise
+            # Lost the race against someone else creating it.
+            net_id = client.api.inspect_network(net_name)["Id"]
+        assert net_id is not None
+        index.on_created(net_name, net_id)
+        return net_id
+
+
+def host_gateway(client: DockerClient, project_name: str) -> str:
+    """
+    Returns the address under which containers can reach the host system. Resolved once per engine.
+
+    Uses Docker's "host-gateway" if the daemon supports it, otherwise the gateway of the project network.
+    """
+    index = network_index(client)
+    with index.lock:
+        if index.host_gateway is not None:
+            return index.host_gateway
+    # Resolved outside of the lock, concurrent calls resolve the same value.
+    if version_gte(client.api.api_version, HOST_GATEWAY_MIN_API_VERSION):
+        gateway = HOST_GATEWAY
+    else:
+        try:
+            ipam_config = client.api.inspect_network(get_network_name(project_name))["IPAM"]["Config"]
+            gateway = ipam_config[0]["Gateway"]
+        except (NotFound, KeyError, IndexError):
+            return FALLBACK_HOST_GATEWAY
+    with index.lock:
+        index.host_gateway = gateway
+    return gateway
+
+
+def create_container(client: DockerClient, create_args: DockerContainerCreate) -> Container:
+    """
+    Creates a container from create_args (see ContainerBuilder.build_docker_api).
+
+    If the daemon doesn't know the Riptide network of the container, because it was removed since the network index
+    last saw it (e.g. by "docker network prune" or another process), the index is rebuilt, the network is created
+    again and creating the container is retried once.
+    """
     try:
-        client.networks.get(net_name)
-    except NotFound:
-        client.networks.create(
-            net_name, driver="bridge", attachable=True, labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"}
-        )
+        return client.containers.create(**create_args)  # type: ignore
+    except NotFound as err:
+        net_name = create_args.get("network")
+        if net_name is None or not _is_riptide_network(net_name) or "network" not in str(err.explanation):
+            raise
+    network_index(client).invalidate()
+    _ensure_network(client, net_name)
+    return client.containers.create(**create_args)  # type: ignore
 
 
 def collect_names_for_links(client: DockerClient, links: list[str]) -> list[str]:
     """Collects a list of Docker networks for all known Riptide projects."""
-    names = [get_network_name(p) for p in links]
-    if len(names) > 0:
-        return [n.name for n in client.networks.list(names=names, filters={"type": "custom"}) if n.name is not None]
-    return []
+    return list(collect_ids_for_links(client, links).keys())
+
+
+def collect_ids_for_links(client: DockerClient, links: list[str]) -> dict[str, str]:
+    """Collects the names and IDs of the Docker networks of all linked Riptide projects that exist."""
+    index = network_index(client)
+    ids = {}
+    for name in (get_network_name(p) for p in links):
+        net_id = index.get(name)
+        if net_id is not None:
+            ids[name] = net_id
+    return ids
+
+
+def hub_alias(name: str, project_name: str) -> str:
+    """Project-qualified DNS alias of a service container in the hub network."""
+    return name + "." + project_name
 
 
-def add_network_links(client: DockerClient, container: Container, name: str | None, links: list[str]):
-    """Adds a project to all container networks specified in the links. Links is a list of Riptide projects."""
-    for network_name in collect_names_for_links(client, links):
+def add_network_links(
+    client: DockerClient, container: Container, name: str | None, links: list[str], project_name: str
+):
+    """
+    Adds a project to all container networks specified in the links. Links is a list of Riptide projects.
+
+    In the "hub" network mode, the container is instead added to the shared hub network (if it has links or is a
+    named service container). There services are reachable under their project-qualified alias (see hub_alias).
+    """
+    if get_network_mode() == NETWORK_MODE_HUB:
+        if len(links) > 0 or name is not None:
+            alias = hub_alias(name, project_name) if name is not None else None
+            try:
+                _connect(client, container, ensure_hub(client), alias)
+            except NotFound:
+                network_index(client).invalidate()
+                _connect(client, container, ensure_hub(client), alias)
+        return
+    for network_name, net_id in collect_ids_for_links(client, links).items():
         try:
-            if name is not None:
-                client.networks.get(network_name).connect(container, aliases=[name])
-            else:
-                client.networks.get(network_name).connect(container)
-        except docker.errors.APIError as err:
-            if err.status_code == 403 and err.explanation is not None and "already exists" in err.explanation:
-                # This can happen sometimes.
-                pass
-            else:
-                raise
+            _connect(client, container, net_id, name)
+        except NotFound:
+            # The index was stale, the network was removed or re-created in the meantime.
+            index = network_index(client)
+            index.invalidate()
+            new_id = index.get(network_name)
+            if new_id is not None:
+                _connect(client, container, new_id, name)
+
+
+def connect(client: DockerClient, container: Container, project_name: str, name: str | None):
+    """Connects the container to the network of the given project, using the network index."""
+    net_name = get_network_name(project_name)
+    net_id = network_index(client).get(net_name)
+    if net_id is None:
+        # Not known (yet), let Docker resolve the name.
+        net_id = net_name
+    try:
+        _connect(client, container, net_id, name)
+    except NotFound:
+        network_index(client).invalidate()
+        _connect(client, container, net_name, name)
+
+
+def _is_riptide_network(name: str) -> bool:
+    return name.startswith(NETWORK_NAME_PREFIX) or name == HUB_NETWORK_NAME
+
+
+def _connect(client: DockerClient, container: Container, net_id: str, name: str | None):
+    try:
+        if name is not None:
+            client.api.connect_container_to_network(container.id, net_id, aliases=[name])  # type: ignore
+        else:
+            client.api.connect_container_to_network(container.id, net_id)  # type: ignore
+    except docker.errors.APIError as err:
+        if isinstance(err, NotFound):
+            raise
+        if err.status_code == 403 and err.explanation is not None and "already exists" in err.explanation:
+            # This can happen sometimes.
+            pass
+        else:
+            raise
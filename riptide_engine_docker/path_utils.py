@@ -1,20 +1,39 @@
 from __future__ import annotations
 
 import os
+import shlex
 
+from docker import DockerClient
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
 from riptide.config.document.command import Command
 from riptide.config.document.project import Project
 from riptide.config.files import path_in_project
 from riptide.engine.abstract import ExecError
+from riptide_engine_docker import host_fileops
+from riptide_engine_docker.assets import riptide_engine_docker_assets_dir
+from riptide_engine_docker.config import get_fileops_sidecar_enabled, get_image_platform, get_runner_idle_timeout
+from riptide_engine_docker.container_builder import ContainerBuilder, get_fileops_container_name
+from riptide_engine_docker.runners import (
+    EENV_RUNNER_IDLE_TIMEOUT,
+    RIPTIDE_DOCKER_LABEL_RUNNER_HASH,
+    RUNNER_CONTAINER_PATH,
+    RUNNER_SH,
+    config_hash_for,
+    ensure_running,
+)
 
 IMAGE = "alpine"
+# Where the project directory is mounted in the file operations container
+FILEOPS_PROJECT_PATH = "/project"
 # TODO: Since permissions are always mapped to user->root under Windows, there won't be permission
 #       problems under windows. We could probably just use the AbstractEngine implementation there.
 
 
 def rm(engine, path, project: Project):
     """
-    Removes path from the hosts file system using a Docker container running root.
+    Removes path from the hosts file system. Subtrees the current user may not remove are removed
+    using a Docker container running root.
     See AbstractEngine.path_rm for general usage.
     """
     # TODO: Safety checks, this function is potentially really dangerous right now
@@ -22,6 +41,43 @@ def rm(engine, path, project: Project):
         raise PermissionError(f"Tried to delete a file/directory that is not within the project: {path}")
     if not os.path.exists(path):
         return
+    if host_fileops.is_supported():
+        remaining = host_fileops.rm(path)
+        for subtree in remaining:
+            _rm_as_root(engine, subtree, project)
+        # The directories that contained these subtrees are left.
+        if not remaining or not host_fileops.rm(path):
+            return
+    _rm_as_root(engine, path, project)
+
+
+def copy(engine, fromm, to, project: Project):
+    """
+    Copy files from the hosts file system. Subtrees the current user may not copy (with their ownership)
+    are copied using a Docker container running root.
+    See AbstractEngine.path_copy for general usage.
+    """
+    if not path_in_project(to, project):
+        raise PermissionError(f"Tried to copy into a path that is not within the project: {fromm} -> {to}")
+    if not os.path.exists(fromm):
+        raise OSError(f"Tried to copy a directory/file that does not exist: {fromm}")
+    if not os.path.exists(os.path.dirname(to)):
+        raise OSError(f"Tried to copy into a path that does not exist: {to}")
+    if host_fileops.is_supported():
+        for src, dst in host_fileops.copy(fromm, to):
+            _copy_as_root(engine, src, dst, project)
+        return
+    _copy_as_root(engine, fromm, to, project)
+
+
+def _rm_as_root(engine, path, project: Project):
+    if _fileops_usable(project, path):
+        result = _fileops_run(engine.client, project, shlex.join(["rm", "-rf", "--", _fileops_path(project, path)]))
+        if result is not None:
+            (exit_code, output) = result
+            if exit_code != 0:
+                raise ExecError(f"Error removing the path ({str(exit_code)}) {path}: {output}")
+            return
     name_of_file = os.path.basename(path)
     file_dir = os.path.abspath(os.path.join(path, ".."))
     command = Command(
@@ -38,24 +94,36 @@ def rm(engine, path, project: Project):
         raise ExecError(f"Error removing the path ({str(exit_code)}) {path}: {output}")
 
 
-def copy(engine, fromm, to, project: Project):
-    """
-    Copy files from the hosts file system using a Docker container running root.
-    See AbstractEngine.path_copy for general usage.
-    """
-    if not path_in_project(to, project):
-        raise PermissionError(f"Tried to copy into a path that is not within the project: {fromm} -> {to}")
-    if not os.path.exists(fromm):
-        raise OSError(f"Tried to copy a directory/file that does not exist: {fromm}")
-    if not os.path.exists(os.path.dirname(to)):
-        raise OSError(f"Tried to copy into a path that does not exist: {to}")
+def _copy_as_root(engine, fromm, to, project: Project):
+    """Copies the directory fromm like `cp -a fromm/. to/`, or the file (or symlink, ...) fromm to to."""
+    is_dir = os.path.isdir(fromm) and not os.path.islink(fromm)
+    if _fileops_usable(project, fromm, to):
+        (src, dst) = (_fileops_path(project, fromm), _fileops_path(project, to))
+        if is_dir:
+            fileops_command = f"mkdir -p {shlex.quote(dst)} && cp -a {shlex.quote(src + '/.')} {shlex.quote(dst + '/')}"
+        else:
+            fileops_command = shlex.join(["cp", "-a", src, dst])
+        result = _fileops_run(engine.client, project, fileops_command)
+        if result is not None:
+            (exit_code, output) = result
+            if exit_code != 0:
+                raise ExecError(f"Error copying the directory ({str(exit_code)}) {fromm} -> {to}: {output}")
+            return
+    if is_dir:
+        command_str = "cp -a /copy_from/. /copy_to/"
+        (from_mount, to_mount) = (fromm, to)
+    else:
+        name_from = shlex.quote("/copy_from/" + os.path.basename(fromm))
+        name_to = shlex.quote("/copy_to/" + os.path.basename(to))
+        command_str = f"cp -a {name_from} {name_to}"
+        (from_mount, to_mount) = (os.path.dirname(fromm), os.path.dirname(to))
     command = Command(
         {
             "image": IMAGE,
-            "command": "cp -a /copy_from/. /copy_to/",
+            "command": command_str,
             "additional_volumes": {
-                "fromm": {"host": fromm, "container": "/copy_from", "mode": "ro"},
-                "to": {"host": to, "container": "/copy_to", "mode": "rw"},
+                "fromm": {"host": from_mount, "container": "/copy_from", "mode": "ro"},
+                "to": {"host": to_mount, "container": "/copy_to", "mode": "rw"},
             },
         }
     )
@@ -64,3 +132,60 @@ def copy(engine, fromm, to, project: Project):
     (exit_code, output) = engine.cmd_detached(project, command, run_as_root=True)
     if exit_code != 0:
         raise ExecError(f"Error copying the directory ({str(exit_code)}) {fromm} -> {to}: {output}")
+
+
+def _fileops_usable(project: Project, *paths: str) -> bool:
+    """Whether the file operations container of the project can be used for operations on paths."""
+    if not get_fileops_sidecar_enabled() or project.folder() is None:
+        return False
+    return all(path_in_project(os.path.abspath(path), project) for path in paths)
+
+
+def _fileops_path(project: Project, path: str) -> str:
+    """Path of the host path (within the project) in the file operations container."""
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(project.folder()))
+    return FILEOPS_PROJECT_PATH + "/" + relative.replace(os.sep, "/")
+
+
+def _fileops_run(client: DockerClient, project: Project, command: str) -> tuple[int, str] | None:
+    """
+    Runs the shell command as root in the file operations container of the project (see _fileops_container).
+    Returns the exit code and output, or None if the container could not be used.
+    """
+    try:
+        container = _fileops_container(client, project)
+        exec_id = client.api.exec_create(
+            container.id,  # type: ignore
+            [RUNNER_CONTAINER_PATH, "run", FILEOPS_PROJECT_PATH, command],
+        )["Id"]
+        output = client.api.exec_start(exec_id)
+        exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+    except APIError:
+        return None
+    return exit_code, output.decode("utf-8", "replace")
+
+
+def _fileops_container(client: DockerClient, project: Project) -> Container:
+    """
+    Returns the file operations container of the project, a long-lived root container with the project directory
+    mounted, that runs operations sent to it via exec. Like command runners (see runners.py), it runs runner.sh,
+    stops and removes itself when idle and is re-created if its configuration changes.
+    """
+    try:
+        image_id = client.api.inspect_image(IMAGE)["Id"]
+    except NotFound:
+        client.api.pull(IMAGE + ":latest", platform=get_image_platform())
+        image_id = client.api.inspect_image(IMAGE)["Id"]
+
+    builder = ContainerBuilder(IMAGE, None)
+    builder.set_name(get_fileops_container_name(project["name"]))
+    builder.set_entrypoint(RUNNER_CONTAINER_PATH)
+    builder.set_env(EENV_RUNNER_IDLE_TIMEOUT, str(get_runner_idle_timeout()))
+    builder.set_mount(os.path.join(riptide_engine_docker_assets_dir(), RUNNER_SH), RUNNER_CONTAINER_PATH, "ro")
+    builder.set_mount(os.path.abspath(project.folder()), FILEOPS_PROJECT_PATH, "rw")
+
+    create_args = builder.build_docker_api()
+    config_hash = config_hash_for(create_args, image_id)
+    create_args["labels"] = {**create_args["labels"], RIPTIDE_DOCKER_LABEL_RUNNER_HASH: config_hash}
+    create_args["auto_remove"] = True
+    return ensure_running(client, create_args, config_hash)
@@ -0,0 +1,209 @@
+"""
+Pools of pre-created containers for commands (opt-in, see config.get_pool_commands).
+
+The containers of a pool are created (but not started) in advance from the same ContainerBuilder configuration as
+a normal command container, without arguments and working directory. Their entrypoint runs a small invocation
+script instead, which is copied into the container right before it is started and contains the working directory
+and the command with its arguments. Running a command then only needs to claim a container, attach and start it.
+
+Containers are claimed by renaming them to a name naming the claiming process (see claimed_name), which the daemon
+refuses to do twice. Pools are refilled in the background while the command runs. Containers created for a different
+configuration or image are removed when refilling.
+
+Pools are shared by all processes, so their containers are not owned by the process that created them. helper_gc
+removes containers of pools that weren't used for POOL_CONTAINER_MAX_AGE seconds and claimed containers whose
+claiming process is gone.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import re
+import shlex
+import socket
+import tarfile
+import threading
+from collections.abc import Callable
+
+from docker import DockerClient
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
+from riptide_engine_docker import tty_attach
+from riptide_engine_docker.config import get_pool_size
+from riptide_engine_docker.container_builder import (
+    EENV_ORIGINAL_ENTRYPOINT,
+    RIPTIDE_DOCKER_LABEL_HELPER,
+    ContainerBuilder,
+    DockerContainerCreate,
+    get_pool_container_name,
+)
+from riptide_engine_docker.network import create_container
+from riptide_engine_docker.runners import config_hash_for, invocation_command
+
+INVOCATION_CONTAINER_PATH = "/riptide_invocation.sh"
+CLAIMED_SUFFIX = "__claimed"
+
+# Helper kind (see ContainerBuilder.set_helper) of pool containers. Unlike other helpers, they have no owner.
+HELPER_KIND_POOL = "pool"
+# Unclaimed containers older than this (in seconds) are removed by helper_gc, e.g. pools of removed projects.
+POOL_CONTAINER_MAX_AGE = 24 * 60 * 60
+RIPTIDE_DOCKER_LABEL_POOL = "riptide_pool"
+RIPTIDE_DOCKER_LABEL_POOL_HASH = "riptide_pool_hash"
+
+
+def run(
+    client: DockerClient,
+    project_name: str,
+    command_name: str,
+    builder: ContainerBuilder,
+    before_start: Callable[[Container], None],
+) -> int | None:
+    """
+    Runs the command configured in builder (like for fg.fg) interactively in a container of its pool and refills
+    the pool in the background. before_start is called with each container created for the pool (e.g. to connect
+    it to networks).
+
+    Returns the exit code of the command or None if no container could be taken from the pool. The command has not
+    run in that case.
+    """
+    create_args, config_hash = pool_create_args(client, project_name, command_name, builder)
+    container = claim(client, config_hash)
+    Refill(client, project_name, command_name, create_args, config_hash, before_start).start()
+    if container is None:
+        return None
+
+    try:
+        _put_invocation(client, container, builder)
+        sock = tty_attach.attach_and_start(client, container)
+    except APIError:
+        # e.g. a network the container was connected to was re-created in the meantime.
+        _remove(container)
+        return None
+    return tty_attach.relay_until_exit(client, container, sock)
+
+
+def pool_create_args(
+    client: DockerClient, project_name: str, command_name: str, builder: ContainerBuilder
+) -> tuple[DockerContainerCreate, str]:
+    """The arguments to create containers of the pool of the command with (without name) and the pool's hash."""
+    pool_builder = builder.clone()
+    pool_builder.set_args([])
+    pool_builder.work_dir = None
+    pool_builder.command = None
+    pool_builder.set_env(EENV_ORIGINAL_ENTRYPOINT, "sh " + INVOCATION_CONTAINER_PATH)
+
+    create_args = tty_attach.interactive_create_args(pool_builder.build_docker_api())
+    create_args.pop("name", None)
+    config_hash = config_hash_for(create_args, client.api.inspect_image(builder.image)["Id"])
+    create_args["labels"] = {
+        **create_args["labels"],
+        RIPTIDE_DOCKER_LABEL_HELPER: HELPER_KIND_POOL,
+        RIPTIDE_DOCKER_LABEL_POOL: project_name + "/" + command_name,
+        RIPTIDE_DOCKER_LABEL_POOL_HASH: config_hash,
+    }
+    return create_args, config_hash
+
+
+def claim(client: DockerClient, config_hash: str) -> Container | None:
+    """Takes a container out of the pool with the given hash, if there is one."""
+    for container in client.containers.list(
+        all=True, filters={"label": RIPTIDE_DOCKER_LABEL_POOL_HASH + "=" + config_hash, "status": "created"}
+    ):
+        if is_claimed(container.name):  # type: ignore
+            continue
+        try:
+            # Fails if another process renamed it first.
+            container.rename(claimed_name(container.name))  # type: ignore
+        except APIError:
+            continue
+        return container
+    return None
+
+
+def claimed_name(name: str) -> str:
+    """The name a container of a pool is renamed to when this process claims it, see claimer."""
+    return name + CLAIMED_SUFFIX + "__" + _name_safe(socket.gethostname()) + "__" + str(os.getpid())
+
+
+def is_claimed(name: str) -> bool:
+    return CLAIMED_SUFFIX in name
+
+
+def claimer(name: str) -> str | None:
+    """The process (see container_builder.helper_owner) that claimed the pool container with the given name."""
+    _, suffix, claimed_by = name.partition(CLAIMED_SUFFIX + "__")
+    host, _, pid = claimed_by.rpartition("__")
+    if not suffix or not host or not pid.isdigit():
+        return None
+    hostname = socket.gethostname()
+    return (hostname if host == _name_safe(hostname) else host) + ":" + pid
+
+
+def _name_safe(value: str) -> str:
+    """value with all characters not allowed in container names replaced."""
+    return re.sub(r"[^a-zA-Z0-9_.-]", "-", value)
+
+
+def invocation_script(builder: ContainerBuilder) -> str:
+    """The script run by the entrypoint of a claimed container: The invocation configured in builder."""
+    return f"cd {shlex.quote(builder.work_dir or '/')} || exit 1\nexec {invocation_command(builder)}\n"
+
+
+def _put_invocation(client: DockerClient, container: Container, builder: ContainerBuilder):
+    script = invocation_script(builder).encode()
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        info = tarfile.TarInfo(INVOCATION_CONTAINER_PATH.lstrip("/"))
+        info.size = len(script)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(script))
+    client.api.put_archive(container.id, "/", archive.getvalue())  # type: ignore
+
+
+def _remove(container: Container):
+    try:
+        container.remove(force=True)
+    except NotFound:
+        pass
+
+
+class Refill(threading.Thread):
+    """
+    Creates containers for the pool of a command until it has config.get_pool_size() unclaimed containers, and
+    removes containers of the command's pool that were created for a different configuration or image.
+    """
+
+    def __init__(
+        self,
+        client: DockerClient,
+        project_name: str,
+        command_name: str,
+        create_args: DockerContainerCreate,
+        config_hash: str,
+        before_start: Callable[[Container], None],
+    ):
+        threading.Thread.__init__(self)
+        self.client = client
+        self.project_name = project_name
+        self.command_name = command_name
+        self.create_args = create_args
+        self.config_hash = config_hash
+        self.before_start = before_start
+
+    def run(self):
+        pool_label = RIPTIDE_DOCKER_LABEL_POOL + "=" + self.project_name + "/" + self.command_name
+        try:
+            available = 0
+            for container in self.client.containers.list(all=True, filters={"label": pool_label, "status": "created"}):
+                if container.labels.get(RIPTIDE_DOCKER_LABEL_POOL_HASH) != self.config_hash:
+                    _remove(container)
+                elif not is_claimed(container.name):  # type: ignore
+                    available += 1
+            for _ in range(get_pool_size() - available):
+                name = get_pool_container_name(self.project_name, self.command_name)
+                container = create_container(self.client, {**self.create_args, "name": name})
+                self.before_start(container)
+        except APIError:
+            # The pool is only an optimization, the next run tries again.
+            pass
@@ -0,0 +1,189 @@
+"""
+Long-lived runner containers for commands (opt-in, see config.get_warm_commands).
+
+Instead of creating a new container for every invocation of a command, one runner container per project and
+command is kept running. It is built from the same ContainerBuilder configuration as a normal command container,
+but runs assets/runner.sh as its main command, which waits for invocations sent as docker exec. Runners stop
+(and are removed) by themselves when idle (see config.get_runner_idle_timeout) and are re-created when the
+configuration of the command or its image changes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections.abc import Callable, Mapping
+from time import sleep, time
+from typing import TypedDict
+
+from docker import DockerClient
+from docker.errors import APIError, NotFound
+from docker.models.containers import Container
+from riptide.engine.abstract import ExecError
+from riptide_engine_docker import timings
+from riptide_engine_docker.assets import riptide_engine_docker_assets_dir
+from riptide_engine_docker.config import get_runner_idle_timeout
+from riptide_engine_docker.container_builder import (
+    EENV_GROUP,
+    EENV_ORIGINAL_ENTRYPOINT,
+    EENV_RUN_MAIN_CMD_AS_USER,
+    EENV_USER,
+    ContainerBuilder,
+    DockerContainerCreate,
+    get_runner_container_name,
+)
+from riptide_engine_docker.network import create_container
+
+RUNNER_SH = "runner.sh"
+RUNNER_CONTAINER_PATH = "/riptide_runner.sh"
+EENV_RUNNER_IDLE_TIMEOUT = "RIPTIDE__DOCKER_RUNNER_IDLE_TIMEOUT"
+RIPTIDE_DOCKER_LABEL_RUNNER_HASH = "riptide_runner_hash"
+
+# Home directory the entrypoint sets for commands running as the normal user
+USER_HOME = "/home/riptide"
+
+# Time (in seconds) to wait for the entrypoint of a new runner to finish preparing the container
+READY_TIMEOUT = 120
+READY_POLL_INTERVAL = 0.05
+
+
+class RunnerExec(TypedDict):
+    """One invocation of a command in its runner container."""
+
+    container: str
+    cmd: list[str]
+    user: str
+    environment: dict[str, str]
+
+
+def prepare(
+    client: DockerClient,
+    project_name: str,
+    command_name: str,
+    builder: ContainerBuilder,
+    before_start: Callable[[Container], None],
+) -> RunnerExec:
+    """
+    Makes sure the runner container for the command is running, ready and up to date with the configuration
+    of builder, which must be fully configured for the invocation (like for fg.fg). The arguments and the working
+    directory of builder are not part of the runner configuration, they are sent with each invocation instead.
+
+    before_start is called with a newly created runner container before it is started (e.g. to connect it to
+    networks).
+
+    :raises: ExecError: If the runner container crashes or doesn't get ready.
+    """
+    runner_builder = builder.clone()
+    runner_builder.set_name(get_runner_container_name(project_name, command_name))
+    runner_builder.set_args([])
+    runner_builder.work_dir = None
+    runner_builder.command = None
+    runner_builder.set_env(EENV_ORIGINAL_ENTRYPOINT, RUNNER_CONTAINER_PATH)
+    runner_builder.set_env(EENV_RUNNER_IDLE_TIMEOUT, str(get_runner_idle_timeout()))
+    runner_builder.set_mount(os.path.join(riptide_engine_docker_assets_dir(), RUNNER_SH), RUNNER_CONTAINER_PATH, "ro")
+
+    create_args = runner_builder.build_docker_api()
+    config_hash = config_hash_for(create_args, client.api.inspect_image(builder.image)["Id"])
+    create_args["labels"] = {**create_args["labels"], RIPTIDE_DOCKER_LABEL_RUNNER_HASH: config_hash}
+    create_args["auto_remove"] = True
+
+    container = ensure_running(client, create_args, config_hash, before_start)
+    _wait_until_ready(client, container)
+
+    user = ""
+    environment = {}
+    if EENV_RUN_MAIN_CMD_AS_USER in builder.env:
+        user = builder.env[EENV_USER] + ":" + builder.env[EENV_GROUP]
+        environment["HOME"] = USER_HOME
+    return {
+        "container": create_args["name"],
+        "cmd": [RUNNER_CONTAINER_PATH, "run", builder.work_dir or "/", invocation_command(builder)],
+        "user": user,
+        "environment": environment,
+    }
+
+
+def ensure_running(
+    client: DockerClient,
+    create_args: DockerContainerCreate,
+    config_hash: str,
+    before_start: Callable[[Container], None] | None = None,
+) -> Container:
+    """
+    Returns the long-lived container named in create_args, if it is running and its RIPTIDE_DOCKER_LABEL_RUNNER_HASH
+    label matches config_hash. Otherwise (re-)creates and starts it from create_args, which must contain that label.
+    before_start is called with a newly created container before it is started.
+    The container may still be starting (created by a concurrent invocation), see _wait_until_ready.
+    """
+    container = _get_runner(client, create_args["name"], config_hash)
+    if container is None:
+        try:
+            container = create_container(client, create_args)
+        except APIError as err:
+            if err.status_code != 409:
+                raise
+            # Created concurrently by another invocation.
+            container = client.containers.get(create_args["name"])
+        else:
+            if before_start is not None:
+                before_start(container)
+            container.start()
+    return container
+
+
+def invocation_command(builder: ContainerBuilder) -> str:
+    """
+    The command string of the invocation configured in builder, including the original entrypoint of the image,
+    which the entrypoint of runner (and pool) containers doesn't run itself.
+    """
+    original_entrypoint = builder.env.get(EENV_ORIGINAL_ENTRYPOINT, "")
+    return (original_entrypoint + " " + builder.build_command_string()).strip()
+
+
+def config_hash_for(create_args: Mapping, image_id: str) -> str:
+    """Hash of the container configuration of a runner, runners with a different hash are re-created."""
+    config = json.dumps({**create_args, "image_id": image_id}, sort_keys=True, default=str)
+    return hashlib.sha256(config.encode()).hexdigest()
+
+
+def _get_runner(client: DockerClient, name: str, config_hash: str) -> Container | None:
+    """
+    Returns the runner container, if it is running (or just created by another invocation, which is about to start
+    it) and up to date. Outdated runners are removed.
+    """
+    try:
+        container = client.containers.get(name)
+    except NotFound:
+        return None
+    if (
+        container.status in ("created", "running")
+        and container.labels.get(RIPTIDE_DOCKER_LABEL_RUNNER_HASH) == config_hash
+    ):
+        return container
+    try:
+        container.remove(force=True)
+    except NotFound:
+        pass
+    return None
+
+
+def _wait_until_ready(client: DockerClient, container: Container):
+    """Waits until the entrypoint of the runner has prepared the container and started the runner script."""
+    deadline = time() + READY_TIMEOUT
+    while True:
+        entrypoint = timings.entrypoint_timings(client, container.name)  # type: ignore
+        if entrypoint is not None and "exec" in entrypoint:
+            return
+        try:
+            container.reload()
+            if container.status not in ("created", "running"):
+                raise ExecError(
+                    "The runner container for the command crashed: " + container.logs().decode("utf-8", "replace")
+                )
+        except NotFound:
+            # Runners are removed automatically when they stop.
+            raise ExecError("The runner container for the command crashed.")
+        if time() > deadline:
+            raise ExecError("The runner container for the command did not get ready in time.")
+        sleep(READY_POLL_INTERVAL)
@@ -1,5 +1,6 @@
 import json
 import threading
+import time
 from json import JSONDecodeError
 from time import sleep
 
@@ -10,6 +11,7 @@ from riptide.config.document.service import Service
 from riptide.engine.error import NonInteractiveCommandRunError
 from riptide.engine.results import ResultError, ResultQueue, StartStopResultStep
 from riptide.lib.cross_platform.cpuser import getgid, getuid
+from riptide_engine_docker.builder_setup import setup_from_daemon
 from riptide_engine_docker.config import get_image_platform
 from riptide_engine_docker.container_builder import (
     EENV_GROUP,
@@ -17,12 +19,14 @@ from riptide_engine_docker.container_builder import (
     EENV_ORIGINAL_ENTRYPOINT,
     EENV_RUN_MAIN_CMD_AS_USER,
     EENV_USER,
-    RIPTIDE_DOCKER_LABEL_IS_RIPTIDE,
     ContainerBuilder,
     get_network_name,
     get_service_container_name,
+    helper_labels,
 )
-from riptide_engine_docker.network import add_network_links
+from riptide_engine_docker.container_output import run_with_tails
+from riptide_engine_docker.network import add_network_links, connect, create_container
+from riptide_engine_docker.timings import daemon_timing, entrypoint_timings, format_summary, record_daemon_timing
 
 start_lock = threading.Lock()
 
@@ -81,7 +85,7 @@ def start(
         queue.put(StartStopResultStep(current_step=current_step, steps=step_count, text="Checking image... "))
         # Check if image exists
         try:
-            client.images.get(service["image"])
+            image = client.api.inspect_image(service["image"])
         except NotFound:
             try:
                 queue.put(StartStopResultStep(current_step=current_step, steps=step_count, text="Pulling image... "))
@@ -115,10 +119,13 @@ def start(
                 queue.end_with_error(ResultError("ERROR pulling image.", cause=err))
                 stop(project_name, service["$name"], client)
                 return
+            image = None
 
         # 2.5. Prepare container
         try:
-            image_config = client.api.inspect_image(service["image"])["Config"]
+            if image is None:
+                image = client.api.inspect_image(service["image"])
+            image_config = image["Config"]
             command = image_config["Cmd"] if "Cmd" in image_config else None
             if "command" in service:
                 command = service.get_command(command_group)
@@ -126,6 +133,7 @@ def start(
 
             builder.set_name(name)
             builder.init_from_service(service, image_config)
+            setup_from_daemon(client, builder, project_name, image["Id"])
             builder.set_hostname(service["$name"])
             # If src role is set, change workdir
             builder.set_workdir(service.get_working_directory())
@@ -178,20 +186,20 @@ def start(
                         {
                             # Don't use ports and labels of actual service container
                             "ports": None,
-                            "labels": {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"},
+                            "labels": helper_labels("pre_start"),
                         }
                     )
 
                     # RUN
-                    container = client.containers.create(**pre_start_config)  # type: ignore
-                    add_network_links(client, container, None, service.get_project()["links"])
-                    container.start()
-                    exit_code = container.wait()
-                    if exit_code["StatusCode"] != 0:
+                    container = create_container(client, pre_start_config)
+                    try:
+                        add_network_links(client, container, None, service.get_project()["links"], project_name)
+                        exit_code, stdout, stderr = run_with_tails(client, container)
+                    finally:
+                        container.remove(force=True)
+                    if exit_code != 0:
                         raise NonInteractiveCommandRunError(
-                            exit_code["StatusCode"],
-                            container.logs(stdout=True).decode("utf-8"),
-                            container.logs(stdout=False).decode("utf-8"),
+                            exit_code, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
                         )
 
                 except (APIError, ContainerError, NonInteractiveCommandRunError) as err:
@@ -208,13 +216,15 @@ def start(
             with start_lock:
                 builder.service_add_main_port(service)
                 # CREATE
-                container = client.containers.create(**builder.build_docker_api())  # type: ignore
+                daemon_start = time.monotonic()
+                container = create_container(client, builder.build_docker_api())
                 # Add container to link networks
-                add_network_links(client, container, service["$name"], service.get_project()["links"])
+                add_network_links(client, container, service["$name"], service.get_project()["links"], project_name)
                 # Add container to main network
-                client.networks.get(get_network_name(project_name)).connect(container, aliases=[service["$name"]])
+                connect(client, container, project_name, service["$name"])
                 # RUN
                 container.start()
+                record_daemon_timing(name, time.monotonic() - daemon_start)
         except (APIError, ContainerError) as err:
             queue.end_with_error(ResultError("ERROR starting container.", cause=err))
             return
@@ -257,7 +267,12 @@ def start(
 
         # 6. Done!
         current_step += 1
-        queue.put(StartStopResultStep(current_step=current_step, steps=step_count, text="Started!"))
+        summary = format_summary(daemon_timing(name), entrypoint_timings(client, name))
+        queue.put(
+            StartStopResultStep(
+                current_step=current_step, steps=step_count, text="Started!" + (f" ({summary})" if summary else "")
+            )
+        )
     else:
         queue.put(StartStopResultStep(current_step=2, steps=2, text="Already started!"))
     queue.end()
@@ -0,0 +1,48 @@
+# mypy: ignore-errors
+
+import threading
+import time
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from riptide_engine_docker.cmd_detached import cmd_detached_batch, get_container_name
+from riptide_engine_docker.network import network_index
+
+
+class CmdDetachedTest(unittest.TestCase):
+    def test_get_container_name_unique(self):
+        self.assertNotEqual(get_container_name("project"), get_container_name("project"))
+
+    @mock.patch("riptide_engine_docker.cmd_detached._executor", None)
+    @mock.patch("riptide_engine_docker.cmd_detached.get_detached_workers", return_value=2)
+    @mock.patch("riptide_engine_docker.cmd_detached.cmd_detached")
+    def test_batch(self, cmd_detached_mock, *args, **kwargs):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def run(client, project, command, run_as_root):
+            # Network lookups of all commands share one sync.
+            self.assertGreater(network_index(client)._batch_depth, 0)
+            with lock:
+                running.append(command)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(command)
+            return command, "output " + str(command)
+
+        cmd_detached_mock.side_effect = run
+
+        self.assertEqual(
+            [(i, "output " + str(i)) for i in range(5)], cmd_detached_batch(MagicMock(), MagicMock(), range(5))
+        )
+        self.assertEqual(2, max(max_running))
+
+    @mock.patch("riptide_engine_docker.cmd_detached._executor", None)
+    @mock.patch("riptide_engine_docker.cmd_detached.cmd_detached")
+    def test_batch_error(self, cmd_detached_mock):
+        cmd_detached_mock.side_effect = [(0, ""), ConnectionError("failed")]
+        with self.assertRaises(ConnectionError):
+            cmd_detached_batch(MagicMock(), MagicMock(), ["a", "b"])
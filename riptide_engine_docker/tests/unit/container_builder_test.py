@@ -1,30 +1,42 @@
 # mypy: ignore-errors
 
 import os
+import tempfile
 import unittest
 from unittest import mock
 from unittest.mock import MagicMock, Mock
 
 from docker.types import Mount
 from riptide.config.document import DocumentClass
+from riptide.engine.abstract import RIPTIDE_HOST_HOSTNAME
 from riptide.tests.configcrunch_test_utils import YamlConfigDocumentStub
 from riptide.tests.stubs import ProjectStub
 from riptide_engine_docker.container_builder import (
+    CHOWN_STAMP_VERSION,
     DOCKER_ENGINE_HTTP_PORT_BND_START,
+    EENV_CHOWN_STAMP_VERSION,
     EENV_COMMAND_LOG_PREFIX,
     EENV_DONT_RUN_CMD,
     EENV_GROUP,
-    EENV_HOST_SYSTEM_HOSTNAMES,
+    EENV_LOG_KEEP,
+    EENV_LOG_MAX_SIZE,
+    EENV_LOG_ROTATE,
     EENV_NAMED_VOLUMES,
     EENV_ON_LINUX,
     EENV_ORIGINAL_ENTRYPOINT,
+    EENV_OVERLAY_PERSISTENT,
     EENV_OVERLAY_TARGETS,
     EENV_RUN_MAIN_CMD_AS_USER,
     EENV_USE_RIPSU,
     EENV_USER,
+    EENV_USER_ENTRIES,
     EENV_USER_RUN,
     ENTRYPOINT_CONTAINER_PATH,
     ENTRYPOINT_SH,
+    HOST_GATEWAY,
+    HOSTS_DIR_CONTAINER_PATH,
+    LOGS_DIR_CONTAINER_PATH,
+    OVERLAY_UPPER_CONTAINER_PATH,
     RIPSU_CONTAINER_PATH,
     RIPTIDE_DOCKER_LABEL_HTTP_PORT,
     RIPTIDE_DOCKER_LABEL_IS_RIPTIDE,
@@ -32,12 +44,15 @@ from riptide_engine_docker.container_builder import (
     RIPTIDE_DOCKER_LABEL_PROJECT,
     RIPTIDE_DOCKER_LABEL_SERVICE,
     ContainerBuilder,
+    make_user_entries,
 )
+from riptide_engine_docker.named_volumes import RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER
+from riptide_engine_docker.user_entries import USER_ENTRIES_CONTAINER_PATH
 
 IMAGE_NAME = "unit/testimage"
 COMMAND = "test_command"
 EADMOCK = "__riptide_engine_docker_assets_dir"
-GET_LOCALHOSTS_HOSTS_RETURN = ["dummy1", "dummy2"]
+HOSTS_DIR_MOCK = "__riptide_docker_hosts_dir"
 
 
 class ContainerBuilderTest(unittest.TestCase):
@@ -71,8 +86,9 @@ class ContainerBuilderTest(unittest.TestCase):
         actual_cli = self.fix.build_docker_cli()
         self.assertListEqual(actual_cli, expected_cli)
 
+    @mock.patch("sys.stdout.isatty", return_value=True)
     @mock.patch("sys.stdin.isatty", return_value=True)
-    def test_tty(self, isatty_mock: Mock):
+    def test_tty(self, isatty_mock: Mock, *args, **kwargs):
         """Test when run from a TTY"""
         # Test CLI build
         expected_cli = self.expected_cli_base + [
@@ -89,6 +105,12 @@ class ContainerBuilderTest(unittest.TestCase):
 
         isatty_mock.assert_called()
 
+    @mock.patch("sys.stdout.isatty", return_value=False)
+    @mock.patch("sys.stdin.isatty", return_value=True)
+    def test_tty_output_redirected(self, *args, **kwargs):
+        """Test when run from a TTY, but with output redirected"""
+        self.assertNotIn("-t", self.fix.build_docker_cli())
+
     def test_with_custom_platform(self):
         """Test when with a custom platform"""
         expected_platform = "mygreat/platform"
@@ -362,6 +384,17 @@ class ContainerBuilderTest(unittest.TestCase):
         actual_cli = self.fix.build_docker_cli()
         self.assertListEqual(actual_cli, expected_cli)
 
+    def test_set_read_only_volumes(self):
+        self.fix.set_named_volume_mount("base", "/base")
+        self.fix.set_read_only_volumes({"base", "other"})
+        self.fix.set_named_volume_mount("other", "/other")
+        self.fix.set_named_volume_mount("name", "/name")
+
+        mounts = {mount["Target"]: mount for mount in self.fix.build_docker_api()["mounts"]}
+        self.assertTrue(mounts["/base"]["ReadOnly"])
+        self.assertTrue(mounts["/other"]["ReadOnly"])
+        self.assertFalse(mounts["/name"]["ReadOnly"])
+
     def test_set_port(self):
         self.fix.set_port(1234, 5678)
         self.fix.set_port(9876, 5432)
@@ -563,6 +596,46 @@ class ContainerBuilderTest(unittest.TestCase):
         actual_cli = self.fix.build_docker_cli()
         self.assertListEqual(actual_cli, expected_cli)
 
+    @mock.patch("platform.system", return_value="Linux")
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
+    def test_add_host_hostnames(self, *args, **kwargs):
+        self.fix.add_host_hostnames()
+        self.fix.set_host_gateway("10.11.12.1")
+
+        # Test API build
+        self.expected_api_base.update(
+            {
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: "10.11.12.1"},
+                "mounts": [
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    )
+                ],
+            },
+        )
+        actual_api = self.fix.build_docker_api()
+        self.assertDictEqual(actual_api, self.expected_api_base)
+
+        # Test CLI build
+        expected_cli = self.expected_cli_base + [
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":10.11.12.1",
+            "-e",
+            EENV_ON_LINUX + "=1",
+            "--label",
+            "riptide=1",
+            "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            IMAGE_NAME,
+            COMMAND,
+        ]
+        actual_cli = self.fix.build_docker_cli()
+        self.assertListEqual(actual_cli, expected_cli)
+
     @mock.patch("riptide_engine_docker.container_builder.riptide_engine_docker_assets_dir", return_value=EADMOCK)
     @mock.patch("platform.system", return_value="Linux")
     def test_enable_riptide_entrypoint_orig_is_list(self, sys_mock: Mock, ead_mock: Mock):
@@ -722,7 +795,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_current_user(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -775,6 +848,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(target="bind1", source="host1", type="bind", read_only=True, consistency="delegated"),
                     Mount(target="bind2", source="host2", type="bind", read_only=False, consistency="delegated"),
                     Mount(
@@ -785,6 +865,7 @@ class ContainerBuilderTest(unittest.TestCase):
                         consistency="delegated",
                     ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_COMMAND_LOG_PREFIX + "name1": "command1",
@@ -796,7 +877,6 @@ class ContainerBuilderTest(unittest.TestCase):
                     "key1": "value1",
                     "key2": "value2",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                 },
                 "labels": {
@@ -820,13 +900,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             "key1=value1",
             "-e",
             "key2=value2",
@@ -855,6 +935,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             "type=bind,dst=bind1,src=host1,ro=1",
             "--mount",
             "type=bind,dst=bind2,src=host2,ro=0",
@@ -870,7 +952,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_weird_image_arch(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -916,14 +998,21 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_USER: "9898",
                     EENV_GROUP: "8989",
                     EENV_RUN_MAIN_CMD_AS_USER: "yes",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                 },
                 "labels": {
@@ -943,13 +1032,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_USER + "=9898",
@@ -967,6 +1056,8 @@ class ContainerBuilderTest(unittest.TestCase):
             RIPTIDE_DOCKER_LABEL_MAIN + "=0",
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
+            "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
             IMAGE_NAME,
             COMMAND,
         ]
@@ -977,7 +1068,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_current_user_main_service(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1018,6 +1109,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(
                         target=RIPSU_CONTAINER_PATH,
                         source=expected_ripsu_host_path,
@@ -1026,13 +1124,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         consistency="delegated",
                     ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_USER: "9898",
                     EENV_GROUP: "8989",
                     EENV_RUN_MAIN_CMD_AS_USER: "yes",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                     EENV_USE_RIPSU: "yes",
                 },
@@ -1053,13 +1151,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_USER + "=9898",
@@ -1080,6 +1178,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             f"type=bind,dst={RIPSU_CONTAINER_PATH},src={expected_ripsu_host_path},ro=1",
             IMAGE_NAME,
             COMMAND,
@@ -1091,7 +1191,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_no_current_user_but_set(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1133,6 +1233,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(
                         target=RIPSU_CONTAINER_PATH,
                         source=expected_ripsu_host_path,
@@ -1141,6 +1248,7 @@ class ContainerBuilderTest(unittest.TestCase):
                         consistency="delegated",
                     ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_USER: "9898",
@@ -1148,7 +1256,6 @@ class ContainerBuilderTest(unittest.TestCase):
                     EENV_GROUP: "8989",
                     EENV_RUN_MAIN_CMD_AS_USER: "yes",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                     EENV_USE_RIPSU: "yes",
                 },
@@ -1169,13 +1276,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_USER + "=9898",
@@ -1198,6 +1305,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             f"type=bind,dst={RIPSU_CONTAINER_PATH},src={expected_ripsu_host_path},ro=1",
             IMAGE_NAME,
             COMMAND,
@@ -1209,7 +1318,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_no_current_user_root(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1249,14 +1358,21 @@ class ContainerBuilderTest(unittest.TestCase):
                         type="bind",
                         read_only=True,
                         consistency="delegated",
-                    )
+                    ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_USER: "9898",
                     EENV_GROUP: "8989",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                 },
                 "labels": {
@@ -1276,13 +1392,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_USER + "=9898",
@@ -1298,6 +1414,8 @@ class ContainerBuilderTest(unittest.TestCase):
             RIPTIDE_DOCKER_LABEL_MAIN + "=1",
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
+            "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
             IMAGE_NAME,
             COMMAND,
         ]
@@ -1308,7 +1426,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_no_current_user_dont_create(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1348,12 +1466,19 @@ class ContainerBuilderTest(unittest.TestCase):
                         type="bind",
                         read_only=True,
                         consistency="delegated",
-                    )
+                    ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                 },
                 "labels": {
@@ -1373,13 +1498,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "--label",
             RIPTIDE_DOCKER_LABEL_IS_RIPTIDE + "=1",
@@ -1391,6 +1516,8 @@ class ContainerBuilderTest(unittest.TestCase):
             RIPTIDE_DOCKER_LABEL_MAIN + "=1",
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
+            "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
             IMAGE_NAME,
             COMMAND,
         ]
@@ -1401,7 +1528,7 @@ class ContainerBuilderTest(unittest.TestCase):
     @mock.patch("platform.system", return_value="Linux")
     @mock.patch("riptide_engine_docker.container_builder.getuid", return_value=9898)
     @mock.patch("riptide_engine_docker.container_builder.getgid", return_value=8989)
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_service_named_volume_perf_options(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1455,6 +1582,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(
                         target="bind1",
                         source="riptide__namedvolume",
@@ -1471,13 +1605,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         consistency="delegated",
                     ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_USER: "9898",
                     EENV_GROUP: "8989",
                     EENV_RUN_MAIN_CMD_AS_USER: "yes",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                     EENV_NAMED_VOLUMES: "bind1",
                     EENV_USE_RIPSU: "yes",
@@ -1499,13 +1633,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_USER + "=9898",
@@ -1528,6 +1662,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             "type=volume,target=bind1,src=riptide__namedvolume,ro=1,volume-label=riptide=1",
             "--mount",
             "type=bind,dst=bind2,src=host2,ro=0",
@@ -1580,7 +1716,7 @@ class ContainerBuilderTest(unittest.TestCase):
 
     @mock.patch("riptide_engine_docker.container_builder.riptide_engine_docker_assets_dir", return_value=EADMOCK)
     @mock.patch("platform.system", return_value="Linux")
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_command(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1620,15 +1756,22 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(target="bind1", source="host1", type="bind", read_only=True, consistency="delegated"),
                     Mount(target="bind2", source="host2", type="bind", read_only=False, consistency="delegated"),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     "key1": "value1",
                     "key2": "value2",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "",
                 },
             }
@@ -1642,13 +1785,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             "key1=value1",
             "-e",
             "key2=value2",
@@ -1659,6 +1802,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             "type=bind,dst=bind1,src=host1,ro=1",
             "--mount",
             "type=bind,dst=bind2,src=host2,ro=0",
@@ -1670,7 +1815,7 @@ class ContainerBuilderTest(unittest.TestCase):
 
     @mock.patch("riptide_engine_docker.container_builder.riptide_engine_docker_assets_dir", return_value=EADMOCK)
     @mock.patch("platform.system", return_value="Linux")
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_command_named_volume_perf_options(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1715,6 +1860,13 @@ class ContainerBuilderTest(unittest.TestCase):
                         read_only=True,
                         consistency="delegated",
                     ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                     Mount(
                         target="bind1",
                         source="riptide__namedvolume",
@@ -1724,10 +1876,10 @@ class ContainerBuilderTest(unittest.TestCase):
                     ),
                     Mount(target="bind2", source="host2", type="bind", read_only=False, consistency="delegated"),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_NAMED_VOLUMES: "bind1",
                     EENV_OVERLAY_TARGETS: "",
                 },
@@ -1742,13 +1894,13 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=",
             "-e",
             EENV_NAMED_VOLUMES + "=" + "bind1",
@@ -1757,6 +1909,8 @@ class ContainerBuilderTest(unittest.TestCase):
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
             "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
+            "--mount",
             "type=volume,target=bind1,src=riptide__namedvolume,ro=1,volume-label=riptide=1",
             "--mount",
             "type=bind,dst=bind2,src=host2,ro=0",
@@ -1768,7 +1922,7 @@ class ContainerBuilderTest(unittest.TestCase):
 
     @mock.patch("riptide_engine_docker.container_builder.riptide_engine_docker_assets_dir", return_value=EADMOCK)
     @mock.patch("platform.system", return_value="Linux")
-    @mock.patch("riptide_engine_docker.container_builder.get_localhost_hosts", return_value=GET_LOCALHOSTS_HOSTS_RETURN)
+    @mock.patch("riptide_engine_docker.container_builder.riptide_docker_hosts_dir", return_value=HOSTS_DIR_MOCK)
     def test_init_from_command_unimportant_paths(self, *args, **kwargs):
         self.maxDiff = None
 
@@ -1814,13 +1968,21 @@ class ContainerBuilderTest(unittest.TestCase):
                         type="bind",
                         read_only=True,
                         consistency="delegated",
-                    )
+                    ),
+                    Mount(
+                        target=HOSTS_DIR_CONTAINER_PATH,
+                        source=HOSTS_DIR_MOCK,
+                        type="bind",
+                        read_only=True,
+                        consistency="delegated",
+                    ),
                 ],
+                "extra_hosts": {RIPTIDE_HOST_HOSTNAME: HOST_GATEWAY},
                 "environment": {
                     EENV_ORIGINAL_ENTRYPOINT: "",
                     EENV_ON_LINUX: "1",
-                    EENV_HOST_SYSTEM_HOSTNAMES: " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
                     EENV_OVERLAY_TARGETS: "/src/unimportant_1:/src/unimportant_2/subpath",
+                    EENV_CHOWN_STAMP_VERSION: CHOWN_STAMP_VERSION,
                 },
             }
         )
@@ -1833,18 +1995,22 @@ class ContainerBuilderTest(unittest.TestCase):
             ENTRYPOINT_CONTAINER_PATH,
             "-u",
             "0",
+            "--add-host",
+            RIPTIDE_HOST_HOSTNAME + ":" + HOST_GATEWAY,
             "-e",
             EENV_ON_LINUX + "=1",
             "-e",
             EENV_ORIGINAL_ENTRYPOINT + "=",
             "-e",
-            EENV_HOST_SYSTEM_HOSTNAMES + "=" + " ".join(GET_LOCALHOSTS_HOSTS_RETURN),
-            "-e",
             EENV_OVERLAY_TARGETS + "=/src/unimportant_1:/src/unimportant_2/subpath",
+            "-e",
+            EENV_CHOWN_STAMP_VERSION + "=" + CHOWN_STAMP_VERSION,
             "--label",
             RIPTIDE_DOCKER_LABEL_IS_RIPTIDE + "=1",
             "--mount",
             f"type=bind,dst={ENTRYPOINT_CONTAINER_PATH},src={expected_entrypoint_host_path},ro=1",
+            "--mount",
+            f"type=bind,dst={HOSTS_DIR_CONTAINER_PATH},src={HOSTS_DIR_MOCK},ro=1",
             "--cap-add=SYS_ADMIN",
             "--security-opt",
             "apparmor:unconfined",
@@ -1853,3 +2019,117 @@ class ContainerBuilderTest(unittest.TestCase):
         ]
         actual_cli = self.fix.build_docker_cli()
         self.assertListEqual(actual_cli, expected_cli)
+
+    def test_set_image_users(self):
+        self.fix.set_image_users(("root:x:0:0:root:/root:/bin/sh", "root:x:0:"))
+        self.fix.set_env(EENV_USER, "1000")
+        self.fix.set_env(EENV_GROUP, "1001")
+
+        with tempfile.TemporaryDirectory() as users_dir:
+            with mock.patch("riptide_engine_docker.user_entries.riptide_docker_users_dir", return_value=users_dir):
+                actual_api = self.fix.build_docker_api()
+                actual_cli = self.fix.build_docker_cli()
+
+            # Not in the environment, only a flag
+            self.assertDictEqual(
+                {EENV_ON_LINUX: "1", EENV_USER: "1000", EENV_GROUP: "1001", EENV_USER_ENTRIES: "1"},
+                actual_api["environment"],
+            )
+            self.assertIn(EENV_USER_ENTRIES + "=1", actual_cli)
+            [mount] = actual_api["mounts"]
+            self.assertEqual(USER_ENTRIES_CONTAINER_PATH, mount["Target"])
+            self.assertTrue(mount["ReadOnly"])
+            self.assertIn(f"type=bind,dst={USER_ENTRIES_CONTAINER_PATH},src={mount['Source']},ro=1", actual_cli)
+            with open(os.path.join(mount["Source"], "passwd")) as f:
+                self.assertEqual(
+                    "root:x:0:0:root:/root:/bin/sh\nriptide:x:1000:1001::/home/riptide:/bin/sh\n", f.read()
+                )
+            with open(os.path.join(mount["Source"], "group")) as f:
+                self.assertEqual("root:x:0:\nriptide:x:1001:\n", f.read())
+            with open(os.path.join(mount["Source"], "user")) as f:
+                self.assertEqual("riptide\n/home/riptide\n", f.read())
+
+    def test_enable_log_rotation(self):
+        self.fix.rotated_logs = {
+            "/riptide_stdout": "/project/_riptide/logs/service/stdout.log",
+            "/cmd_logs/cmd": "/project/_riptide/logs/service/cmd.log",
+        }
+        self.fix.enable_log_rotation(1024, 2)
+
+        actual_api = self.fix.build_docker_api()
+        self.assertEqual(
+            {
+                EENV_ON_LINUX: "1",
+                EENV_LOG_ROTATE: "/riptide_stdout=stdout.log:/cmd_logs/cmd=cmd.log",
+                EENV_LOG_MAX_SIZE: "1024",
+                EENV_LOG_KEEP: "2",
+            },
+            actual_api["environment"],
+        )
+        self.assertEqual(
+            [
+                Mount(
+                    target=LOGS_DIR_CONTAINER_PATH,
+                    source="/project/_riptide/logs/service",
+                    type="bind",
+                    read_only=False,
+                    consistency="delegated",
+                )
+            ],
+            actual_api["mounts"],
+        )
+
+    def test_enable_log_rotation_disabled(self):
+        self.fix.rotated_logs = {"/riptide_stdout": "/project/_riptide/logs/service/stdout.log"}
+        self.fix.enable_log_rotation(0, 2)
+        self.assertDictEqual(self.expected_api_base, self.fix.build_docker_api())
+
+    def test_set_overlay_upper_volume(self):
+        self.fix.set_overlay_upper_volume("project__service__overlay")
+
+        # Test API build
+        self.expected_api_base.update(
+            {
+                "environment": {EENV_ON_LINUX: "1", EENV_OVERLAY_PERSISTENT: "1"},
+                "mounts": [
+                    Mount(
+                        target=OVERLAY_UPPER_CONTAINER_PATH,
+                        source="riptide__project__service__overlay",
+                        type="volume",
+                        labels={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER: "1"},
+                    )
+                ],
+            }
+        )
+        self.assertDictEqual(self.expected_api_base, self.fix.build_docker_api())
+
+        # Test CLI build
+        expected_cli = self.expected_cli_base + [
+            "-e",
+            EENV_ON_LINUX + "=1",
+            "-e",
+            EENV_OVERLAY_PERSISTENT + "=1",
+            "--label",
+            "riptide=1",
+            "--mount",
+            f"type=volume,target={OVERLAY_UPPER_CONTAINER_PATH},src=riptide__project__service__overlay,ro=0,"
+            f"volume-label={RIPTIDE_DOCKER_LABEL_IS_RIPTIDE}=1,volume-label={RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER}=1",
+            IMAGE_NAME,
+            COMMAND,
+        ]
+        self.assertListEqual(expected_cli, self.fix.build_docker_cli())
+
+
+class MakeUserEntriesTest(unittest.TestCase):
+    def test_existing_user_and_group(self):
+        passwd = "root:x:0:0:root:/root:/bin/bash\nnode:x:1000:1000::/home/node:/bin/bash"
+        group = "root:x:0:\nnode:x:1000:\nwww:x:33:other"
+        self.assertEqual(
+            (passwd, "root:x:0:\nnode:x:1000:\nwww:x:33:other,node", "node", "/home/node"),
+            make_user_entries(passwd, group, "1000", "33"),
+        )
+
+    def test_existing_membership(self):
+        passwd = "node:x:1000:1000::/home/node:/bin/bash"
+        group = "www:x:33:node"
+        self.assertEqual((passwd, group, "node", "/home/node"), make_user_entries(passwd, group, "1000", "33"))
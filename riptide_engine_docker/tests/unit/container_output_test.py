@@ -0,0 +1,37 @@
+# mypy: ignore-errors
+
+import unittest
+from unittest.mock import MagicMock
+
+from riptide_engine_docker.container_output import OutputTail, run_with_tails
+
+
+class ContainerOutputTest(unittest.TestCase):
+    def test_output_tail(self):
+        tail = OutputTail(5)
+        for chunk in [b"abc", b"def", b"gh", b"ijklmn"]:
+            tail.append(chunk)
+        self.assertEqual(b"jklmn", tail.get())
+        self.assertEqual([b"ijklmn"], list(tail.chunks))
+
+        unlimited = OutputTail()
+        for chunk in [b"abc", b"def"]:
+            unlimited.append(chunk)
+        self.assertEqual(b"abcdef", unlimited.get())
+
+    def test_run_with_tails(self):
+        client = MagicMock()
+        container = MagicMock(id="container")
+        calls = []
+        container.start.side_effect = lambda: calls.append("start")
+
+        def attach(*args, **kwargs):
+            calls.append("attach")
+            return iter([(b"out1", None), (None, b"err1"), (b"out2", b"err2")])
+
+        client.api.attach.side_effect = attach
+        container.wait.return_value = {"StatusCode": 1}
+
+        self.assertEqual((1, b"t1out2", b"r1err2"), run_with_tails(client, container, 6))
+        self.assertEqual(["attach", "start"], calls)
+        client.api.attach.assert_called_once_with("container", stream=True, logs=True, demux=True)
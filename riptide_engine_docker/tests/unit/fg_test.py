@@ -0,0 +1,18 @@
+# mypy: ignore-errors
+
+import unittest
+
+from riptide_engine_docker.container_builder import ContainerBuilder
+from riptide_engine_docker.fg import run_create_args
+
+
+class FgTest(unittest.TestCase):
+    def test_run_create_args_argument_with_space(self):
+        builder = ContainerBuilder("image", ["php"])
+        builder.set_args(["a b", "c"])
+
+        create_args = run_create_args(builder)
+
+        # One string, split by the entrypoint, exactly like the Docker CLI passes it.
+        self.assertEqual(['php "a b" "c"'], create_args["command"])
+        self.assertEqual(builder.build_docker_cli()[-1], create_args["command"][0])
@@ -0,0 +1,83 @@
+# mypy: ignore-errors
+
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from riptide_engine_docker.container_builder import (
+    RIPTIDE_DOCKER_LABEL_HELPER,
+    RIPTIDE_DOCKER_LABEL_OWNER,
+    helper_owner,
+)
+from riptide_engine_docker.helper_gc import _executor, collect, collect_in_background
+from riptide_engine_docker.pool import CLAIMED_SUFFIX, HELPER_KIND_POOL, POOL_CONTAINER_MAX_AGE
+
+
+@mock.patch("socket.gethostname", return_value="host")
+class HelperGcTest(unittest.TestCase):
+    def _container(self, container_id, owner):
+        return {"Id": container_id, "Labels": {RIPTIDE_DOCKER_LABEL_OWNER: owner}}
+
+    @mock.patch("os.kill")
+    def test_collect(self, kill_mock, *args, **kwargs):
+        def kill(pid, sig):
+            if pid == 111:
+                raise ProcessLookupError()
+
+        kill_mock.side_effect = kill
+        client = MagicMock()
+        client.api.containers.return_value = [
+            self._container("exited", "host:111"),
+            self._container("running", "host:111"),
+            self._container("alive", "host:222"),
+            self._container("other_host", "other:111"),
+            self._container("own", helper_owner()),
+        ]
+
+        self.assertEqual(["exited", "running"], collect(client))
+
+        # Only the collected containers, a prune by owner would also hit containers it doesn't collect.
+        client.containers.prune.assert_not_called()
+        self.assertEqual(
+            [mock.call("exited", force=True), mock.call("running", force=True)],
+            client.api.remove_container.call_args_list,
+        )
+
+    @mock.patch("time.time", return_value=POOL_CONTAINER_MAX_AGE + 2000)
+    @mock.patch("os.kill")
+    def test_collect_pool(self, kill_mock, *args, **kwargs):
+        def kill(pid, sig):
+            if pid == 111:
+                raise ProcessLookupError()
+
+        kill_mock.side_effect = kill
+
+        def pool_container(container_id, name, state, created, owner=None):
+            labels = {RIPTIDE_DOCKER_LABEL_HELPER: HELPER_KIND_POOL}
+            if owner is not None:
+                labels[RIPTIDE_DOCKER_LABEL_OWNER] = owner
+            return {"Id": container_id, "Names": ["/" + name], "State": state, "Created": created, "Labels": labels}
+
+        client = MagicMock()
+        client.api.containers.return_value = [
+            # The process that created a container is irrelevant
+            pool_container("fresh", "pool0", "created", 2000, owner="host:111"),
+            pool_container("old", "pool1", "created", 1000),
+            pool_container("claimed_alive", "pool2" + CLAIMED_SUFFIX + "__host__222", "running", 1000),
+            pool_container("claimed_dead", "pool3" + CLAIMED_SUFFIX + "__host__111", "running", 2000),
+            pool_container("claimed_other_host", "pool4" + CLAIMED_SUFFIX + "__other__111", "running", 1000),
+        ]
+
+        self.assertEqual(["old", "claimed_dead"], collect(client))
+        client.containers.prune.assert_not_called()
+
+    def test_collect_in_background_logs_failure(self, *args, **kwargs):
+        client = MagicMock()
+        client.api.containers.side_effect = ConnectionError("daemon gone")
+        with self.assertLogs("riptide_engine_docker.helper_gc", level="DEBUG") as logs:
+            future = collect_in_background(client)
+            with self.assertRaises(ConnectionError):
+                future.result()
+            # The callback runs in the worker thread, right after the result was set.
+            _executor.submit(lambda: None).result()
+        self.assertIn("daemon gone", logs.output[0])
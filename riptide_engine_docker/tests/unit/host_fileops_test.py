@@ -0,0 +1,62 @@
+# mypy: ignore-errors
+
+import os
+import platform
+import tempfile
+import unittest
+
+from riptide_engine_docker import host_fileops
+
+OTHER_UID = 54321
+
+
+@unittest.skipUnless(platform.system() == "Linux", "Linux only")
+class HostFileopsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.src = os.path.join(self.root, "src")
+        os.makedirs(os.path.join(self.src, "dir", "sub"))
+        with open(os.path.join(self.src, "file"), "w") as f:
+            f.write("content")
+        with open(os.path.join(self.src, "dir", "sub", "nested"), "w") as f:
+            f.write("nested")
+        os.chmod(os.path.join(self.src, "file"), 0o640)
+        os.symlink("file", os.path.join(self.src, "link"))
+        os.utime(os.path.join(self.src, "dir"), (1000000000, 1000000000))
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_copy(self):
+        dst = os.path.join(self.root, "dst")
+        self.assertEqual([], host_fileops.copy(self.src, dst))
+        with open(os.path.join(dst, "file")) as f:
+            self.assertEqual("content", f.read())
+        with open(os.path.join(dst, "dir", "sub", "nested")) as f:
+            self.assertEqual("nested", f.read())
+        self.assertEqual(0o640, os.stat(os.path.join(dst, "file")).st_mode & 0o777)
+        self.assertEqual("file", os.readlink(os.path.join(dst, "link")))
+        self.assertEqual(1000000000, int(os.stat(os.path.join(dst, "dir")).st_mtime))
+
+    def test_rm(self):
+        self.assertEqual([], host_fileops.rm(self.src))
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual([], host_fileops.rm(self.src))
+
+    @unittest.skipUnless(hasattr(os, "getuid") and os.getuid() == 0, "requires changing file owners")
+    def test_not_owned(self):
+        not_owned = os.path.join(self.src, "dir", "sub")
+        os.chown(not_owned, OTHER_UID, -1)
+        dst = os.path.join(self.root, "dst")
+
+        self.assertEqual(
+            [(not_owned, os.path.join(dst, "dir", "sub"))],
+            host_fileops.copy(self.src, dst),
+        )
+        self.assertTrue(os.path.exists(os.path.join(dst, "file")))
+        self.assertFalse(os.path.exists(os.path.join(dst, "dir", "sub")))
+
+        self.assertEqual([not_owned], host_fileops.rm(self.src))
+        self.assertEqual(["sub"], os.listdir(os.path.join(self.src, "dir")))
+        self.assertFalse(os.path.exists(os.path.join(self.src, "file")))
@@ -0,0 +1,61 @@
+# mypy: ignore-errors
+
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from riptide_engine_docker import hosts_file
+from riptide_engine_docker.container_builder import HOSTS_DIR_CONTAINER_PATH
+
+
+class HostsFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.system_hosts = os.path.join(self.tmp.name, "system_hosts")
+        with open(self.system_hosts, "w") as f:
+            f.write("127.0.0.1 a\n")
+        self.client = MagicMock()
+        self.client.api.containers.return_value = [
+            {"Id": "with_hosts", "Mounts": [{"Destination": HOSTS_DIR_CONTAINER_PATH}]},
+            {"Id": "without_hosts", "Mounts": []},
+        ]
+        self.client.api.exec_create.return_value = {"Id": "exec"}
+        for patcher in [
+            mock.patch.object(hosts_file, "_last_signature", None),
+            mock.patch.object(hosts_file, "riptide_docker_hosts_dir", return_value=self.tmp.name),
+            mock.patch.object(hosts_file, "_system_hosts_path", return_value=self.system_hosts),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def _update(self):
+        hosts_file.update(self.client)
+        for thread in threading.enumerate():
+            if thread.name == "riptide_hosts_sync":
+                thread.join()
+
+    @mock.patch("riptide_engine_docker.hosts_file.get_localhost_hosts", return_value=["host.riptide.internal", "a"])
+    def test_update_only_if_changed(self, get_localhost_hosts_mock):
+        self._update()
+        with open(os.path.join(self.tmp.name, hosts_file.HOSTS_FILE_NAME)) as f:
+            self.assertEqual("host.riptide.internal a\n", f.read())
+        self.client.api.exec_create.assert_called_once()
+        self.assertEqual("with_hosts", self.client.api.exec_create.call_args[0][0])
+
+        # Neither the system hosts file nor the fragment changed: not even the hosts are collected again.
+        self._update()
+        get_localhost_hosts_mock.assert_called_once()
+
+        # Changed, but with the same result: nothing to sync.
+        with open(self.system_hosts, "a") as f:
+            f.write("10.0.0.1 b\n")
+        self._update()
+        self.assertEqual(2, get_localhost_hosts_mock.call_count)
+        self.client.api.exec_create.assert_called_once()
+        self.client.api.containers.assert_called_once()
@@ -0,0 +1,247 @@
+# mypy: ignore-errors
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import NotFound
+from riptide.engine.abstract import ExecError
+from riptide_engine_docker.container_builder import RIPTIDE_DOCKER_LABEL_IS_RIPTIDE
+from riptide_engine_docker.named_volumes import (
+    RIPTIDE_DOCKER_LABEL_VOLUME_BASE,
+    RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF,
+    VOLUME_USAGE_CACHE_TTL,
+    clone,
+    clone_bases,
+    copy,
+    create,
+    delete,
+    list_with_usage,
+    restore,
+    snapshot,
+)
+
+
+@mock.patch("riptide_engine_docker.named_volumes.exists", return_value=True)
+class CopyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.container = self.client.containers.create.return_value
+        self.container.wait.return_value = {"StatusCode": 0}
+
+    def test_target_exists(self, *args, **kwargs):
+        with self.assertRaises(FileExistsError):
+            copy(self.client, "from", "to")
+        self.client.containers.create.assert_not_called()
+
+    def test_progress(self, *args, **kwargs):
+        self.container.logs.return_value = [b"TOTAL 3 1024\n./\n./a", b"\n./b\n"]
+        progress = MagicMock()
+        copy(self.client, "from", "to", incremental=True, progress=progress)
+
+        self.assertEqual(
+            [mock.call(0, 3, 1024), mock.call(1, 3, 1024), mock.call(2, 3, 1024), mock.call(3, 3, 1024)],
+            progress.call_args_list,
+        )
+        self.assertEqual("incremental", self.client.containers.create.call_args.kwargs["command"][-1])
+        self.container.wait.assert_called_once()
+        self.container.remove.assert_called_once_with(force=True)
+
+    def test_error(self, *args, **kwargs):
+        self.container.logs.side_effect = [[], b"tar: error"]
+        self.container.wait.return_value = {"StatusCode": 1}
+        with self.assertRaisesRegex(ExecError, "tar: error"):
+            copy(self.client, "from", "to", incremental=True)
+        self.container.remove.assert_called_once_with(force=True)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.containers.create.return_value = MagicMock(id="container")
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    @mock.patch("riptide_engine_docker.named_volumes.exists", return_value=True)
+    def test_snapshot(self, *args, **kwargs):
+        self.client.api.get_archive.return_value = (iter([b"tar", b"data"]), {})
+        path = os.path.join(self.tmp_dir, "snap.tar.gz")
+        snapshot(self.client, "vol", path)
+
+        with gzip.open(path) as f:
+            self.assertEqual(b"tardata", f.read())
+        self.assertEqual(["snap.tar.gz"], os.listdir(self.tmp_dir))
+        self.client.containers.create.return_value.start.assert_not_called()
+        self.client.containers.create.return_value.remove.assert_called_once()
+
+    @mock.patch("riptide_engine_docker.named_volumes.exists", return_value=True)
+    def test_snapshot_failed(self, *args, **kwargs):
+        self.client.api.get_archive.side_effect = NotFound("gone")
+        path = os.path.join(self.tmp_dir, "snap.tar.gz")
+        with self.assertRaises(NotFound):
+            snapshot(self.client, "vol", path)
+        self.assertEqual([], os.listdir(self.tmp_dir))
+
+    @mock.patch("riptide_engine_docker.named_volumes.delete")
+    @mock.patch("riptide_engine_docker.named_volumes.create")
+    @mock.patch("riptide_engine_docker.named_volumes.exists", return_value=False)
+    def test_restore(self, exists_mock, create_mock, delete_mock):
+        path = os.path.join(self.tmp_dir, "snap.tar.gz")
+        with open(path, "wb") as f:
+            f.write(b"archive")
+        self.client.api.put_archive.side_effect = lambda cid, dst, data: data.read() == b"archive"
+
+        restore(self.client, path, "vol")
+
+        create_mock.assert_called_once_with(self.client, "vol")
+        delete_mock.assert_not_called()
+        self.assertEqual(("container", "/"), self.client.api.put_archive.call_args.args[:2])
+
+
+class CloneTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+
+    def _volume(self, name, mountpoint, labels=None, options=None):
+        return MagicMock(name=name, attrs={"Mountpoint": mountpoint, "Labels": labels, "Options": options})
+
+    @mock.patch("riptide_engine_docker.named_volumes.exists", side_effect=[True, False])
+    def test_clone(self, *args, **kwargs):
+        self.client.volumes.get.return_value = self._volume("riptide__base", "/base")
+        self.client.volumes.create.side_effect = [self._volume("u", "/upper"), self._volume("w", "/work"), None]
+
+        clone(self.client, "base", "new")
+
+        clone_call = self.client.volumes.create.call_args_list[2]
+        self.assertEqual("riptide__new", clone_call.args[0])
+        self.assertEqual("lowerdir=/base,upperdir=/upper,workdir=/work", clone_call.kwargs["driver_opts"]["o"])
+        self.assertEqual("base", clone_call.kwargs["labels"][RIPTIDE_DOCKER_LABEL_VOLUME_BASE])
+
+    @mock.patch("riptide_engine_docker.named_volumes.exists", side_effect=[True, False])
+    def test_clone_base_mounted_writable(self, *args, **kwargs):
+        base = self._volume("riptide__base", "/base")
+        base.name = "riptide__base"
+        self.client.volumes.get.return_value = base
+        self.client.api.containers.return_value = [
+            {"Names": ["/reader"], "Mounts": [{"Name": "riptide__base", "RW": False}]},
+            {"Names": ["/writer"], "Mounts": [{"Name": "riptide__base", "RW": True}]},
+        ]
+
+        with self.assertRaisesRegex(ExecError, "by the containers writer\\."):
+            clone(self.client, "base", "new")
+        self.client.volumes.create.assert_not_called()
+
+    @mock.patch("riptide_engine_docker.named_volumes.exists", side_effect=[True, False])
+    def test_clone_of_clone(self, *args, **kwargs):
+        self.client.volumes.get.return_value = self._volume(
+            "riptide__base",
+            "/base",
+            {RIPTIDE_DOCKER_LABEL_VOLUME_BASE: "orig"},
+            {"o": "lowerdir=/orig,upperdir=/base_upper,workdir=/base_work"},
+        )
+        self.client.volumes.create.side_effect = [self._volume("u", "/upper"), self._volume("w", "/work"), None]
+
+        clone(self.client, "base", "new")
+
+        self.assertEqual(
+            "lowerdir=/base_upper:/orig,upperdir=/upper,workdir=/work",
+            self.client.volumes.create.call_args_list[2].kwargs["driver_opts"]["o"],
+        )
+
+    def test_delete_with_dependents(self):
+        dependent = MagicMock()
+        dependent.name = "riptide__clone"
+        self.client.volumes.list.side_effect = lambda filters: (
+            [dependent] if filters["label"] == RIPTIDE_DOCKER_LABEL_VOLUME_BASE + "=base" else []
+        )
+        with self.assertRaises(ExecError):
+            delete(self.client, "base")
+        self.client.volumes.get.assert_not_called()
+
+        delete(self.client, "base", cascade=True)
+        self.assertEqual(
+            [mock.call("riptide__clone"), mock.call("riptide__base")], self.client.volumes.get.call_args_list
+        )
+
+    @mock.patch("time.time", return_value=1000.0)
+    def test_clone_bases_cache(self, *args, **kwargs):
+        clone_volume = self._volume("riptide__clone", "/clone", {RIPTIDE_DOCKER_LABEL_VOLUME_BASE: "base"})
+        self.client.volumes.list.return_value = [clone_volume]
+        self.assertEqual({"base"}, clone_bases(self.client))
+        self.assertEqual({"base"}, clone_bases(self.client))
+        self.client.volumes.list.assert_called_once()
+
+        # Checks before changing volumes don't use the cache.
+        self.assertEqual({"base"}, clone_bases(self.client, use_cache=False))
+        self.assertEqual(2, self.client.volumes.list.call_count)
+
+
+@mock.patch("time.time", return_value=1000.0)
+class ListWithUsageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.df.return_value = {
+            "Containers": [
+                {"Names": ["/db"], "Mounts": [{"Type": "volume", "Name": "riptide__vol"}, {"Type": "bind"}]},
+            ],
+            "Volumes": [
+                {
+                    "Name": "riptide__vol",
+                    "Labels": {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1"},
+                    "CreatedAt": "2024-01-01T00:00:00Z",
+                    "UsageData": {"Size": 1234, "RefCount": 1},
+                },
+                {
+                    "Name": "riptide__clone",
+                    "Labels": {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_VOLUME_BASE: "vol"},
+                    "CreatedAt": "2024-01-02T00:00:00Z",
+                    "UsageData": {"Size": -1, "RefCount": 0},
+                },
+                {
+                    "Name": "riptide__clone__upper",
+                    "Labels": {RIPTIDE_DOCKER_LABEL_IS_RIPTIDE: "1", RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF: "clone"},
+                },
+                {"Name": "other", "Labels": None},
+            ],
+        }
+
+    def test_list(self, *args, **kwargs):
+        self.assertEqual(
+            [
+                {
+                    "name": "vol",
+                    "size": 1234,
+                    "ref_count": 1,
+                    "containers": ["db"],
+                    "created_at": "2024-01-01T00:00:00Z",
+                    "base": None,
+                },
+                {
+                    "name": "clone",
+                    "size": -1,
+                    "ref_count": 0,
+                    "containers": [],
+                    "created_at": "2024-01-02T00:00:00Z",
+                    "base": "vol",
+                },
+            ],
+            list_with_usage(self.client),
+        )
+
+    def test_cache(self, time_mock):
+        list_with_usage(self.client)
+        list_with_usage(self.client)
+        self.client.df.assert_called_once()
+
+        time_mock.return_value = 1000.0 + VOLUME_USAGE_CACHE_TTL
+        list_with_usage(self.client)
+        self.assertEqual(2, self.client.df.call_count)
+
+        with mock.patch("riptide_engine_docker.named_volumes.exists", return_value=False):
+            create(self.client, "new")
+        list_with_usage(self.client)
+        self.assertEqual(3, self.client.df.call_count)
@@ -0,0 +1,223 @@
+# mypy: ignore-errors
+
+import threading
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import APIError, ImageNotFound, NotFound
+from riptide_engine_docker.network import (
+    NETWORK_INDEX_SYNC_INTERVAL,
+    NetworkIndex,
+    add_network_links,
+    collect_names_for_links,
+    create_container,
+    ensure,
+)
+
+
+class NetworkIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.networks.return_value = [
+            {"Name": "riptide__project1", "Id": "id1"},
+            {"Name": "riptide__project2", "Id": "id2"},
+            {"Name": "not_riptide__project3", "Id": "id3"},
+        ]
+        self.fix = NetworkIndex(self.client)
+
+    @mock.patch("time.time", return_value=1000.0)
+    def test_get_lists_once(self, *args, **kwargs):
+        self.assertEqual("id1", self.fix.get("riptide__project1"))
+        self.assertEqual("id2", self.fix.get("riptide__project2"))
+        self.assertIsNone(self.fix.get("not_riptide__project3"))
+        self.assertIsNone(self.fix.get("riptide__unknown"))
+
+        self.client.api.networks.assert_called_once()
+        self.client.events.assert_not_called()
+
+    def test_get_replays_events(self):
+        self.client.events.return_value = [
+            {"Action": "create", "Actor": {"ID": "id4", "Attributes": {"name": "riptide__project4"}}},
+            {"Action": "destroy", "Actor": {"ID": "id1", "Attributes": {"name": "riptide__project1"}}},
+            {"Action": "create", "Actor": {"ID": "id5", "Attributes": {"name": "other"}}},
+        ]
+        with mock.patch("time.time", return_value=1000.0):
+            self.assertEqual("id1", self.fix.get("riptide__project1"))
+        with mock.patch("time.time", return_value=1000.0 + NETWORK_INDEX_SYNC_INTERVAL):
+            self.assertIsNone(self.fix.get("riptide__project1"))
+            self.assertEqual("id4", self.fix.get("riptide__project4"))
+            self.assertIsNone(self.fix.get("other"))
+
+        self.client.api.networks.assert_called_once()
+        self.client.events.assert_called_once()
+        # Only past events, otherwise the daemon keeps the stream open until then.
+        self.assertEqual(int(1000.0 + NETWORK_INDEX_SYNC_INTERVAL), self.client.events.call_args.kwargs["until"])
+
+    def test_sync_doesnt_hold_lock(self):
+        lock_free = []
+
+        def try_lock():
+            if self.fix.lock.acquire(timeout=1):
+                lock_free.append(True)
+                self.fix.lock.release()
+
+        def events(**kwargs):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return []
+
+        self.client.events.side_effect = events
+        with mock.patch("time.time", return_value=1000.0):
+            self.fix.get("riptide__project1")
+        with mock.patch("time.time", return_value=1000.0 + NETWORK_INDEX_SYNC_INTERVAL):
+            self.fix.get("riptide__project1")
+        self.assertEqual([True], lock_free)
+
+    @mock.patch("time.time", return_value=1000.0)
+    def test_own_operations(self, *args, **kwargs):
+        self.fix.get("riptide__project1")
+        self.fix.on_created("riptide__new", "idnew")
+
+        self.assertEqual("idnew", self.fix.get("riptide__new"))
+        self.client.api.networks.assert_called_once()
+
+    @mock.patch("time.time", return_value=1000.0)
+    def test_collect_names_for_links(self, *args, **kwargs):
+        with mock.patch("riptide_engine_docker.network.network_index", return_value=self.fix):
+            self.assertListEqual(
+                ["riptide__project2", "riptide__project1"],
+                collect_names_for_links(self.client, ["project2", "unknown", "project1"]),
+            )
+        self.client.networks.list.assert_not_called()
+
+    def test_batch_doesnt_sync(self):
+        with mock.patch("time.time", return_value=1000.0):
+            self.fix.get("riptide__project1")
+        with mock.patch("time.time", return_value=1000.0 + NETWORK_INDEX_SYNC_INTERVAL):
+            with self.fix.batch():
+                self.fix.get("riptide__project1")
+                self.fix.get("riptide__project2")
+        self.client.events.assert_not_called()
+
+
+@mock.patch("time.time", return_value=1000.0)
+class EnsureTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.networks.return_value = [{"Name": "riptide__project1", "Id": "id1"}]
+        self.index = NetworkIndex(self.client)
+        patcher = mock.patch("riptide_engine_docker.network.network_index", return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_known(self, *args, **kwargs):
+        self.assertEqual("id1", ensure(self.client, "project1"))
+        self.assertEqual("id1", ensure(self.client, "project1"))
+        self.client.api.create_network.assert_not_called()
+        self.client.api.networks.assert_called_once()
+
+    def test_create(self, *args, **kwargs):
+        self.client.api.create_network.return_value = {"Id": "idnew"}
+        self.assertEqual("idnew", ensure(self.client, "new"))
+        self.assertEqual("idnew", ensure(self.client, "new"))
+        self.client.api.create_network.assert_called_once()
+        self.assertEqual("riptide__new", self.client.api.create_network.call_args.args[0])
+
+    def test_create_race(self, *args, **kwargs):
+        response = MagicMock(status_code=409)
+        self.client.api.create_network.side_effect = APIError("Conflict", response=response)
+        self.client.api.inspect_network.return_value = {"Id": "idother"}
+        self.assertEqual("idother", ensure(self.client, "new"))
+        self.client.api.inspect_network.assert_called_once_with("riptide__new")
+
+    def test_create_doesnt_hold_lock(self, *args, **kwargs):
+        # Lookups of other threads may sync and wait for lock, it must not be held while talking to the daemon.
+        lock_free = []
+
+        def try_lock():
+            if self.index.lock.acquire(timeout=1):
+                lock_free.append(True)
+                self.index.lock.release()
+
+        def create_network(*args, **kwargs):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return {"Id": "idnew"}
+
+        self.client.api.create_network.side_effect = create_network
+        self.assertEqual("idnew", ensure(self.client, "new"))
+        self.assertEqual([True], lock_free)
+
+
+@mock.patch("time.time", return_value=1000.0)
+class CreateContainerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.networks.side_effect = [
+            [{"Name": "riptide__project1", "Id": "id1"}],
+            [],
+        ]
+        self.client.api.create_network.return_value = {"Id": "idnew"}
+        self.index = NetworkIndex(self.client)
+        patcher = mock.patch("riptide_engine_docker.network.network_index", return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_network_removed(self, *args, **kwargs):
+        self.assertEqual("id1", ensure(self.client, "project1"))
+        response = MagicMock(status_code=404)
+        self.client.containers.create.side_effect = [
+            NotFound("Not Found", response=response, explanation="network riptide__project1 not found"),
+            "container",
+        ]
+
+        self.assertEqual("container", create_container(self.client, {"image": "image", "network": "riptide__project1"}))
+        self.client.api.create_network.assert_called_once()
+        self.assertEqual("riptide__project1", self.client.api.create_network.call_args.args[0])
+        self.assertEqual("idnew", self.index.get("riptide__project1"))
+        self.assertEqual(2, self.client.containers.create.call_count)
+
+    def test_other_not_found(self, *args, **kwargs):
+        response = MagicMock(status_code=404)
+        self.client.containers.create.side_effect = ImageNotFound(
+            "Not Found", response=response, explanation="No such image: image"
+        )
+
+        with self.assertRaises(ImageNotFound):
+            create_container(self.client, {"image": "image", "network": "riptide__project1"})
+        self.client.api.create_network.assert_not_called()
+        self.client.containers.create.assert_called_once()
+
+
+@mock.patch("time.time", return_value=1000.0)
+@mock.patch.dict("os.environ", {"RIPTIDE_DOCKER_NETWORK_MODE": "hub"})
+class HubNetworkModeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.networks.return_value = [
+            {"Name": "riptide__project1", "Id": "id1"},
+            {"Name": "riptide__project2", "Id": "id2"},
+            {"Name": "riptide_hub", "Id": "idhub"},
+        ]
+        self.index = NetworkIndex(self.client)
+        patcher = mock.patch("riptide_engine_docker.network.network_index", return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.container = MagicMock(id="container")
+
+    def test_service(self, *args, **kwargs):
+        add_network_links(self.client, self.container, "service", ["project1", "project2"], "myproject")
+        self.client.api.connect_container_to_network.assert_called_once_with(
+            "container", "idhub", aliases=["service.myproject"]
+        )
+
+    def test_unnamed_with_links(self, *args, **kwargs):
+        add_network_links(self.client, self.container, None, ["project1", "project2"], "myproject")
+        self.client.api.connect_container_to_network.assert_called_once_with("container", "idhub")
+
+    def test_unnamed_without_links(self, *args, **kwargs):
+        add_network_links(self.client, self.container, None, [], "myproject")
+        self.client.api.connect_container_to_network.assert_not_called()
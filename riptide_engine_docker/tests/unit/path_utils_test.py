@@ -0,0 +1,83 @@
+# mypy: ignore-errors
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import APIError
+from riptide.engine.abstract import ExecError
+from riptide_engine_docker.path_utils import FILEOPS_PROJECT_PATH, copy, rm
+from riptide_engine_docker.runners import RUNNER_CONTAINER_PATH
+
+
+@mock.patch("riptide_engine_docker.path_utils.host_fileops.is_supported", return_value=False)
+@mock.patch("riptide_engine_docker.path_utils.ensure_running", return_value=MagicMock(id="fileops"))
+class PathUtilsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+        os.makedirs(os.path.join(self.folder, "a", "b"))
+        os.makedirs(os.path.join(self.folder, "c"))
+        self.project = MagicMock()
+        self.project.folder.return_value = self.folder
+        self.project.__getitem__.side_effect = {"name": "project"}.__getitem__
+        self.engine = MagicMock()
+        self.engine.client.api.inspect_image.return_value = {"Id": "sha256:alpine"}
+        self.engine.client.api.exec_create.return_value = {"Id": "exec"}
+        self.engine.client.api.exec_start.return_value = b"output"
+        self.engine.client.api.exec_inspect.return_value = {"ExitCode": 0}
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def test_rm(self, ensure_running_mock, *args):
+        rm(self.engine, os.path.join(self.folder, "a", "b"), self.project)
+        self.engine.client.api.exec_create.assert_called_once_with(
+            "fileops", [RUNNER_CONTAINER_PATH, "run", FILEOPS_PROJECT_PATH, "rm -rf -- /project/a/b"]
+        )
+        self.engine.cmd_detached.assert_not_called()
+        create_args = ensure_running_mock.call_args[0][1]
+        self.assertEqual("riptide__project__fileops", create_args["name"])
+        self.assertTrue(create_args["auto_remove"])
+
+    def test_copy_error(self, ensure_running_mock, *args):
+        self.engine.client.api.exec_inspect.return_value = {"ExitCode": 1}
+        with self.assertRaises(ExecError):
+            copy(self.engine, os.path.join(self.folder, "a"), os.path.join(self.folder, "c"), self.project)
+        self.engine.client.api.exec_create.assert_called_once_with(
+            "fileops",
+            [
+                RUNNER_CONTAINER_PATH,
+                "run",
+                FILEOPS_PROJECT_PATH,
+                "mkdir -p /project/c && cp -a /project/a/. /project/c/",
+            ],
+        )
+
+    def test_fallback(self, ensure_running_mock, *args):
+        self.engine.cmd_detached.return_value = (0, "")
+        ensure_running_mock.side_effect = APIError("failed")
+        rm(self.engine, os.path.join(self.folder, "a"), self.project)
+        self.engine.cmd_detached.assert_called_once()
+
+        self.engine.cmd_detached.reset_mock()
+        with tempfile.TemporaryDirectory() as outside:
+            copy(self.engine, outside, os.path.join(self.folder, "c"), self.project)
+        self.engine.cmd_detached.assert_called_once()
+
+    @mock.patch("riptide_engine_docker.path_utils.host_fileops.copy")
+    def test_host_fileops_remaining(self, host_copy_mock, ensure_running_mock, is_supported_mock):
+        is_supported_mock.return_value = True
+        host_copy_mock.return_value = [(os.path.join(self.folder, "a", "b"), os.path.join(self.folder, "c", "b"))]
+        copy(self.engine, os.path.join(self.folder, "a"), os.path.join(self.folder, "c"), self.project)
+        self.engine.client.api.exec_create.assert_called_once_with(
+            "fileops",
+            [
+                RUNNER_CONTAINER_PATH,
+                "run",
+                FILEOPS_PROJECT_PATH,
+                "mkdir -p /project/c/b && cp -a /project/a/b/. /project/c/b/",
+            ],
+        )
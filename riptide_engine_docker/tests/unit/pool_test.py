@@ -0,0 +1,94 @@
+# mypy: ignore-errors
+
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import APIError
+from riptide_engine_docker.container_builder import (
+    EENV_ORIGINAL_ENTRYPOINT,
+    RIPTIDE_DOCKER_LABEL_HELPER,
+    RIPTIDE_DOCKER_LABEL_OWNER,
+    ContainerBuilder,
+    helper_owner,
+)
+from riptide_engine_docker.pool import (
+    CLAIMED_SUFFIX,
+    HELPER_KIND_POOL,
+    RIPTIDE_DOCKER_LABEL_POOL,
+    RIPTIDE_DOCKER_LABEL_POOL_HASH,
+    Refill,
+    claim,
+    claimed_name,
+    claimer,
+    invocation_script,
+    pool_create_args,
+)
+
+
+def _container(name, labels=None):
+    container = MagicMock(labels=labels or {})
+    container.name = name
+    return container
+
+
+class PoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.inspect_image.return_value = {"Id": "sha256:image"}
+        self.builder = ContainerBuilder("image", ["composer"])
+        self.builder.set_workdir("/src/dir with space")
+        self.builder.set_args(["install"])
+        self.builder.set_env(EENV_ORIGINAL_ENTRYPOINT, 'docker-entrypoint.sh "--flag"')
+
+    def test_pool_create_args(self):
+        create_args, config_hash = pool_create_args(self.client, "project", "composer", self.builder)
+
+        self.assertNotIn("name", create_args)
+        self.assertIsNone(create_args["command"])
+        self.assertTrue(create_args["tty"])
+        self.assertEqual("sh /riptide_invocation.sh", create_args["environment"][EENV_ORIGINAL_ENTRYPOINT])
+        self.assertEqual("project/composer", create_args["labels"][RIPTIDE_DOCKER_LABEL_POOL])
+        self.assertEqual(config_hash, create_args["labels"][RIPTIDE_DOCKER_LABEL_POOL_HASH])
+        self.assertEqual(HELPER_KIND_POOL, create_args["labels"][RIPTIDE_DOCKER_LABEL_HELPER])
+        # Shared by all processes
+        self.assertNotIn(RIPTIDE_DOCKER_LABEL_OWNER, create_args["labels"])
+
+        # Arguments and working directory are not part of the pool configuration
+        self.builder.set_args(["update"])
+        self.builder.set_workdir("/src")
+        self.assertEqual(config_hash, pool_create_args(self.client, "project", "composer", self.builder)[1])
+
+    def test_invocation_script(self):
+        self.assertEqual(
+            'cd \'/src/dir with space\' || exit 1\nexec docker-entrypoint.sh "--flag" composer "install"\n',
+            invocation_script(self.builder),
+        )
+
+    def test_claim(self):
+        taken = _container("pool1")
+        taken.rename.side_effect = APIError("already renamed")
+        free = _container("pool2")
+        self.client.containers.list.return_value = [_container("pool0" + CLAIMED_SUFFIX), taken, free]
+
+        self.assertEqual(free, claim(self.client, "hash"))
+        free.rename.assert_called_once_with(claimed_name("pool2"))
+        self.assertEqual(helper_owner(), claimer(claimed_name("pool2")))
+        self.assertIsNone(claimer("pool2"))
+        self.assertIsNone(claimer("pool2" + CLAIMED_SUFFIX))
+
+    @mock.patch("riptide_engine_docker.pool.get_pool_size", return_value=2)
+    def test_refill(self, *args, **kwargs):
+        outdated = _container("pool0", {RIPTIDE_DOCKER_LABEL_POOL_HASH: "old"})
+        current = _container("pool1", {RIPTIDE_DOCKER_LABEL_POOL_HASH: "hash"})
+        claimed = _container("pool2" + CLAIMED_SUFFIX, {RIPTIDE_DOCKER_LABEL_POOL_HASH: "hash"})
+        self.client.containers.list.return_value = [outdated, current, claimed]
+        before_start = MagicMock()
+
+        Refill(self.client, "project", "composer", {"image": "image"}, "hash", before_start).run()
+
+        outdated.remove.assert_called_once_with(force=True)
+        current.remove.assert_not_called()
+        self.client.containers.create.assert_called_once()
+        self.assertTrue(self.client.containers.create.call_args.kwargs["name"].startswith("riptide__project__pool__"))
+        before_start.assert_called_once_with(self.client.containers.create.return_value)
@@ -0,0 +1,105 @@
+# mypy: ignore-errors
+
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import NotFound
+from riptide.engine.abstract import ExecError
+from riptide_engine_docker.container_builder import (
+    EENV_GROUP,
+    EENV_ORIGINAL_ENTRYPOINT,
+    EENV_RUN_MAIN_CMD_AS_USER,
+    EENV_USER,
+    ContainerBuilder,
+)
+from riptide_engine_docker.runners import (
+    RIPTIDE_DOCKER_LABEL_RUNNER_HASH,
+    RUNNER_CONTAINER_PATH,
+    invocation_command,
+    prepare,
+)
+
+
+@mock.patch("riptide_engine_docker.timings.entrypoint_timings", return_value={"users": 0.1, "exec": 0.1})
+class RunnersTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = MagicMock()
+        self.client.api.inspect_image.return_value = {"Id": "sha256:image"}
+        self.builder = ContainerBuilder("image", "php")
+        self.builder.set_name("riptide__project__cmd__php__123")
+        self.builder.set_workdir("/src/sub")
+        self.builder.set_args(["-r", "echo 1;"])
+        self.builder.set_env(EENV_RUN_MAIN_CMD_AS_USER, "yes")
+        self.builder.set_env(EENV_USER, "1000")
+        self.builder.set_env(EENV_GROUP, "100")
+        self.before_start = MagicMock()
+
+    def test_create(self, *args, **kwargs):
+        self.client.containers.get.side_effect = NotFound("no")
+
+        runner_exec = prepare(self.client, "project", "php", self.builder, self.before_start)
+
+        create_args = self.client.containers.create.call_args.kwargs
+        self.assertEqual("riptide__project__runner__php", create_args["name"])
+        self.assertIsNone(create_args["command"])
+        self.assertNotIn("working_dir", create_args)
+        self.assertEqual(RUNNER_CONTAINER_PATH, create_args["environment"][EENV_ORIGINAL_ENTRYPOINT])
+        self.assertTrue(create_args["auto_remove"])
+        self.before_start.assert_called_once_with(self.client.containers.create.return_value)
+        self.client.containers.create.return_value.start.assert_called_once()
+        self.assertEqual(
+            {
+                "container": "riptide__project__runner__php",
+                "cmd": [RUNNER_CONTAINER_PATH, "run", "/src/sub", 'php "-r" "echo 1;"'],
+                "user": "1000:100",
+                "environment": {"HOME": "/home/riptide"},
+            },
+            runner_exec,
+        )
+
+    def test_reuse_and_recreate(self, *args, **kwargs):
+        self.client.containers.get.side_effect = NotFound("no")
+        prepare(self.client, "project", "php", self.builder, self.before_start)
+        config_hash = self.client.containers.create.call_args.kwargs["labels"][RIPTIDE_DOCKER_LABEL_RUNNER_HASH]
+
+        running = MagicMock(status="running", labels={RIPTIDE_DOCKER_LABEL_RUNNER_HASH: config_hash})
+        self.client.containers.get.side_effect = None
+        self.client.containers.get.return_value = running
+        self.builder.set_args(["other"])
+        prepare(self.client, "project", "php", self.builder, self.before_start)
+        self.assertEqual(1, self.client.containers.create.call_count)
+        running.remove.assert_not_called()
+
+        self.client.api.inspect_image.return_value = {"Id": "sha256:new_image"}
+        prepare(self.client, "project", "php", self.builder, self.before_start)
+        self.assertEqual(2, self.client.containers.create.call_count)
+        running.remove.assert_called_once_with(force=True)
+
+    def test_starting(self, *args, **kwargs):
+        self.client.containers.get.side_effect = NotFound("no")
+        prepare(self.client, "project", "php", self.builder, self.before_start)
+        config_hash = self.client.containers.create.call_args.kwargs["labels"][RIPTIDE_DOCKER_LABEL_RUNNER_HASH]
+
+        # Just created by another invocation, which starts it.
+        starting = MagicMock(status="created", labels={RIPTIDE_DOCKER_LABEL_RUNNER_HASH: config_hash})
+        self.client.containers.get.side_effect = None
+        self.client.containers.get.return_value = starting
+        prepare(self.client, "project", "php", self.builder, self.before_start)
+        self.assertEqual(1, self.client.containers.create.call_count)
+        starting.remove.assert_not_called()
+        starting.start.assert_not_called()
+
+    def test_invocation_command(self, *args, **kwargs):
+        self.builder.set_env(EENV_ORIGINAL_ENTRYPOINT, 'docker-php-entrypoint "--flag"')
+        self.assertEqual('docker-php-entrypoint "--flag" php "-r" "echo 1;"', invocation_command(self.builder))
+
+        self.builder.set_env(EENV_ORIGINAL_ENTRYPOINT, "")
+        self.assertEqual('php "-r" "echo 1;"', invocation_command(self.builder))
+
+    def test_crashed(self, timings_mock):
+        timings_mock.return_value = None
+        self.client.containers.get.side_effect = NotFound("no")
+        self.client.containers.create.return_value.reload.side_effect = NotFound("removed")
+        with self.assertRaises(ExecError):
+            prepare(self.client, "project", "php", self.builder, self.before_start)
@@ -0,0 +1,38 @@
+# mypy: ignore-errors
+
+import io
+import tarfile
+import unittest
+from unittest.mock import MagicMock
+
+from docker.errors import NotFound
+from riptide_engine_docker.timings import entrypoint_timings, format_summary
+
+
+def _archive(content: bytes) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        info = tarfile.TarInfo("riptide_timings")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+class TimingsTest(unittest.TestCase):
+    def test_entrypoint_timings(self):
+        client = MagicMock()
+        archive = _archive(b"start 100.00\nlogging 100.05\nusers 100.25\ngarbage\nexec 101.00\n")
+        client.api.get_archive.return_value = (iter([archive[:100], archive[100:]]), {})
+
+        self.assertEqual({"logging": 0.05, "users": 0.2, "exec": 0.75}, entrypoint_timings(client, "container"))
+        client.api.get_archive.assert_called_once_with("container", "/riptide_timings")
+
+    def test_entrypoint_timings_not_found(self):
+        client = MagicMock()
+        client.api.get_archive.side_effect = NotFound("gone")
+        self.assertIsNone(entrypoint_timings(client, "container"))
+
+    def test_format_summary(self):
+        self.assertEqual("Docker: 0.42s, entrypoint: 0.30s", format_summary(0.42, {"users": 0.1, "exec": 0.2}))
+        self.assertEqual("entrypoint: 0.10s", format_summary(None, {"users": 0.1}))
+        self.assertEqual("", format_summary(None, None))
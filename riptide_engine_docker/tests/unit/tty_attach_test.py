@@ -0,0 +1,69 @@
+# mypy: ignore-errors
+
+import fcntl
+import os
+import pty
+import socket
+import struct
+import termios
+import unittest
+from unittest import mock
+from unittest.mock import MagicMock
+
+from docker.errors import NotFound
+from riptide_engine_docker.tty_attach import exec_interactive, relay, run_interactive
+
+
+class TtyAttachTest(unittest.TestCase):
+    @mock.patch("riptide_engine_docker.tty_attach.relay")
+    def test_exec_interactive(self, relay_mock):
+        client = MagicMock()
+        client.api.exec_create.return_value = {"Id": "exec"}
+        client.api.exec_inspect.return_value = {"ExitCode": 3}
+
+        self.assertEqual(3, exec_interactive(client, "container", ["sh"], user="1000:1000", environment={"A": "b"}))
+
+        client.api.exec_create.assert_called_once_with(
+            "container", ["sh"], stdin=True, tty=True, user="1000:1000", environment={"A": "b"}, workdir=None
+        )
+        client.api.exec_start.assert_called_once_with("exec", tty=True, socket=True)
+        relay_mock.call_args.args[1](24, 80)
+        client.api.exec_resize.assert_called_once_with("exec", height=24, width=80)
+
+    def test_relay(self):
+        master, slave = pty.openpty()
+        self.addCleanup(os.close, master)
+        self.addCleanup(os.close, slave)
+        fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack("HHHH", 30, 100, 0, 0))
+        local, remote = socket.socketpair()
+        self.addCleanup(remote.close)
+        remote.sendall(b"hello\n")
+        remote.shutdown(socket.SHUT_WR)
+        terminal = MagicMock(**{"fileno.return_value": slave})
+        # The session may already be gone, that doesn't end the relay.
+        resize = MagicMock(side_effect=NotFound("gone"))
+
+        with mock.patch("sys.stdin", terminal), mock.patch("sys.stdout", terminal):
+            relay(local, resize)
+
+        self.assertEqual(b"hello\n", os.read(master, 100))
+        resize.assert_called_once_with(30, 100)
+        # Terminal mode is restored
+        self.assertTrue(termios.tcgetattr(slave)[3] & termios.ECHO)
+
+    @mock.patch("riptide_engine_docker.tty_attach.relay")
+    def test_run_interactive(self, relay_mock):
+        client = MagicMock()
+        container = client.containers.create.return_value
+        container.id = "container"
+        container.wait.return_value = {"StatusCode": 2}
+        calls = []
+        container.start.side_effect = lambda: calls.append("start")
+
+        self.assertEqual(2, run_interactive(client, {"image": "image"}, lambda c: calls.append(("links", c))))
+
+        client.containers.create.assert_called_once_with(image="image", tty=True, stdin_open=True, init=True)
+        self.assertEqual([("links", container), "start"], calls)
+        relay_mock.call_args.args[1](24, 80)
+        client.api.resize.assert_called_once_with("container", height=24, width=80)
+        container.remove.assert_called_once_with(force=True)
@@ -0,0 +1,71 @@
+"""
+Module for collecting the timings of the phases of container starts.
+
+The Riptide entrypoint records the end of each of its phases in TIMINGS_CONTAINER_PATH (see entrypoint.sh),
+using the system uptime as monotonic clock.
+"""
+
+import io
+import tarfile
+import threading
+
+from docker import DockerClient
+from docker.errors import APIError
+
+TIMINGS_CONTAINER_PATH = "/riptide_timings"
+
+# Time (in seconds) the Docker daemon took to create and start the last started container, by container name
+_daemon_timings: dict[str, float] = {}
+_daemon_timings_lock = threading.Lock()
+
+
+def record_daemon_timing(container_name: str, seconds: float) -> None:
+    with _daemon_timings_lock:
+        _daemon_timings[container_name] = seconds
+
+
+def daemon_timing(container_name: str) -> float | None:
+    """Time the Docker daemon took to create and start the container, if it was started by this process."""
+    with _daemon_timings_lock:
+        return _daemon_timings.get(container_name)
+
+
+def entrypoint_timings(client: DockerClient, container_name: str) -> dict[str, float] | None:
+    """
+    Returns the duration (in seconds) of each phase of the entrypoint of the container, in order.
+    The time after the "exec" phase is spent in the original entrypoint/command of the image.
+    Returns None if the container doesn't exist (or the daemon fails to provide the file)
+    or the entrypoint didn't record any timings (yet).
+    """
+    try:
+        stream, _ = client.api.get_archive(container_name, TIMINGS_CONTAINER_PATH)
+    except APIError:
+        return None
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+        member = tar.extractfile(TIMINGS_CONTAINER_PATH.lstrip("/"))
+        if member is None:
+            return None
+        content = member.read().decode()
+
+    timings = {}
+    previous = None
+    for line in content.splitlines():
+        try:
+            phase, uptime = line.split(" ")
+            now = float(uptime)
+        except ValueError:
+            continue
+        if previous is not None:
+            timings[phase] = round(now - previous, 3)
+        previous = now
+    return timings
+
+
+def format_summary(daemon: float | None, entrypoint: dict[str, float] | None) -> str:
+    """Short summary of the timings, e.g. for status messages."""
+    parts = []
+    if daemon is not None:
+        parts.append(f"Docker: {daemon:.2f}s")
+    if entrypoint:
+        parts.append(f"entrypoint: {sum(entrypoint.values()):.2f}s")
+    return ", ".join(parts)
@@ -0,0 +1,193 @@
+"""
+Interactive terminal sessions over the Docker API.
+
+Instead of spawning the docker CLI in a PTY, the stream of an exec instance or container is attached through the
+hijacked HTTP connection of the API and relayed to the terminal of this process in raw mode. Terminal resizes are
+forwarded to the daemon. Only available on POSIX systems when stdin and stdout are terminals, callers fall
+back to the docker CLI otherwise.
+"""
+
+import logging
+import os
+import platform
+import select
+import signal
+import sys
+from collections.abc import Callable
+from typing import Any
+
+from docker import DockerClient
+from docker.errors import APIError
+from docker.models.containers import Container
+from docker.utils.socket import read as socket_read
+from riptide_engine_docker.container_builder import DockerContainerCreate
+from riptide_engine_docker.network import create_container
+
+CHUNK_SIZE = 16 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def is_supported() -> bool:
+    """Whether interactive sessions can be relayed in-process (POSIX and stdin and stdout are terminals)."""
+    if platform.system().lower().startswith("win"):
+        return False
+    return sys.stdin.isatty() and sys.stdout.isatty()
+
+
+def exec_interactive(
+    client: DockerClient,
+    container_name: str,
+    cmd: list[str],
+    user: str = "",
+    environment: dict[str, str] | None = None,
+    workdir: str | None = None,
+) -> int:
+    """
+    Runs cmd in the running container with a TTY attached to the terminal of this process.
+    Returns the exit code of the command.
+
+    :raises: docker.errors.NotFound: If the container does not exist.
+    :raises: docker.errors.APIError: If the container is not running or the daemon fails otherwise.
+    """
+    exec_id = client.api.exec_create(
+        container_name,
+        cmd,
+        stdin=True,
+        tty=True,
+        user=user,
+        environment=environment,
+        workdir=workdir,
+    )["Id"]
+    sock = client.api.exec_start(exec_id, tty=True, socket=True)
+
+    def resize(height: int, width: int):
+        client.api.exec_resize(exec_id, height=height, width=width)
+
+    relay(sock, resize)
+    exit_code = client.api.exec_inspect(exec_id)["ExitCode"]
+    return exit_code if exit_code is not None else 0
+
+
+def run_interactive(
+    client: DockerClient, create_args: DockerContainerCreate, before_start: Callable[[Container], None]
+) -> int:
+    """
+    Creates a container from create_args (see ContainerBuilder.build_docker_api) with a TTY attached to the
+    terminal of this process, like "docker run --rm -it --init" would. before_start is called with the created
+    container before it is started (e.g. to connect it to networks). The container is removed afterwards.
+    Returns the exit code of the container.
+
+    :raises: docker.errors.APIError: If the daemon fails to create or start the container.
+    """
+    container = create_container(client, interactive_create_args(create_args))
+    try:
+        before_start(container)
+        sock = attach_and_start(client, container)
+    except BaseException:
+        container.remove(force=True)
+        raise
+    return relay_until_exit(client, container, sock)
+
+
+def interactive_create_args(create_args: DockerContainerCreate) -> DockerContainerCreate:
+    """create_args with the settings needed for containers run with run_interactive or attach_and_start."""
+    create_args = create_args.copy()
+    create_args.update({"tty": True, "stdin_open": True, "init": True})
+    return create_args
+
+
+def attach_and_start(client: DockerClient, container: Container) -> Any:
+    """
+    Attaches to the stdio of the created (but not started) container and starts it.
+    The container must have been created with interactive_create_args. Returns the attached socket.
+
+    :raises: docker.errors.APIError: If the daemon fails to start the container.
+    """
+    params = {"stdin": 1, "stdout": 1, "stderr": 1, "stream": 1}
+    sock = client.api.attach_socket(container.id, params=params)  # type: ignore
+    try:
+        container.start()
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def relay_until_exit(client: DockerClient, container: Container, sock: Any) -> int:
+    """
+    Relays the terminal to the socket returned by attach_and_start until the container exits,
+    then removes the container. Returns the exit code of the container.
+    """
+
+    def resize(height: int, width: int):
+        client.api.resize(container.id, height=height, width=width)  # type: ignore
+
+    try:
+        relay(sock, resize)
+        return container.wait()["StatusCode"]
+    finally:
+        container.remove(force=True)
+
+
+def relay(sock: Any, resize: Callable[[int, int], None]) -> None:
+    """
+    Relays the terminal of this process to the hijacked socket sock (and back) in raw mode, until the remote
+    end closes the connection. resize(height, width) is called initially and whenever the terminal is resized.
+    """
+    import termios
+    import tty
+
+    stdin_fd = sys.stdin.fileno()
+    stdout_fd = sys.stdout.fileno()
+    sys.stdout.flush()
+
+    def on_resize(*args):
+        size = os.get_terminal_size(stdout_fd)
+        try:
+            resize(size.lines, size.columns)
+        except APIError as err:
+            # The session may already be gone (NotFound).
+            logger.debug("Resizing the terminal of the session failed: %s", err)
+
+    old_attrs = termios.tcgetattr(stdin_fd)
+    try:
+        old_handler = signal.signal(signal.SIGWINCH, on_resize)
+    except ValueError:
+        # Not the main thread, resizes are not forwarded.
+        old_handler = None
+    try:
+        tty.setraw(stdin_fd)
+        on_resize()
+        stdin_open = True
+        while True:
+            readable, _, _ = select.select([sock, stdin_fd] if stdin_open else [sock], [], [])
+            if sock in readable:
+                data = socket_read(sock, CHUNK_SIZE)
+                if not data:
+                    break
+                _write_all(stdout_fd, data)
+            if stdin_fd in readable:
+                data = os.read(stdin_fd, CHUNK_SIZE)
+                if data:
+                    _send_all(sock, data)
+                else:
+                    stdin_open = False
+    finally:
+        if old_handler is not None:
+            signal.signal(signal.SIGWINCH, old_handler)
+        termios.tcsetattr(stdin_fd, termios.TCSADRAIN, old_attrs)
+        sock.close()
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def _send_all(sock: Any, data: bytes) -> None:
+    # Unix socket connections are wrapped in a SocketIO, TCP/TLS and SSH connections are sockets (or channels).
+    if hasattr(sock, "_sock"):
+        sock._sock.sendall(data)
+    else:
+        sock.sendall(data)
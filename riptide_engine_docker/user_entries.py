@@ -0,0 +1,56 @@
+"""
+Module for the user and group entries generated by the engine (see ContainerBuilder.set_image_users).
+
+The entries are written to a directory on the host named after their content, which is mounted read-only into the
+container and read by the entrypoint. Passing them as environment variables instead would make them visible in
+docker inspect and in the environment of every exec session.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+from riptide.config.files import riptide_config_dir
+
+USER_ENTRIES_CONTAINER_PATH = "/riptide_users"
+PASSWD_FILE_NAME = "passwd"
+GROUP_FILE_NAME = "group"
+# Name and home directory of the user, one per line
+USER_FILE_NAME = "user"
+
+
+def riptide_docker_users_dir() -> str:
+    """Host path of the directory containing the directories of generated user entries."""
+    return os.path.join(riptide_config_dir(), "docker_users")
+
+
+def write(passwd: str, group: str, username: str, home: str) -> str:
+    """
+    Writes the entries (see container_builder.make_user_entries), if not already done,
+    and returns the host path of the directory containing them.
+    """
+    files = {
+        PASSWD_FILE_NAME: passwd + "\n",
+        GROUP_FILE_NAME: group + "\n",
+        USER_FILE_NAME: username + "\n" + home + "\n",
+    }
+    digest = hashlib.sha256("\0".join(files.values()).encode("utf-8")).hexdigest()[:16]
+    users_dir = riptide_docker_users_dir()
+    path = os.path.join(users_dir, digest)
+    if os.path.isdir(path):
+        return path
+
+    os.makedirs(users_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=users_dir, prefix="." + digest)
+    for name, content in files.items():
+        with open(os.path.join(tmp_path, name), "w") as f:
+            f.write(content)
+        os.chmod(os.path.join(tmp_path, name), 0o644)
+    os.chmod(tmp_path, 0o755)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # Written by someone else in the meantime.
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return path
@@ -0,0 +1,14 @@
+"""Names and labels of the Docker named volumes managed by Riptide (see named_volumes)."""
+
+NAMED_VOLUME_INTERNAL_PREFIX = "riptide__"
+# Label of clones (see named_volumes.clone), contains the name of the volume the clone is based on
+RIPTIDE_DOCKER_LABEL_VOLUME_BASE = "riptide_volume_base"
+# Label of the internal upper/work layer volumes of a clone, contains the name of the clone
+RIPTIDE_DOCKER_LABEL_VOLUME_LAYER_OF = "riptide_volume_layer_of"
+# Label of the volumes storing the overlay upper layers of services (see overlay_upper_volume_name)
+RIPTIDE_DOCKER_LABEL_OVERLAY_UPPER = "riptide_overlay_upper"
+
+
+def overlay_upper_volume_name(project_name: str, service_name: str) -> str:
+    """Name of the named volume storing the overlay upper layer for the unimportant paths of a service."""
+    return f"{project_name}__{service_name}__overlay"